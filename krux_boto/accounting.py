@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from collections import namedtuple
+from functools import partial, wraps
+import threading
+import time
+
+#
+# Third party libraries
+#
+
+#
+# Internal libraries
+#
+
+from krux.logging import get_logger
+
+# Constants
+_START_TIME_KEY = 'krux_boto_accounting_start_time'
+_OPERATION_KEY = 'krux_boto_accounting_operation'
+
+OperationCalls = namedtuple('OperationCalls', [
+    'service', 'operation', 'calls', 'retries', 'errors', 'latency', 'max_latency',
+])
+
+
+class _Counts(object):
+    __slots__ = ('calls', 'retries', 'errors', 'latency', 'max_latency')
+
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.errors = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+
+
+class CallAccounting(object):
+    """
+    Counts the AWS calls made per service and operation, with their retries, errors and cumulative latency,
+    so code paths making too many calls are easy to find.
+
+    Calls of boto3 clients are counted once however many times they were retried; their retries are the ones
+    botocore reports. boto2 does not report its retries, so only its calls and errors are counted.
+    """
+
+    def __init__(self, logger=None):
+        """
+        :param logger: Logger, recommended to be obtained using krux.cli.Application
+        :type logger: logging.Logger
+        """
+        self._logger = logger or get_logger('krux_boto')
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def record(self, service, operation, latency, retries=0, error=False):
+        """
+        Counts a call.
+
+        :param service: Name of the service, i.e. 's3'
+        :type service: str
+        :param operation: Name of the operation, i.e. 'ListObjectsV2'
+        :type operation: str
+        :param latency: Seconds the call took, retries included
+        :type latency: float
+        :param retries: Number of times the call was retried
+        :type retries: int
+        :param error: Whether the call failed
+        :type error: bool
+        """
+        key = (service, operation)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = _Counts()
+            counts.calls += 1
+            counts.retries += retries
+            counts.errors += 1 if error else 0
+            counts.latency += latency
+            counts.max_latency = max(counts.max_latency, latency)
+
+    def register(self, client):
+        """
+        Counts the calls of a boto3 client.
+
+        :param client: The client
+        :type client: botocore.client.BaseClient
+        """
+        service = client.meta.service_model.service_name
+        client.meta.events.register_first('before-call.*.*', self._before_call)
+        client.meta.events.register('after-call.*.*', partial(self._after_call, service))
+        client.meta.events.register('after-call-error.*.*', partial(self._after_call_error, service))
+
+    def register_boto2(self, connection, service):
+        """
+        Counts the calls of a boto2 connection.
+
+        :param connection: The connection
+        :type connection: boto.connection.AWSAuthConnection
+        :param service: Name of the service, i.e. 's3'
+        :type service: str
+        """
+        make_request = connection.make_request
+
+        @wraps(make_request)
+        def counted(*args, **kwargs):
+            # i.e. the action of query connections ('DescribeInstances'), or the HTTP method of S3 ('GET')
+            operation = args[0] if args else kwargs.get('action', kwargs.get('method'))
+            start_time = time.time()
+            try:
+                response = make_request(*args, **kwargs)
+            except Exception:
+                self.record(service, operation, time.time() - start_time, error=True)
+                raise
+            self.record(service, operation, time.time() - start_time, error=getattr(response, 'status', 200) >= 300)
+            return response
+
+        connection.make_request = counted
+
+    def _before_call(self, model, context, **kwargs):
+        context[_START_TIME_KEY] = time.time()
+        context[_OPERATION_KEY] = model.name
+
+    def _after_call(self, service, http_response, parsed, model, context, **kwargs):
+        start_time = context.get(_START_TIME_KEY)
+        if start_time is None:
+            return
+        retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+        self.record(
+            service, model.name, time.time() - start_time, retries=retries, error=http_response.status_code >= 300,
+        )
+
+    def _after_call_error(self, service, context, **kwargs):
+        start_time = context.get(_START_TIME_KEY)
+        if start_time is None:
+            return
+        self.record(service, context[_OPERATION_KEY], time.time() - start_time, error=True)
+
+    def snapshot(self):
+        """
+        :return: The calls counted so far per service and operation, the most frequent first.
+                 Latencies are in seconds.
+        :rtype: list[krux_boto.accounting.OperationCalls]
+        """
+        with self._lock:
+            operations = [
+                OperationCalls(
+                    service=service,
+                    operation=operation,
+                    calls=counts.calls,
+                    retries=counts.retries,
+                    errors=counts.errors,
+                    latency=counts.latency,
+                    max_latency=counts.max_latency,
+                )
+                for (service, operation), counts in self._counts.items()
+            ]
+        return sorted(operations, key=lambda operation: (-operation.calls, operation.service, operation.operation))
+
+    def reset(self):
+        """
+        Forgets the calls counted so far.
+        """
+        with self._lock:
+            self._counts = {}
+
+    def log_summary(self, logger=None):
+        """
+        Logs a table of the calls counted so far, at the info level.
+
+        :param logger: Logger to log to. Defaults to the one of this object.
+        :type logger: logging.Logger
+        """
+        logger = logger or self._logger
+        operations = self.snapshot()
+        if not operations:
+            return
+
+        logger.info(
+            'AWS calls: %d, retries: %d, errors: %d',
+            sum(op.calls for op in operations), sum(op.retries for op in operations),
+            sum(op.errors for op in operations),
+        )
+        logger.info(
+            '%-16s %-32s %8s %8s %8s %12s %10s %10s',
+            'Service', 'Operation', 'Calls', 'Retries', 'Errors', 'Total (ms)', 'Avg (ms)', 'Max (ms)',
+        )
+        for op in operations:
+            logger.info(
+                '%-16s %-32s %8d %8d %8d %12.1f %10.1f %10.1f',
+                op.service, op.operation, op.calls, op.retries, op.errors,
+                op.latency * 1000, op.latency * 1000 / op.calls, op.max_latency * 1000,
+            )
@@ -7,13 +7,21 @@
 # Standard libraries
 #
 
-from functools import wraps
+from functools import wraps, partial
 
 # Declare the baseboto class a metaclass to avoid
 # it being used directly
 from abc import ABCMeta, abstractmethod
 
+from argparse import ArgumentTypeError
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
 import os
+import sys
+import threading
+import time
+from types import ModuleType
+import weakref
 
 #
 # Third party libraries
@@ -23,14 +31,18 @@ import os
 # http://boto3.readthedocs.org/en/latest/guide/migration.html
 
 # Version2
-import boto
-import boto.ec2
-import boto.utils
+# GOTCHA: boto2 is imported by Boto.__init__() rather than here, so applications that
+#         only use boto3 never pay for importing it.
 
 # Version3
 import boto3
+import botocore.loaders
+import botocore.session
+from botocore.awsrequest import AWSRequest
+from botocore.config import Config
 
 from six import iteritems
+from six.moves.urllib.parse import urlparse
 
 #
 # Internal libraries
@@ -40,6 +52,25 @@ from krux.logging import get_logger, LEVELS, DEFAULT_LOG_LEVEL
 from krux.stats import get_stats
 from krux.cli import get_parser, get_group
 from krux_boto.util import RegionCode
+from krux_boto.latency import get_nearest_region
+from krux_boto.accounting import CallAccounting
+from krux_boto.cassette import Cassette, RECORD, REPLAY
+from krux_boto.breaker import CircuitBreaker, DEFAULT_FAILURE_THRESHOLD, DEFAULT_RESET_TIMEOUT, DEFAULT_SLOW_CALL_THRESHOLD
+from krux_boto.deadline import register_deadline
+from krux_boto.deadline import deadline as _deadline
+from krux_boto.ec2 import EC2Inventory
+from krux_boto.hedge import HedgedClient, DEFAULT_HEDGED_OPERATIONS, DEFAULT_MAX_EXTRA_LOAD, DEFAULT_HEDGE_WORKERS
+from krux_boto.dynamodb import DynamoDBParallelScan, DEFAULT_TOTAL_SEGMENTS
+from krux_boto.s3 import S3Downloader, S3MultipartWriter, DEFAULT_PART_SIZE, DEFAULT_MAX_WORKERS, DEFAULT_MAX_IN_FLIGHT
+from krux_boto.s3 import (
+    S3BulkDeleter, S3BulkCopier, iter_s3_keys, MAX_DELETE_BATCH_SIZE, DEFAULT_COPY_BATCH_SIZE, DEFAULT_BULK_RETRIES,
+    DEFAULT_PROGRESS_INTERVAL,
+)
+from krux_boto.s3 import S3MultipartCopier, DEFAULT_COPY_PART_SIZE, DEFAULT_MULTIPART_COPY_THRESHOLD
+from krux_boto.s3 import BucketRegionCache, DEFAULT_BUCKET_REGION_TTL, iter_s3_objects
+from krux_boto.records import RecordSchema, S3_OBJECT
+from krux_boto.sqs import SQSConsumer, DEFAULT_RECEIVERS, DEFAULT_WORKERS, DEFAULT_WAIT_TIME, DEFAULT_VISIBILITY_TIMEOUT
+from krux_boto.stats import CloudWatchStatsClient, DEFAULT_FLUSH_INTERVAL, DEFAULT_MAX_METRICS
 
 
 # Constants
@@ -47,6 +78,8 @@ ACCESS_KEY = 'AWS_ACCESS_KEY_ID'
 SECRET_KEY = 'AWS_SECRET_ACCESS_KEY'
 REGION = 'AWS_DEFAULT_REGION'
 NAME = 'krux-boto'
+# Pass this as the region to use the region with the lowest latency from here
+AUTO_REGION = 'auto'
 
 # GOTCHA: This is not meant to be imported by another library. Thus, prefix with double underscore.
 __DEFAULT_REGION = 'us-east-1'
@@ -66,23 +99,51 @@ DEFAULT = {
 }
 
 
-def __get_arguments(args=None, logger=None, stats=None):
+# Shared objects returned by get_boto() and get_boto3(), keyed by class and effective settings
+_instances = {}
+# Arguments parsed from the command line when get_boto() or get_boto3() is called without them
+_default_args = {}
+# GOTCHA: Reentrant, in case constructing an object ends up calling get_boto*() again
+_instances_lock = threading.RLock()
+
+
+# Names of the regions accepted by --boto-region, see __get_region_choices()
+_region_choices = None
+
+
+def __get_region_choices():
     """
-    A helper method that generates a dictionary of arguments needed to instantiate a BaseBoto object.
-    The purpose of this method is to abstract out the code to handle optional CLI arguments
-    and not duplicate the None handling code.
+    A helper method that returns the names of all EC2 regions known to botocore, across all partitions.
+    The list is built from botocore's bundled endpoint data on the first call and cached.
 
-    :param args: Namespace of arguments parsed by argparse
-    :type args: argparse.Namespace
-    :param logger: Logger, recommended to be obtained using krux.cli.Application
-    :type logger: logging.Logger
-    :param stats: Stats, recommended to be obtained using krux.cli.Application
-    :type stats: kruxstatsd.StatsClient
-    :return: A dictionary of arguments needed for BaseBoto.__init__()
-    :rtype: dict
+    :return: Sorted list of region names
+    :rtype: list[str]
     """
+    global _region_choices
 
-    if not args:
+    if _region_choices is None:
+        session = botocore.session.get_session()
+        regions = set()
+        for partition in session.get_available_partitions():
+            regions.update(session.get_available_regions('ec2', partition_name=partition))
+        _region_choices = sorted(regions)
+
+    return _region_choices
+
+
+def __get_default_args():
+    """
+    A helper method that parses the arguments added by add_boto_cli_arguments() from the command line.
+    The result is cached, so the parser is only built once for a given command line and environment.
+
+    :return: Namespace of the parsed arguments
+    :rtype: argparse.Namespace
+    """
+    # GOTCHA: The defaults of the arguments come from the environment, so a change there must invalidate the cache.
+    key = (tuple(sys.argv), os.environ.get(ACCESS_KEY), os.environ.get(SECRET_KEY), os.environ.get(REGION))
+
+    args = _default_args.get(key)
+    if args is None:
         parser = get_parser()
         add_boto_cli_arguments(parser)
         # Parse only the known arguments added by add_boto_cli_arguments().
@@ -90,23 +151,78 @@ def __get_arguments(args=None, logger=None, stats=None):
         # parse_known_args() return (Namespace, list of unknown arguments),
         # we only care about the Namespace object here.
         args = parser.parse_known_args()[0]
+        _default_args[key] = args
 
-    if not logger:
-        logger = get_logger(name=NAME)
+    return args
 
-    if not stats:
-        stats = get_stats(prefix=NAME)
+
+def __get_settings(args=None):
+    """
+    A helper method that generates a dictionary of the settings needed to instantiate a BaseBoto object.
+    The purpose of this method is to abstract out the code to handle optional CLI arguments
+    and not duplicate the None handling code.
+
+    :param args: Namespace of arguments parsed by argparse
+    :type args: argparse.Namespace
+    :return: A dictionary of settings for BaseBoto.__init__(), excluding the logger and the stats
+    :rtype: dict
+    """
+    if not args:
+        args = __get_default_args()
 
     return {
         'log_level': getattr(args, 'boto_log_level', DEFAULT['log_level']()),
         'access_key': getattr(args, 'boto_access_key', DEFAULT['access_key']()),
         'secret_key': getattr(args, 'boto_secret_key', DEFAULT['secret_key']()),
         'region': getattr(args, 'boto_region', DEFAULT['region']()),
-        'logger': logger,
-        'stats': stats,
+        'endpoint_url': getattr(args, 'boto_endpoint_url', None),
+        # GOTCHA: argparse gives a list, but the settings are part of a cache key and must be hashable
+        'endpoints': tuple(getattr(args, 'boto_endpoint', None) or ()) or None,
     }
 
 
+def __get_instance(cls, settings, logger=None, stats=None):
+    """
+    A helper method that returns the shared instance of cls for the settings, creating it if needed.
+
+    :param cls: Class to instantiate
+    :type cls: type
+    :param settings: Keyword arguments for the constructor, as returned by __get_settings(). The values must be hashable.
+    :type settings: dict
+    :param logger: Logger, used only if the instance needs to be created
+    :type logger: logging.Logger
+    :param stats: Stats, used only if the instance needs to be created
+    :type stats: kruxstatsd.StatsClient
+    :return: The shared instance
+    :rtype: krux_boto.boto.BaseBoto
+    """
+    key = (cls, tuple(sorted(iteritems(settings))))
+
+    with _instances_lock:
+        instance = _instances.get(key)
+
+        if instance is None:
+            if not logger:
+                logger = get_logger(name=NAME)
+
+            if not stats:
+                stats = get_stats(prefix=NAME)
+
+            instance = cls(logger=logger, stats=stats, **settings)
+            _instances[key] = instance
+
+    return instance
+
+
+def reset_boto_instances():
+    """
+    Forgets the shared objects returned by get_boto() and get_boto3(), so the next calls create new ones.
+    """
+    with _instances_lock:
+        _instances.clear()
+        _default_args.clear()
+
+
 def get_boto(args=None, logger=None, stats=None):
     """
     Return a usable Boto object without creating a class around it.
@@ -115,6 +231,10 @@ def get_boto(args=None, logger=None, stats=None):
     and 'stats' objects should already be present. If you don't have them,
     however, we'll attempt to provide usable ones for the boto setup.
 
+    Calls with the same effective settings (log level, credentials, region) return
+    the same object, so this is cheap to call repeatedly. The logger and the stats
+    are only used when the object is first created. See reset_boto_instances().
+
     (If you omit the add_boto_cli_arguments() call during other cli setup,
     the Boto object will still work, but its cli options won't show up in
     --help output)
@@ -128,7 +248,7 @@ def get_boto(args=None, logger=None, stats=None):
     :return: Boto object created with the arguments, logger, and stats created or deduced
     :rtype: krux_boto.boto.Boto
     """
-    return Boto(**__get_arguments(args, logger, stats))
+    return __get_instance(Boto, __get_settings(args), logger, stats)
 
 
 def get_boto3(args=None, logger=None, stats=None):
@@ -139,6 +259,10 @@ def get_boto3(args=None, logger=None, stats=None):
     and 'stats' objects should already be present. If you don't have them,
     however, we'll attempt to provide usable ones for the boto setup.
 
+    Calls with the same effective settings (log level, credentials, region) return
+    the same object, so this is cheap to call repeatedly. The logger and the stats
+    are only used when the object is first created. See reset_boto_instances().
+
     (If you omit the add_boto_cli_arguments() call during other cli setup,
     the Boto object will still work, but its cli options won't show up in
     --help output)
@@ -152,11 +276,41 @@ def get_boto3(args=None, logger=None, stats=None):
     :return: Boto3 object created with the arguments, logger, and stats created or deduced
     :rtype: krux_boto.boto.Boto3
     """
-    return Boto3(**__get_arguments(args, logger, stats))
+    if not args:
+        args = __get_default_args()
+
+    settings = __get_settings(args)
+    settings['prewarm'] = getattr(args, 'boto_prewarm', None)
+
+    return __get_instance(Boto3, settings, logger, stats)
+
+
+def _comma_separated(value):
+    """
+    argparse type for a comma separated list. Returns a tuple so the value can be part of a cache key.
+    """
+    return tuple(item.strip() for item in value.split(',') if item.strip())
+
+
+def _endpoint_override(value):
+    """
+    argparse type for a SERVICE=URL pair. Returns a (service, url) tuple.
+    """
+    service, separator, url = value.partition('=')
+    if not separator or not service.strip() or not url.strip():
+        raise ArgumentTypeError("expected SERVICE=URL, got '{0}'".format(value))
+    return service.strip(), url.strip()
 
 
 # Designed to be called from krux.cli, or programs inheriting from it
-def add_boto_cli_arguments(parser, include_log_level=True, include_credentials=True, include_region=True):
+def add_boto_cli_arguments(
+    parser,
+    include_log_level=True,
+    include_credentials=True,
+    include_region=True,
+    include_prewarm=True,
+    include_endpoints=True,
+):
 
     group = get_group(parser, 'boto')
 
@@ -185,9 +339,42 @@ def add_boto_cli_arguments(parser, include_log_level=True, include_credentials=T
         group.add_argument(
             '--boto-region',
             default=DEFAULT['region'](),
-            choices=[r.name for r in boto.ec2.regions()],
+            choices=__get_region_choices() + [AUTO_REGION],
+            help=(
+                "EC2 Region to connect to. Defaults to ENV[{0}]. If not ENV set, defaults to us-east-1. "
+                "Use '{1}' for the region with the lowest latency from here.".format(REGION, AUTO_REGION)
+            ),
+        )
+
+    if include_prewarm:
+        group.add_argument(
+            '--boto-prewarm',
+            type=_comma_separated,
+            default=None,
+            metavar='SERVICE[,SERVICE...]',
+            help=(
+                "Comma separated list of services, i.e. ec2,s3,sqs. Their boto3 clients are created "
+                "and connected in the background at start up, ahead of the first call."
+            ),
+        )
+
+    if include_endpoints:
+        group.add_argument(
+            '--boto-endpoint-url',
+            default=None,
+            metavar='URL',
+            help="Endpoint URL to use for every service instead of AWS, i.e. a local stand-in like moto server.",
+        )
+
+        group.add_argument(
+            '--boto-endpoint',
+            type=_endpoint_override,
+            action='append',
+            default=None,
+            metavar='SERVICE=URL',
             help=(
-                "EC2 Region to connect to. Defaults to ENV[{0}]. If not ENV set, defaults to us-east-1.".format(REGION)
+                "Endpoint URL to use for a service instead of AWS, i.e. s3=http://localhost:9000. "
+                "Takes precedence over --boto-endpoint-url. May be given several times."
             ),
         )
 
@@ -203,11 +390,15 @@ class BaseBoto(metaclass=ABCMeta):
         region=None,
         logger=None,
         stats=None,
+        endpoint_url=None,
+        endpoints=None,
     ):
         # Private variables, not to be used outside this module
         self._name = NAME
         self._logger = logger or get_logger(self._name)
         self._stats = stats or get_stats(prefix=self._name)
+        # AWS calls made through this object, per service and operation
+        self._accounting = CallAccounting(logger=self._logger)
 
         if log_level is None:
             log_level = DEFAULT['log_level']()
@@ -226,6 +417,10 @@ class BaseBoto(metaclass=ABCMeta):
                 "There is not a default region set in your environment variables. Defaulted to '%s'", region
             )
 
+        if region == AUTO_REGION:
+            region = get_nearest_region()
+            self._logger.info("Using the nearest region '%s'", region)
+
         # GOTCHA: Due to backward incompatible version change in v1.0.0, the users of krux_boto may
         # pass wrong credential. Make sure the passed credential via CLI is the same as one passed into this instance.
         parser = get_parser()
@@ -250,6 +445,7 @@ class BaseBoto(metaclass=ABCMeta):
 
         # Infer the loglevel, but set it as a property so the subclasses can
         # use it to set the loglevels on the loghandlers for their implementation
+        self._log_level = log_level
         self._boto_log_level = LEVELS[log_level]
 
         # this has to be 'public', so callers can use it. It's unfortunately
@@ -263,9 +459,10 @@ class BaseBoto(metaclass=ABCMeta):
         # So for now, we just store the region that was asked for, and let the
         # caller use it. See the sample app for a howto.
         self.cli_region = region
-        # if these are set, make sure we set the environment again
-        # as well; that way the underlying boto calls will just DTRT
-        # without the need to wrap all the functions.
+
+        # GOTCHA: Do NOT put the credentials in os.environ for boto to pick up. The environment is shared by
+        # the whole process, so two objects with different credentials would clobber each other. Instead,
+        # keep them on this object and hand them to the sessions and connections it creates.
         credential_map = {
             ACCESS_KEY: access_key,
             SECRET_KEY: secret_key,
@@ -273,27 +470,60 @@ class BaseBoto(metaclass=ABCMeta):
         for env_var, val in iteritems(credential_map):
             if val is None or len(val) < 1:
                 self._logger.debug('Passed boto credentials is empty. Falling back to environment variable %s', env_var)
+                credential_map[env_var] = os.environ.get(env_var, None)
             else:
-
                 # this way we can tell what credentials are being used,
                 # without dumping the whole secret into the logs
                 self._logger.debug('Setting boto credential %s', env_var)
 
-                os.environ[env_var] = val
-
-            # If at this point the environment variable is NOT set,
-            # you didn't set it, and we didn't set it. At which point
-            # boto will go off spelunking for .boto files or other
-            # settings. Best be clear about this. Using 'if not' because
-            # if you set it like this:
+            # If at this point the credential is NOT set, you didn't set it,
+            # and the environment didn't either. At which point boto will go
+            # off spelunking for .boto files or other settings. Best be clear
+            # about this. Using 'if not' because if you set it like this:
             # $ FOO= ./myprog.py
             # It'll return an empty string, and we'd not catch it.
-            if not os.environ.get(env_var, None):
+            if not credential_map[env_var]:
                 self._logger.debug(
                     'Boto environment credential %s NOT explicitly set ' +
                     '-- boto will look for a .boto file somewhere', env_var
                 )
 
+        # Keyword arguments accepted by both boto3 sessions and boto2 connections.
+        # Only pass a complete pair; otherwise let boto resolve the credentials on its own.
+        self._credentials = {}
+        if credential_map[ACCESS_KEY] and credential_map[SECRET_KEY]:
+            self._credentials = {
+                'aws_access_key_id': credential_map[ACCESS_KEY],
+                'aws_secret_access_key': credential_map[SECRET_KEY],
+            }
+
+        # Endpoint URLs to use instead of AWS, i.e. local stand-ins for load testing
+        self._endpoint_url = endpoint_url
+        self._endpoints = dict(endpoints or {})
+        for service_name, url in sorted(iteritems(self._endpoints)):
+            self._logger.debug('Using endpoint %s for %s', url, service_name)
+        if endpoint_url:
+            self._logger.debug('Using endpoint %s for all the other services', endpoint_url)
+
+    @property
+    def call_accounting(self):
+        """
+        The AWS calls made by the clients and connections of this object so far. Use its snapshot() to
+        find out which code paths make the most calls, or log_summary() to log them.
+
+        :rtype: krux_boto.accounting.CallAccounting
+        """
+        return self._accounting
+
+    def _get_endpoint_url(self, service_name):
+        """
+        :param service_name: Name of the service, i.e. 's3'
+        :type service_name: str
+        :return: The endpoint URL to use for the service, or None to use the one of AWS
+        :rtype: str
+        """
+        return self._endpoints.get(service_name, self._endpoint_url)
+
     def __getattr__(self, attr):
         """Proxies calls to ``boto.*`` methods."""
 
@@ -308,7 +538,8 @@ class BaseBoto(metaclass=ABCMeta):
         attr = getattr(self._boto, attr)
 
         if callable(attr):
-            self._logger.debug("Boto attribute '%s' is callable", attr)
+            # GOTCHA: Log the boto function rather than the wrapper of a _ConnectionProxy
+            self._logger.debug("Boto attribute '%s' is callable", getattr(attr, '__wrapped__', attr))
 
             @wraps(attr)
             def wrapper(*args, **kwargs):
@@ -329,6 +560,89 @@ class BaseBoto(metaclass=ABCMeta):
         pass
 
 
+def _boto2_endpoint_args(service_name, url, from_region):
+    """
+    Returns the keyword arguments that make a boto2 connection use the endpoint URL, or None if
+    the connection function does not support a custom endpoint.
+
+    :param service_name: Name of the service, i.e. 's3'
+    :type service_name: str
+    :param url: Endpoint URL
+    :type url: str
+    :param from_region: Whether the function is a connect_to_region() function of a service module
+    :type from_region: bool
+    :rtype: dict
+    """
+    parsed = urlparse(url)
+    args = {'is_secure': parsed.scheme == 'https'}
+    if parsed.port is not None:
+        args['port'] = parsed.port
+
+    if service_name == 's3':
+        from boto.s3.connection import OrdinaryCallingFormat
+
+        args['host'] = parsed.hostname
+        # GOTCHA: Local stand-ins do not resolve bucket names as subdomains
+        args['calling_format'] = OrdinaryCallingFormat()
+        return args
+
+    if from_region:
+        # GOTCHA: connect_to_region() passes its own RegionInfo to the connection. There is no way to override it.
+        return None
+
+    from boto.regioninfo import RegionInfo
+
+    args['region'] = RegionInfo(name='custom', endpoint=parsed.hostname)
+    return args
+
+
+class _ConnectionProxy(object):
+    """
+    Proxies a boto2 module, passing the given credentials and endpoints to every connect_* function
+    in it or its submodules, and counting the calls of the connections they return.
+
+    boto2 has no notion of a session, so this is how a Boto object keeps its settings to itself.
+    """
+
+    def __init__(self, target, credentials, get_endpoint_url, accounting):
+        self._target = target
+        self._credentials = credentials
+        self._get_endpoint_url = get_endpoint_url
+        self._accounting = accounting
+
+    def __getattr__(self, attr):
+        value = getattr(self._target, attr)
+
+        # i.e. boto.ec2, so that boto.ec2.connect_to_region() is covered as well
+        if isinstance(value, ModuleType) and value.__name__.startswith('boto.'):
+            return _ConnectionProxy(value, self._credentials, self._get_endpoint_url, self._accounting)
+
+        if callable(value) and attr.startswith('connect_'):
+            from_region = attr == 'connect_to_region'
+            # i.e. 'ec2' for boto.connect_ec2() and boto.ec2.connect_to_region()
+            service_name = self._target.__name__.split('.')[-1] if from_region else attr[len('connect_'):]
+
+            @wraps(value)
+            def connect(*args, **kwargs):
+                for key, val in iteritems(self._credentials):
+                    kwargs.setdefault(key, val)
+
+                url = self._get_endpoint_url(service_name)
+                endpoint_args = _boto2_endpoint_args(service_name, url, from_region) if url else None
+                for key, val in iteritems(endpoint_args or {}):
+                    kwargs.setdefault(key, val)
+
+                connection = value(*args, **kwargs)
+                self._accounting.register_boto2(connection, service_name)
+                return connection
+            return connect
+
+        return value
+
+    def __repr__(self):
+        return '<_ConnectionProxy of {0!r}>'.format(self._target)
+
+
 class Boto(BaseBoto):
 
     # All the hard work is done in the superclass. We just need to use the
@@ -337,10 +651,16 @@ class Boto(BaseBoto):
         # Call to the superclass to resolve.
         super(Boto, self).__init__(*args, **kwargs)
 
+        import boto
+        import boto.ec2
+
         # access the boto classes via the object. Note these are just the
         # classes for internal use, NOT the object as exposed via the CLI
         # or the objects returned via the get_boto* calls
-        self._boto = boto
+        # GOTCHA: The credentials and endpoints are only passed to the connect_* functions, and only the calls
+        # of the connections they return are counted. Connection classes instantiated directly still use
+        # the environment or .boto files.
+        self._boto = _ConnectionProxy(boto, self._credentials, self._get_endpoint_url, self._accounting)
 
         # This sets the log level for the underlying boto library
         get_logger('boto').setLevel(self._boto_log_level)
@@ -370,21 +690,52 @@ class Boto3(BaseBoto):
     # All the hard work is done in the superclass. We just need to use the
     # resulting object to initialize a session properly.
     def __init__(self, *args, **kwargs):
+        """
+        Takes the same arguments as BaseBoto, plus:
+
+        :param prewarm: Names of the services whose clients to create in the background right away. See prewarm().
+        :type prewarm: list[str]
+        :param bucket_region_ttl: Seconds the region of an S3 bucket is remembered. See get_s3_bucket_region().
+        :type bucket_region_ttl: int
+        :param bucket_region_cache_path: Path of a file to remember the regions of S3 buckets in across processes,
+                                         i.e. krux_boto.s3.DEFAULT_BUCKET_REGION_CACHE_PATH. Defaults to
+                                         remembering them in memory only.
+        :type bucket_region_cache_path: str
+        """
+        prewarm = kwargs.pop('prewarm', None)
+        self._bucket_region_ttl = kwargs.pop('bucket_region_ttl', DEFAULT_BUCKET_REGION_TTL)
+        self._bucket_region_cache_path = kwargs.pop('bucket_region_cache_path', None)
+
+        # Clients returned by client(), keyed by service and region.
+        # GOTCHA: Set these before anything else, or __getattr__() would be consulted for them.
+        self._clients = {}
+        self._clients_lock = threading.RLock()
+        # Functions called with every new client, i.e. to register event handlers on it
+        self._client_hooks = [register_deadline]
+        # Created on first use. See get_s3_bucket_region().
+        self._bucket_regions = None
+        # The boto3 session, see _boto
+        self._session = None
+
         # Call to the superclass to resolve.
         super(Boto3, self).__init__(*args, **kwargs)
+        self._client_hooks.append(self._accounting.register)
 
         # In boto3, the custom settings like region and connection params are
         # stored in what's called a 'session'. This object behaves just like
         # the boto3 class invocation, but it uses your custom settings instead.
         # Read here for details: http://boto3.readthedocs.org/en/latest/guide/session.html
 
-        # Creating your own session, based on the region that was passed in
-        session = boto3.session.Session(region_name=self.cli_region)
+        # Creating your own session, based on the region and the credentials that were passed in
+        session = self._create_session()
 
         # access the boto classes via the session. Note these are just the
         # classes for internal use, NOT the object as exposed via the CLI
         # or the objects returned via the get_boto* calls
-        self._boto = session
+        self._session = session
+
+        # Sessions and clients hold sockets, which must not be shared with a forked child. See _reset_after_fork().
+        _live_boto3.add(self)
 
         # This sets the log level for the underlying boto library
         # http://boto3.readthedocs.org/en/latest/reference/core/boto3.html?highlight=logging
@@ -392,6 +743,325 @@ class Boto3(BaseBoto):
         # called 'botocore'
         get_logger('botocore').setLevel(self._boto_log_level)
 
+        if prewarm:
+            self.prewarm(prewarm)
+
+    def _create_session(self):
+        # GOTCHA: Every botocore session loads and parses the JSON service models on its own.
+        #         Give them all the same loader, so the models are loaded once per process.
+        botocore_session = botocore.session.get_session()
+        botocore_session.register_component('data_loader', get_shared_loader())
+
+        return boto3.session.Session(
+            botocore_session=botocore_session,
+            region_name=self.cli_region,
+            **self._credentials
+        )
+
+    @property
+    def _boto(self):
+        """
+        The boto3 session, created again on first use after _reset().
+
+        :rtype: boto3.session.Session
+        """
+        session = self._session
+        if session is None:
+            with self._clients_lock:
+                if self._session is None:
+                    self._session = self._create_session()
+                session = self._session
+        return session
+
+    def _reset(self):
+        """
+        Drops the session and every client created from it. A new session is only created when needed.
+        """
+        # GOTCHA: Another thread of the parent may have held the lock at the time of fork(). Replace it.
+        self._clients_lock = threading.RLock()
+        self._clients = {}
+        self._bucket_regions = None
+        # GOTCHA: Creating a session is slow. Do not make every forked child pay for it, i.e. in a
+        #         multiprocessing pool whose workers may never call AWS.
+        self._session = None
+
+    def _get_settings(self):
+        """
+        :return: Keyword arguments to create an equivalent object, i.e. in another process
+        :rtype: dict
+        """
+        return {
+            'log_level': self._log_level,
+            'access_key': self._credentials.get('aws_access_key_id'),
+            'secret_key': self._credentials.get('aws_secret_access_key'),
+            # GOTCHA: Use the resolved region, so an 'auto' region is not probed again
+            'region': self.cli_region,
+            'endpoint_url': self._endpoint_url,
+            'endpoints': self._endpoints,
+            'bucket_region_ttl': self._bucket_region_ttl,
+            'bucket_region_cache_path': self._bucket_region_cache_path,
+        }
+
+    def process_map(self, fn, iterable, processes=None, chunksize=1):
+        """
+        Calls fn(boto3, item) for every item in a pool of worker processes, and returns the results in order.
+
+        Each worker process creates its own Boto3 object once, with the same settings as this one, and passes
+        it to every call it handles; the clients created from it are reused across those calls.
+
+        :param fn: Function to call. It must be picklable, i.e. defined at the top level of a module.
+        :type fn: callable
+        :param iterable: Items to call fn with. They must be picklable.
+        :type iterable: collections.Iterable
+        :param processes: Number of worker processes. Defaults to the number of CPUs.
+        :type processes: int
+        :param chunksize: Number of items sent to a worker process at a time
+        :type chunksize: int
+        :return: Results of fn, in the order of iterable
+        :rtype: list
+        """
+        pool = multiprocessing.Pool(
+            processes=processes,
+            initializer=_init_process_worker,
+            initargs=(self._get_settings(),),
+        )
+        try:
+            return pool.map(partial(_call_process_worker, fn), iterable, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+
+    def client(self, service_name, region_name=None, **kwargs):
+        """
+        Returns a boto3 client for the service.
+
+        Clients are thread-safe, so a client created without extra arguments is cached and shared
+        by every caller asking for the same service and region. Passing any other arguments of
+        boto3.session.Session.client() creates a new client every time.
+
+        :param service_name: Name of the service, i.e. 's3'
+        :type service_name: str
+        :param region_name: Region to connect to. Defaults to cli_region.
+        :type region_name: str
+        :return: The client
+        :rtype: botocore.client.BaseClient
+        """
+        region_name = region_name or self.cli_region
+
+        if kwargs:
+            return self._create_client(service_name, region_name, **kwargs)
+
+        key = (service_name, region_name)
+        client = self._clients.get(key)
+        if client is None:
+            with self._clients_lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = self._create_client(service_name, region_name)
+                    self._clients[key] = client
+
+        return client
+
+    def _create_client(self, service_name, region_name, **kwargs):
+        # GOTCHA: boto3 sessions are not thread-safe. Serialize creating clients on this one.
+        endpoint_url = self._get_endpoint_url(service_name)
+        if endpoint_url is not None:
+            kwargs.setdefault('endpoint_url', endpoint_url)
+
+        with self._clients_lock:
+            client = self._boto.client(service_name, region_name=region_name, **kwargs)
+            for hook in self._client_hooks:
+                hook(client)
+            return client
+
+    def _add_client_hook(self, hook):
+        """
+        Calls hook(client) with every client created from now on, and with the cached clients.
+        """
+        with self._clients_lock:
+            self._client_hooks.append(hook)
+            for client in self._clients.values():
+                hook(client)
+
+    def deadline(self, seconds):
+        """
+        Returns a context manager capping the total time of the calls made in it by the clients of this object
+        (and of any other Boto3 object) to the given number of seconds, retries included. The read timeout of
+        each attempt is shortened as the deadline approaches, and a call that cannot complete in time raises
+        krux_boto.deadline.DeadlineExceededError instead of being retried.
+
+        GOTCHA: Deadlines apply to the calls made by the current thread only.
+
+        :param seconds: Seconds from now
+        :type seconds: float
+        """
+        return _deadline(seconds)
+
+    def enable_circuit_breaker(
+        self,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout=DEFAULT_RESET_TIMEOUT,
+        slow_call_threshold=DEFAULT_SLOW_CALL_THRESHOLD,
+    ):
+        """
+        Guards the calls of the clients of this object with a circuit breaker per service and region.
+        Once the circuit of a service and region opens, its calls raise krux_boto.breaker.CircuitOpenError
+        right away instead of waiting on timeouts and retries.
+
+        GOTCHA: Clients created with extra arguments before this is called are not guarded.
+
+        :param failure_threshold: Number of consecutive failed calls that open the circuit
+        :type failure_threshold: int
+        :param reset_timeout: Seconds the circuit stays open before a trial call is let through
+        :type reset_timeout: float
+        :param slow_call_threshold: Seconds after which a call counts as a failure
+        :type slow_call_threshold: float
+        :return: The circuit breaker
+        :rtype: krux_boto.breaker.CircuitBreaker
+        """
+        breaker = CircuitBreaker(
+            failure_threshold=failure_threshold,
+            reset_timeout=reset_timeout,
+            slow_call_threshold=slow_call_threshold,
+            logger=self._logger,
+            stats=self._stats,
+        )
+        self._add_client_hook(breaker.register)
+        return breaker
+
+    def hedged_client(
+        self,
+        service_name,
+        region_name=None,
+        operations=DEFAULT_HEDGED_OPERATIONS,
+        delay=None,
+        max_extra_load=DEFAULT_MAX_EXTRA_LOAD,
+        max_workers=DEFAULT_HEDGE_WORKERS,
+    ):
+        """
+        Returns a boto3 client for the service whose idempotent reads are hedged: if a call has not returned
+        after a delay, it is made again and whichever returns first is used. See krux_boto.hedge.HedgedClient.
+        Each hedged client runs its calls in its own thread pool, so create it once and reuse it.
+        The caller owns the hedged client, and must close() it once done with it to release the thread pool.
+
+        :param service_name: Name of the service, i.e. 's3'
+        :type service_name: str
+        :param region_name: Region to connect to. Defaults to cli_region.
+        :type region_name: str
+        :param operations: Names of the client methods to hedge. They must be idempotent.
+        :type operations: list[str]
+        :param delay: Seconds to wait before hedging. Defaults to the p95 latency observed for the operation.
+        :type delay: float
+        :param max_extra_load: Maximum number of hedges, as a fraction of the calls
+        :type max_extra_load: float
+        :param max_workers: Maximum number of calls in progress at once, hedges included
+        :type max_workers: int
+        :return: The client
+        :rtype: krux_boto.hedge.HedgedClient
+        """
+        client = self.client(service_name, region_name, config=Config(max_pool_connections=max(max_workers, 10)))
+
+        return HedgedClient(
+            client=client,
+            operations=operations,
+            delay=delay,
+            max_extra_load=max_extra_load,
+            max_workers=max_workers,
+            logger=self._logger,
+            stats=self._stats,
+        )
+
+    def record_cassette(self, path):
+        """
+        Records the HTTP responses of the clients of this object to a new cassette file, with credentials scrubbed,
+        so they can be replayed with replay_cassette(). See krux_boto.cassette.Cassette.
+
+        GOTCHA: Clients created with extra arguments before this is called do not record.
+
+        :param path: Path of the cassette file. It is overwritten.
+        :type path: str
+        :return: The cassette. Close it to finish writing the file.
+        :rtype: krux_boto.cassette.Cassette
+        """
+        cassette = Cassette(path, mode=RECORD, logger=self._logger)
+        self._add_client_hook(cassette.register)
+        return cassette
+
+    def replay_cassette(self, path, simulate_latency=False):
+        """
+        Serves the calls of the clients of this object from a cassette recorded with record_cassette(), without
+        any network or credentials. A call without a recorded response raises krux_boto.cassette.CassetteError.
+
+        GOTCHA: Clients created with extra arguments before this is called are not served from the cassette.
+
+        :param path: Path of the cassette file
+        :type path: str
+        :param simulate_latency: Whether replayed responses take as long as they did when recorded
+        :type simulate_latency: bool
+        :return: The cassette
+        :rtype: krux_boto.cassette.Cassette
+        """
+        cassette = Cassette(path, mode=REPLAY, simulate_latency=simulate_latency, logger=self._logger)
+        self._add_client_hook(cassette.register)
+        return cassette
+
+    def prewarm(self, services, connect=True):
+        """
+        Creates the clients of the services in the background, so the first calls do not pay for loading
+        the service models, resolving the endpoints and the credentials, and opening a connection.
+
+        :param services: Names of the services, i.e. ['ec2', 's3']
+        :type services: list[str]
+        :param connect: Whether to also open a connection to each service's endpoint
+        :type connect: bool
+        :return: Futures of the clients, keyed by service name. Nothing needs to wait on them.
+        :rtype: dict[str, concurrent.futures.Future]
+        """
+        services = list(services)
+        if not services:
+            return {}
+
+        self._logger.debug('Prewarming boto3 clients for %s', ', '.join(services))
+
+        executor = ThreadPoolExecutor(max_workers=len(services))
+        futures = dict(
+            (service, executor.submit(self._prewarm_client, service, connect)) for service in services
+        )
+        # Let the threads finish on their own, without blocking the caller
+        executor.shutdown(wait=False)
+
+        return futures
+
+    def _prewarm_client(self, service_name, connect):
+        start_time = time.time()
+
+        try:
+            client = self.client(service_name)
+            # Resolving the credentials may involve a round trip to the instance metadata service
+            self._boto.get_credentials()
+
+            if connect:
+                self._open_connection(client)
+        except Exception:
+            self._logger.debug('Failed to prewarm the %s client', service_name, exc_info=True)
+            raise
+
+        self._stats.timing('prewarm.{0}'.format(service_name), (time.time() - start_time) * 1000)
+        return client
+
+    def _open_connection(self, client):
+        # Any response will do, as long as the connection (and its TLS session) ends up in the client's pool.
+        # GOTCHA: botocore does not expose its HTTP session, so this is a best effort.
+        http_session = getattr(getattr(client, '_endpoint', None), 'http_session', None)
+        if http_session is None:
+            return
+
+        request = AWSRequest(method='HEAD', url=client.meta.endpoint_url).prepare()
+        try:
+            http_session.send(request)
+        except Exception as e:
+            self._logger.debug('Failed to connect to %s: %s', client.meta.endpoint_url, e)
+
     def get_valid_regions(self):
         """
         Gets all AWS regions that Krux can access
@@ -400,7 +1070,7 @@ class Boto3(BaseBoto):
                  for which the enum does not exist, just returns the name of the region as a string.
         :rtype: list[RegionCode.Region]
         """
-        client = self._boto.client('ec2')
+        client = self.client('ec2')
 
         regions = []
         for region in client.describe_regions().get('Regions', []):
@@ -410,3 +1080,556 @@ class Boto3(BaseBoto):
                 regions.append(region.get('RegionName'))
 
         return regions
+
+    def get_ec2_inventory(self, regions=None, refresh_interval=None, fields=None):
+        """
+        Reads the EC2 instances of the regions into memory, indexed by instance ID, tag and private IP.
+        If refresh_interval is set, the inventory keeps refreshing itself in a background thread until
+        its stop() method is called.
+
+        :param regions: Names of the regions. Defaults to get_valid_regions().
+        :type regions: list[str]
+        :param refresh_interval: Seconds between refreshes. Defaults to never refreshing.
+        :type refresh_interval: float
+        :param fields: Names of the fields to keep of each instance, as compact records.
+                       See krux_boto.records.FIELDS. Defaults to keeping the whole dicts.
+        :type fields: list[str]
+        :return: The inventory
+        :rtype: krux_boto.ec2.EC2Inventory
+        """
+        if regions is None:
+            regions = self.get_valid_regions()
+
+        inventory = EC2Inventory(
+            client_factory=lambda region: self.client('ec2', region_name=region),
+            regions=regions,
+            refresh_interval=refresh_interval,
+            logger=self._logger,
+            stats=self._stats,
+            fields=fields,
+        )
+        inventory.start()
+        return inventory
+
+    def get_s3_bucket_region(self, bucket):
+        """
+        Returns the region of an S3 bucket, finding it out with a HeadBucket call the first time and
+        remembering it for bucket_region_ttl seconds. See krux_boto.s3.BucketRegionCache.
+
+        With an endpoint override for S3, i.e. a local S3 compatible server, this is always cli_region.
+
+        :param bucket: Name of the bucket
+        :type bucket: str
+        :return: Name of the region of the bucket
+        :rtype: str
+        """
+        if self._get_endpoint_url('s3') is not None:
+            return self.cli_region
+
+        if self._bucket_regions is None:
+            with self._clients_lock:
+                if self._bucket_regions is None:
+                    self._bucket_regions = BucketRegionCache(
+                        client=self.client('s3'),
+                        ttl=self._bucket_region_ttl,
+                        cache_path=self._bucket_region_cache_path,
+                        logger=self._logger,
+                    )
+        return self._bucket_regions.get_region(bucket)
+
+    def s3_client_for_bucket(self, bucket, **kwargs):
+        """
+        Returns a boto3 S3 client of the region of the bucket, so its requests are not redirected there.
+        The S3 helpers of this object use it whenever they are not given a region.
+
+        :param bucket: Name of the bucket
+        :type bucket: str
+        :param kwargs: Other arguments of client()
+        :return: The client
+        :rtype: botocore.client.S3
+        """
+        return self.client('s3', self.get_s3_bucket_region(bucket), **kwargs)
+
+    def download_s3_object(
+        self,
+        bucket,
+        key,
+        target,
+        part_size=DEFAULT_PART_SIZE,
+        max_workers=DEFAULT_MAX_WORKERS,
+        version_id=None,
+        verify=True,
+    ):
+        """
+        Downloads an S3 object with concurrent ranged GETs, writing each part directly into
+        a memory-mapped file or a caller-supplied buffer.
+
+        :param bucket: Name of the bucket
+        :type bucket: str
+        :param key: Key of the object
+        :type key: str
+        :param target: Path of the file to write to, or a writable buffer at least as large as the object
+        :type target: str | bytearray | memoryview
+        :param part_size: Size of each ranged GET, in bytes
+        :type part_size: int
+        :param max_workers: Number of concurrent ranged GETs
+        :type max_workers: int
+        :param version_id: Version of the object to download. Defaults to the latest version.
+        :type version_id: str
+        :param verify: Whether to verify the downloaded data against the object's ETag
+        :type verify: bool
+        :return: Size of the object in bytes
+        :rtype: int
+        """
+        # GOTCHA: botocore keeps at most 10 connections per client by default, which would
+        #         serialize any workers beyond that.
+        client = self.s3_client_for_bucket(bucket, config=Config(max_pool_connections=max(max_workers, 10)))
+
+        downloader = S3Downloader(
+            client=client,
+            part_size=part_size,
+            max_workers=max_workers,
+            logger=self._logger,
+            stats=self._stats,
+        )
+        return downloader.download(bucket, key, target, version_id=version_id, verify=verify)
+
+    def open_s3_writer(self, bucket, key, part_size=DEFAULT_PART_SIZE, max_in_flight=DEFAULT_MAX_IN_FLIGHT, **extra_args):
+        """
+        Opens a file-like object that uploads to S3 as data is written to it, with a bounded amount of memory.
+        Use it as a context manager so the upload is completed on success and aborted on error.
+
+        :param bucket: Name of the bucket
+        :type bucket: str
+        :param key: Key of the object
+        :type key: str
+        :param part_size: Size of each part, in bytes. Must be at least 5 MB.
+        :type part_size: int
+        :param max_in_flight: Maximum number of parts buffered or being uploaded at once
+        :type max_in_flight: int
+        :param extra_args: Extra arguments for put_object() / create_multipart_upload(), i.e. ContentType
+        :return: The writer
+        :rtype: krux_boto.s3.S3MultipartWriter
+        """
+        client = self.s3_client_for_bucket(bucket, config=Config(max_pool_connections=max(max_in_flight, 10)))
+
+        return S3MultipartWriter(
+            client=client,
+            bucket=bucket,
+            key=key,
+            part_size=part_size,
+            max_in_flight=max_in_flight,
+            extra_args=extra_args,
+            logger=self._logger,
+            stats=self._stats,
+        )
+
+    def copy_s3_object(
+        self,
+        source_bucket,
+        source_key,
+        destination_bucket,
+        destination_key=None,
+        source_region=None,
+        destination_region=None,
+        part_size=DEFAULT_COPY_PART_SIZE,
+        max_workers=DEFAULT_MAX_WORKERS,
+        multipart_threshold=DEFAULT_MULTIPART_COPY_THRESHOLD,
+        version_id=None,
+        **extra_args
+    ):
+        """
+        Copies an S3 object server side, keeping its metadata and tags. Large objects, including those above
+        the 5 GB limit of CopyObject, are copied in parts concurrently. See krux_boto.s3.S3MultipartCopier.
+
+        :param source_bucket: Name of the bucket to copy from
+        :type source_bucket: str
+        :param source_key: Key of the object to copy
+        :type source_key: str
+        :param destination_bucket: Name of the bucket to copy to
+        :type destination_bucket: str
+        :param destination_key: Key of the copy. Defaults to source_key.
+        :type destination_key: str
+        :param source_region: Region of the source bucket. Defaults to the one get_s3_bucket_region() finds.
+        :type source_region: str
+        :param destination_region: Region of the destination bucket. Defaults to the one
+                                   get_s3_bucket_region() finds.
+        :type destination_region: str
+        :param part_size: Size of each part, in bytes, between 5 MB and 5 GB
+        :type part_size: int
+        :param max_workers: Number of parts copied concurrently
+        :type max_workers: int
+        :param multipart_threshold: Size in bytes above which objects are copied in parts, at most 5 GB
+        :type multipart_threshold: int
+        :param version_id: Version of the object to copy. Defaults to the latest version.
+        :type version_id: str
+        :param extra_args: Extra arguments for copy_object() / create_multipart_upload(), i.e. StorageClass
+        :return: The outcome, with the time each part took to copy
+        :rtype: krux_boto.s3.CopyResult
+        """
+        copier = S3MultipartCopier(
+            source_client=self.client('s3', source_region or self.get_s3_bucket_region(source_bucket)),
+            destination_client=self.client(
+                's3',
+                destination_region or self.get_s3_bucket_region(destination_bucket),
+                config=Config(max_pool_connections=max(max_workers, 10)),
+            ),
+            part_size=part_size,
+            max_workers=max_workers,
+            multipart_threshold=multipart_threshold,
+            logger=self._logger,
+            stats=self._stats,
+        )
+        return copier.copy(
+            source_bucket,
+            source_key,
+            destination_bucket,
+            destination_key or source_key,
+            version_id=version_id,
+            extra_args=extra_args,
+        )
+
+    def iter_s3_keys(self, bucket, prefix='', start_after=None):
+        """
+        Yields the keys of the objects of a bucket, page by page, without holding the whole listing in memory.
+
+        :param bucket: Name of the bucket
+        :type bucket: str
+        :param prefix: Only yield the keys starting with this
+        :type prefix: str
+        :param start_after: Only yield the keys after this one, i.e. to resume a listing
+        :type start_after: str
+        :rtype: collections.Iterator[str]
+        """
+        return iter_s3_keys(self.s3_client_for_bucket(bucket), bucket, prefix=prefix, start_after=start_after)
+
+    def list_s3_objects(self, bucket, prefix='', start_after=None, fields=None, columnar=False):
+        """
+        Lists the objects of a bucket as compact records holding only the given fields, i.e. to keep millions of
+        them in memory. See krux_boto.records.
+
+        :param bucket: Name of the bucket
+        :type bucket: str
+        :param prefix: Only list the objects whose key starts with this
+        :type prefix: str
+        :param start_after: Only list the objects after this key, i.e. to resume a listing
+        :type start_after: str
+        :param fields: Names of the fields to keep, among krux_boto.records.FIELDS[S3_OBJECT].
+                       Defaults to key, size, etag and last_modified, in seconds since the epoch.
+        :type fields: list[str]
+        :param columnar: Whether to store the objects as columns, which takes even less memory than records
+        :type columnar: bool
+        :return: The objects, in the order of their keys
+        :rtype: list[tuple] | krux_boto.records.Columns
+        """
+        schema = RecordSchema(S3_OBJECT, fields)
+        items = iter_s3_objects(self.s3_client_for_bucket(bucket), bucket, prefix=prefix, start_after=start_after)
+        if columnar:
+            return schema.columns(items)
+        return [schema.record(item) for item in items]
+
+    def bulk_delete_s3_objects(
+        self,
+        bucket,
+        keys,
+        batch_size=MAX_DELETE_BATCH_SIZE,
+        max_workers=DEFAULT_MAX_WORKERS,
+        max_retries=DEFAULT_BULK_RETRIES,
+        progress_interval=DEFAULT_PROGRESS_INTERVAL,
+        progress=None,
+    ):
+        """
+        Deletes the objects of a stream of keys, i.e. from iter_s3_keys(), with concurrent DeleteObjects calls
+        of up to 1,000 keys each. See krux_boto.s3.S3BulkOperation.
+
+        :param bucket: Name of the bucket
+        :type bucket: str
+        :param keys: Keys of the objects to delete
+        :type keys: collections.Iterable[str]
+        :param batch_size: Number of keys per DeleteObjects call, at most 1,000
+        :type batch_size: int
+        :param max_workers: Number of concurrent DeleteObjects calls
+        :type max_workers: int
+        :param max_retries: Number of times a key failing with a transient error is retried
+        :type max_retries: int
+        :param progress_interval: Seconds between progress reports
+        :type progress_interval: float
+        :param progress: Called with a krux_boto.s3.BulkProgress on every report. Defaults to logging it.
+        :type progress: callable
+        :return: The outcome. Its errors map every key that could not be deleted to the code of its error.
+        :rtype: krux_boto.s3.BulkResult
+        """
+        deleter = S3BulkDeleter(
+            client=self.s3_client_for_bucket(bucket, config=Config(max_pool_connections=max(max_workers, 10))),
+            bucket=bucket,
+            batch_size=batch_size,
+            max_workers=max_workers,
+            max_retries=max_retries,
+            progress_interval=progress_interval,
+            progress=progress,
+            logger=self._logger,
+            stats=self._stats,
+        )
+        return deleter.run(keys)
+
+    def bulk_copy_s3_objects(
+        self,
+        source_bucket,
+        keys,
+        destination_bucket,
+        key_map=None,
+        batch_size=DEFAULT_COPY_BATCH_SIZE,
+        max_workers=DEFAULT_MAX_WORKERS,
+        max_retries=DEFAULT_BULK_RETRIES,
+        progress_interval=DEFAULT_PROGRESS_INTERVAL,
+        progress=None,
+        **extra_args
+    ):
+        """
+        Copies the objects of a stream of keys, i.e. from iter_s3_keys(), to another bucket or prefix with
+        concurrent CopyObject calls. See krux_boto.s3.S3BulkOperation. Objects larger than 5 GB cannot be copied
+        this way.
+
+        :param source_bucket: Name of the bucket to copy from
+        :type source_bucket: str
+        :param keys: Keys of the objects to copy
+        :type keys: collections.Iterable[str]
+        :param destination_bucket: Name of the bucket to copy to
+        :type destination_bucket: str
+        :param key_map: Returns the destination key of a source key. Defaults to the same key.
+        :type key_map: callable
+        :param batch_size: Number of keys handed to a worker at a time
+        :type batch_size: int
+        :param max_workers: Number of concurrent CopyObject calls
+        :type max_workers: int
+        :param max_retries: Number of times a key failing with a transient error is retried
+        :type max_retries: int
+        :param progress_interval: Seconds between progress reports
+        :type progress_interval: float
+        :param progress: Called with a krux_boto.s3.BulkProgress on every report. Defaults to logging it.
+        :type progress: callable
+        :param extra_args: Extra arguments for copy_object(), i.e. StorageClass
+        :return: The outcome. Its errors map every key that could not be copied to the code of its error.
+        :rtype: krux_boto.s3.BulkResult
+        """
+        copier = S3BulkCopier(
+            # GOTCHA: CopyObject is sent to the region of the destination bucket
+            client=self.s3_client_for_bucket(
+                destination_bucket, config=Config(max_pool_connections=max(max_workers, 10)),
+            ),
+            source_bucket=source_bucket,
+            destination_bucket=destination_bucket,
+            key_map=key_map,
+            batch_size=batch_size,
+            extra_args=extra_args,
+            max_workers=max_workers,
+            max_retries=max_retries,
+            progress_interval=progress_interval,
+            progress=progress,
+            logger=self._logger,
+            stats=self._stats,
+        )
+        return copier.run(keys)
+
+    def scan_dynamodb_table(
+        self,
+        table_name,
+        total_segments=DEFAULT_TOTAL_SEGMENTS,
+        max_workers=None,
+        max_buffered_pages=None,
+        read_capacity=None,
+        checkpoints=None,
+        **scan_args
+    ):
+        """
+        Scans a DynamoDB table with several segments in parallel. The returned object yields the items
+        (in the format of the low-level client) of all the segments as they arrive.
+
+        :param table_name: Name of the table
+        :type table_name: str
+        :param total_segments: Number of segments the table is split into
+        :type total_segments: int
+        :param max_workers: Number of segments scanned at once. Defaults to all of them.
+        :type max_workers: int
+        :param max_buffered_pages: Maximum number of pages held in memory. Defaults to total_segments.
+        :type max_buffered_pages: int
+        :param read_capacity: Maximum number of read capacity units consumed per second. Defaults to no limit.
+        :type read_capacity: float
+        :param checkpoints: The checkpoints attribute of a previous scan with the same total_segments, to resume it
+        :type checkpoints: dict[int, dict]
+        :param scan_args: Extra arguments for scan(), i.e. FilterExpression
+        :return: The scan, to iterate over
+        :rtype: krux_boto.dynamodb.DynamoDBParallelScan
+        """
+        max_workers = max_workers or total_segments
+        client = self.client('dynamodb', config=Config(max_pool_connections=max(max_workers, 10)))
+
+        return DynamoDBParallelScan(
+            client=client,
+            table_name=table_name,
+            total_segments=total_segments,
+            max_workers=max_workers,
+            max_buffered_pages=max_buffered_pages,
+            read_capacity=read_capacity,
+            checkpoints=checkpoints,
+            scan_args=scan_args,
+            logger=self._logger,
+            stats=self._stats,
+        )
+
+    def get_sqs_consumer(
+        self,
+        queue_url,
+        handler,
+        receivers=DEFAULT_RECEIVERS,
+        workers=DEFAULT_WORKERS,
+        wait_time=DEFAULT_WAIT_TIME,
+        visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT,
+    ):
+        """
+        Creates a consumer that receives messages from an SQS queue with several long-polling threads,
+        passes them to the handler in a pool of worker threads and deletes the handled ones in batches.
+        Use it as a context manager, or call run() to consume the queue until interrupted.
+
+        :param queue_url: URL of the queue
+        :type queue_url: str
+        :param handler: Function called with each message, as returned by receive_message().
+                        Messages are deleted unless it raises.
+        :type handler: callable
+        :param receivers: Number of long-polling receiver threads
+        :type receivers: int
+        :param workers: Number of worker threads calling the handler
+        :type workers: int
+        :param wait_time: Seconds each receive call waits for messages
+        :type wait_time: int
+        :param visibility_timeout: Visibility timeout of the received messages, in seconds.
+                                   It is extended automatically while a message is being handled.
+        :type visibility_timeout: int
+        :return: The consumer
+        :rtype: krux_boto.sqs.SQSConsumer
+        """
+        # GOTCHA: Each receiver holds a connection for the whole long poll, and the deleter and
+        #         the visibility extender need one each on top of that.
+        client = self.client('sqs', config=Config(max_pool_connections=max(receivers + 2, 10)))
+
+        return SQSConsumer(
+            client=client,
+            queue_url=queue_url,
+            handler=handler,
+            receivers=receivers,
+            workers=workers,
+            wait_time=wait_time,
+            visibility_timeout=visibility_timeout,
+            logger=self._logger,
+            stats=self._stats,
+        )
+
+    def get_cloudwatch_stats(
+        self,
+        namespace,
+        prefix=None,
+        dimensions=None,
+        flush_interval=DEFAULT_FLUSH_INTERVAL,
+        max_metrics=DEFAULT_MAX_METRICS,
+    ):
+        """
+        Creates a stats client that buffers the stats in memory and sends them to CloudWatch in batches.
+        It has the same interface as krux.stats.get_stats(), so it can be used anywhere a stats object is.
+
+        :param namespace: CloudWatch namespace of the metrics
+        :type namespace: str
+        :param prefix: Prefix of the metric names
+        :type prefix: str
+        :param dimensions: Dimensions added to every metric, i.e. {'Environment': 'prod'}
+        :type dimensions: dict[str, str]
+        :param flush_interval: Seconds between flushes
+        :type flush_interval: float
+        :param max_metrics: Maximum number of distinct metrics buffered between flushes
+        :type max_metrics: int
+        :return: The stats client
+        :rtype: krux_boto.stats.CloudWatchStatsClient
+        """
+        return CloudWatchStatsClient(
+            client=self.client('cloudwatch'),
+            namespace=namespace,
+            prefix=prefix,
+            dimensions=dimensions,
+            flush_interval=flush_interval,
+            max_metrics=max_metrics,
+            logger=self._logger,
+        )
+
+
+class _SearchPaths(list):
+    """
+    A list of data paths that ignores duplicates.
+
+    boto3 appends its own data path to the loader of every session it creates, which would
+    make the list of a shared loader grow forever.
+    """
+
+    def append(self, path):
+        if path not in self:
+            super(_SearchPaths, self).append(path)
+
+
+# The botocore loader shared by the sessions of every Boto3 object, see get_shared_loader()
+_shared_loader = None
+_shared_loader_lock = threading.Lock()
+
+
+def get_shared_loader():
+    """
+    Returns the botocore data loader shared by the sessions of every Boto3 object in this process.
+    The loader caches the service models it loads, so the models are loaded and parsed only once
+    no matter how many sessions there are.
+
+    :rtype: botocore.loaders.Loader
+    """
+    global _shared_loader
+
+    if _shared_loader is None:
+        with _shared_loader_lock:
+            if _shared_loader is None:
+                # Honor AWS_DATA_PATH, like botocore does for the loaders it creates
+                data_path = os.environ.get('AWS_DATA_PATH')
+                paths = _SearchPaths()
+                if data_path:
+                    for path in data_path.split(os.pathsep):
+                        paths.append(os.path.expanduser(os.path.expandvars(path)))
+
+                _shared_loader = botocore.loaders.Loader(extra_search_paths=paths)
+
+    return _shared_loader
+
+
+# Every live Boto3 object, so their sessions can be reset in a forked child
+_live_boto3 = weakref.WeakSet()
+# The Boto3 object of a Boto3.process_map() worker process
+_process_boto3 = None
+
+
+def _reset_after_fork():
+    """
+    Resets the state a forked child must not share with its parent: the sessions and clients of every
+    Boto3 object (their connection pools hold the parent's sockets) and the locks guarding them.
+    """
+    global _instances_lock
+    _instances_lock = threading.RLock()
+
+    for instance in list(_live_boto3):
+        instance._reset()
+
+
+# GOTCHA: os.register_at_fork() is only available as of Python 3.7
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _init_process_worker(settings):
+    global _process_boto3
+    _process_boto3 = Boto3(**settings)
+
+
+def _call_process_worker(fn, item):
+    return fn(_process_boto3, item)
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from functools import partial
+import threading
+import time
+
+#
+# Third party libraries
+#
+
+#
+# Internal libraries
+#
+
+from krux.logging import get_logger
+from krux_boto.util import Error
+
+# Constants
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30
+# Seconds after which a call counts as a failure even if it succeeds
+DEFAULT_SLOW_CALL_THRESHOLD = 10
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_START_TIME_KEY = 'krux_boto_breaker_start_time'
+_TRIAL_KEY = 'krux_boto_breaker_trial'
+
+
+class CircuitOpenError(Error):
+    """
+    Raised instead of making a call while the circuit of its service and region is open.
+    """
+    pass
+
+
+class _Circuit(object):
+    """
+    State of the circuit of one service and region.
+    """
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+
+class CircuitBreaker(object):
+    """
+    Fails calls fast while the endpoint of their service and region is failing, instead of letting
+    them wait on timeouts and retries.
+
+    The circuit of a service and region opens after failure_threshold consecutive failed calls, where
+    a call fails if it raises a connection error, gets a 5xx response or takes longer than
+    slow_call_threshold seconds. While the circuit is open, calls raise CircuitOpenError right away.
+    After reset_timeout seconds, one trial call at a time is let through (half-open): the circuit closes
+    again if it succeeds, and opens for another reset_timeout seconds if it fails.
+    """
+
+    def __init__(
+        self,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout=DEFAULT_RESET_TIMEOUT,
+        slow_call_threshold=DEFAULT_SLOW_CALL_THRESHOLD,
+        logger=None,
+        stats=None,
+    ):
+        """
+        :param failure_threshold: Number of consecutive failed calls that open the circuit
+        :type failure_threshold: int
+        :param reset_timeout: Seconds the circuit stays open before a trial call is let through
+        :type reset_timeout: float
+        :param slow_call_threshold: Seconds after which a call counts as a failure
+        :type slow_call_threshold: float
+        :param logger: Logger, recommended to be obtained using krux.cli.Application
+        :type logger: logging.Logger
+        :param stats: Stats, recommended to be obtained using krux.cli.Application
+        :type stats: kruxstatsd.StatsClient
+        """
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._slow_call_threshold = slow_call_threshold
+        self._logger = logger or get_logger('krux_boto')
+        self._stats = stats
+
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def register(self, client):
+        """
+        Guards the calls of a boto3 client with the circuit of its service and region.
+
+        :param client: The client
+        :type client: botocore.client.BaseClient
+        """
+        key = (client.meta.service_model.service_name, client.meta.region_name)
+        # GOTCHA: Handlers of more specific events (and 'before-call.*.*' is more specific than 'before-call')
+        #         run first, and a handler returning a response skips the rest, i.e. botocore's Stubber.
+        #         Make sure the breaker always gets to fail the call first.
+        client.meta.events.register_first('before-call.*.*', partial(self._before_call, key))
+        client.meta.events.register('after-call.*.*', partial(self._after_call, key))
+        client.meta.events.register('after-call-error.*.*', partial(self._after_call_error, key))
+
+    def state(self, service_name, region_name):
+        """
+        :return: State of the circuit of the service and region: 'closed', 'open' or 'half_open'
+        :rtype: str
+        """
+        with self._lock:
+            circuit = self._circuits.get((service_name, region_name))
+            return circuit.state if circuit is not None else CLOSED
+
+    def _before_call(self, key, context, **kwargs):
+        with self._lock:
+            circuit = self._circuits.setdefault(key, _Circuit())
+
+            if circuit.state == OPEN:
+                if time.time() - circuit.opened_at < self._reset_timeout:
+                    raise CircuitOpenError('Circuit of {0} in {1} is open'.format(*key))
+                self._transition(key, circuit, HALF_OPEN)
+
+            if circuit.state == HALF_OPEN:
+                if circuit.trial_in_flight:
+                    raise CircuitOpenError('Circuit of {0} in {1} is half open'.format(*key))
+                circuit.trial_in_flight = True
+                context[_TRIAL_KEY] = True
+
+        context[_START_TIME_KEY] = time.time()
+
+    def _after_call(self, key, http_response, context, **kwargs):
+        failed = http_response.status_code >= 500
+        if not failed and _START_TIME_KEY in context:
+            failed = time.time() - context[_START_TIME_KEY] > self._slow_call_threshold
+        self._record(key, context, failed)
+
+    def _after_call_error(self, key, context, **kwargs):
+        self._record(key, context, True)
+
+    def _record(self, key, context, failed):
+        with self._lock:
+            circuit = self._circuits.setdefault(key, _Circuit())
+            if context.pop(_TRIAL_KEY, False):
+                circuit.trial_in_flight = False
+
+            if not failed:
+                circuit.failures = 0
+                if circuit.state == HALF_OPEN:
+                    self._transition(key, circuit, CLOSED)
+                return
+
+            circuit.failures += 1
+            if circuit.state == HALF_OPEN or (
+                circuit.state == CLOSED and circuit.failures >= self._failure_threshold
+            ):
+                circuit.opened_at = time.time()
+                self._transition(key, circuit, OPEN)
+
+    def _transition(self, key, circuit, state):
+        # GOTCHA: Called with the lock held. Logging and stats must not call back into the breaker.
+        circuit.state = state
+        if state == CLOSED:
+            self._logger.info('Circuit of %s in %s closed', *key)
+        else:
+            self._logger.warn('Circuit of %s in %s is %s after %d failures', key[0], key[1], state, circuit.failures)
+
+        if self._stats is not None:
+            self._stats.incr('circuit_breaker.{0}.{1}.{2}'.format(key[0], key[1], state))
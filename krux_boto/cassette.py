@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from collections import defaultdict
+import base64
+import gzip
+import hashlib
+import io
+import json
+import re
+import threading
+import time
+
+#
+# Third party libraries
+#
+
+import botocore
+from botocore.awsrequest import AWSResponse
+from botocore.response import StreamingBody
+from six.moves.urllib.parse import urlsplit, parse_qsl, urlencode
+
+#
+# Internal libraries
+#
+
+from krux.logging import get_logger
+from krux_boto.util import Error
+
+# Constants
+RECORD = 'record'
+REPLAY = 'replay'
+
+# Headers and query parameters carrying credentials or signatures. They are never written to a cassette.
+SCRUBBED_HEADERS = frozenset(['authorization', 'x-amz-security-token', 'x-amz-date', 'x-amz-content-sha256'])
+SCRUBBED_QUERY_PARAMS = frozenset([
+    'x-amz-credential', 'x-amz-security-token', 'x-amz-signature', 'x-amz-date',
+    'awsaccesskeyid', 'signature', 'security-token',
+])
+# Credentials returned in response bodies, i.e. by sts:AssumeRole, in XML or JSON
+_SCRUBBED_BODY_PATTERNS = [
+    re.compile(br'(<(SecretAccessKey|SessionToken)>)[^<]*(</\2>)'),
+    re.compile(br'("(SecretAccessKey|SessionToken)"\s*:\s*")[^"]*(")'),
+]
+_SCRUBBED = 'SCRUBBED'
+
+_START_TIME_KEY = 'krux_boto_cassette_start_time'
+_INTERACTION_KEY = 'krux_boto_cassette_interaction'
+
+
+class CassetteError(Error):
+    """
+    Raised when a call has no recorded response to replay.
+    """
+    pass
+
+
+class _RecordedBody(object):
+    """
+    Raw body of a replayed response, readable both at once and as a stream.
+    """
+
+    def __init__(self, data):
+        self._data = data
+        self._stream = io.BytesIO(data)
+
+    def stream(self, **kwargs):
+        yield self._data
+
+    def read(self, amt=None):
+        return self._stream.read(amt)
+
+    def close(self):
+        self._stream.close()
+
+
+def _scrub_url(url):
+    parts = urlsplit(url)
+    query = [
+        (name, _SCRUBBED if name.lower() in SCRUBBED_QUERY_PARAMS else value)
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+    ]
+    return parts._replace(query=urlencode(query)).geturl()
+
+
+def _scrub_body(body):
+    for pattern in _SCRUBBED_BODY_PATTERNS:
+        body = pattern.sub(br'\g<1>' + _SCRUBBED.encode() + br'\g<3>', body)
+    return body
+
+
+def _request_key(service, operation, request):
+    """
+    Identifies a request regardless of where it is sent to and of its signature.
+    """
+    parts = urlsplit(request.url)
+    query = sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name.lower() not in SCRUBBED_QUERY_PARAMS
+    )
+    body = request.body
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    # GOTCHA: Streamed request bodies cannot be read without consuming them. Only match them on the URL.
+    body_digest = hashlib.sha1(body).hexdigest() if isinstance(body, bytes) else None
+
+    key = json.dumps([service, operation, request.method, parts.path, query, body_digest])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _split_event_name(event_name):
+    # i.e. before-send.sqs.ListQueues
+    _, service, operation = event_name.split('.', 2)
+    return service, operation
+
+
+class Cassette(object):
+    """
+    Records the HTTP responses of boto3 clients to a file, or replays them from it without any network.
+
+    A cassette is a gzipped file of JSON lines, one per HTTP attempt, retries included. Credentials are
+    scrubbed from the recorded headers, URLs and response bodies.
+
+    When replaying, the responses are indexed in memory by request (service, operation, method, path,
+    query and body, but not host or signature) and served in the order they were recorded, starting over
+    once they run out. A request that was not recorded as such, i.e. because of a generated idempotency token,
+    gets the next response recorded for the same operation. Requests are not signed, so no credentials are needed.
+    """
+
+    def __init__(self, path, mode=REPLAY, simulate_latency=False, logger=None):
+        """
+        :param path: Path of the cassette file
+        :type path: str
+        :param mode: RECORD to record the responses of the calls to a new cassette, or REPLAY to replay them
+        :type mode: str
+        :param simulate_latency: Whether replayed responses take as long as they did when recorded
+        :type simulate_latency: bool
+        :param logger: Logger, recommended to be obtained using krux.cli.Application
+        :type logger: logging.Logger
+        """
+        if mode not in (RECORD, REPLAY):
+            raise ValueError('Unknown cassette mode {0}, expected {1} or {2}'.format(mode, RECORD, REPLAY))
+
+        self._path = path
+        self._mode = mode
+        self._simulate_latency = simulate_latency
+        self._logger = logger or get_logger('krux_boto')
+        self._lock = threading.Lock()
+
+        self._file = None
+        self._by_request = {}
+        self._by_operation = {}
+        self._positions = defaultdict(int)
+        if mode == RECORD:
+            self._file = gzip.open(path, 'wt')
+        else:
+            self._load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def mode(self):
+        return self._mode
+
+    def _load(self):
+        by_request = defaultdict(list)
+        by_operation = defaultdict(list)
+        count = 0
+        with gzip.open(self._path, 'rt') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                interaction = json.loads(line)
+                by_request[interaction['key']].append(interaction)
+                by_operation[(interaction['service'], interaction['operation'])].append(interaction)
+                count += 1
+
+        self._by_request = dict(by_request)
+        self._by_operation = dict(by_operation)
+        self._logger.debug('Loaded %d recorded responses from %s', count, self._path)
+
+    def register(self, client):
+        """
+        Makes a boto3 client record its responses to this cassette, or be served from it.
+
+        :param client: The client
+        :type client: botocore.client.BaseClient
+        """
+        events = client.meta.events
+        if self._mode == RECORD:
+            events.register_first('before-send.*.*', self._before_send_record)
+            events.register('response-received.*.*', self._response_received)
+        else:
+            events.register('choose-signer.*.*', self._choose_signer)
+            events.register_first('before-send.*.*', self._before_send_replay)
+
+    def close(self):
+        """
+        Finishes writing the cassette when recording.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _choose_signer(self, **kwargs):
+        return botocore.UNSIGNED
+
+    def _before_send_record(self, request, event_name, **kwargs):
+        service, operation = _split_event_name(event_name)
+        request.context[_START_TIME_KEY] = time.time()
+        request.context[_INTERACTION_KEY] = {
+            'service': service,
+            'operation': operation,
+            'key': _request_key(service, operation, request),
+            'method': request.method,
+            'url': _scrub_url(request.url),
+        }
+
+    def _response_received(self, response_dict, parsed_response, context, exception=None, **kwargs):
+        interaction = context.get(_INTERACTION_KEY)
+        if interaction is None or response_dict is None:
+            # Connection errors have no response to record
+            return
+
+        body = response_dict['body']
+        if not isinstance(body, bytes):
+            # GOTCHA: Reading a streamed body consumes it. Hand the caller a copy of what was read.
+            for name, value in list(parsed_response.items()):
+                if isinstance(value, StreamingBody):
+                    body = value.read()
+                    parsed_response[name] = StreamingBody(io.BytesIO(body), len(body))
+                    break
+            else:
+                self._logger.debug('Not recording the unsupported streamed response of %s', interaction['operation'])
+                return
+
+        headers = dict(
+            (name, value) for name, value in response_dict['headers'].items()
+            if name.lower() not in SCRUBBED_HEADERS
+        )
+        scrubbed = _scrub_body(body)
+        if scrubbed != body:
+            # Keep the length consistent, or botocore would take the body for a truncated one
+            headers = dict((name, value) for name, value in headers.items() if name.lower() != 'content-length')
+            headers['content-length'] = str(len(scrubbed))
+        interaction = dict(
+            interaction,
+            status=response_dict['status_code'],
+            headers=headers,
+            body=base64.b64encode(scrubbed).decode('ascii'),
+            latency=time.time() - context[_START_TIME_KEY],
+        )
+
+        line = json.dumps(interaction, separators=(',', ':'), sort_keys=True)
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line + '\n')
+
+    def _next(self, service, operation, key):
+        with self._lock:
+            for index_key, index in ((key, self._by_request), ((service, operation), self._by_operation)):
+                interactions = index.get(index_key)
+                if interactions:
+                    position = self._positions[index_key]
+                    self._positions[index_key] = position + 1
+                    return interactions[position % len(interactions)]
+        return None
+
+    def _before_send_replay(self, request, event_name, **kwargs):
+        service, operation = _split_event_name(event_name)
+        interaction = self._next(service, operation, _request_key(service, operation, request))
+        if interaction is None:
+            raise CassetteError('No recorded response for {0}.{1} in {2}'.format(service, operation, self._path))
+
+        if self._simulate_latency:
+            time.sleep(interaction['latency'])
+
+        body = base64.b64decode(interaction['body'])
+        return AWSResponse(request.url, interaction['status'], interaction['headers'], _RecordedBody(body))
@@ -7,26 +7,45 @@
 # Standard libraries
 #
 
+from argparse import ArgumentTypeError
 from builtins import str
 from os import path
+import gc
 import json
+import tracemalloc
 
 #
 # Third party libraries
 #
 
+import boto3
+
 #
 # Internal libraries
 #
 
 import krux.cli
-from krux_boto.boto import add_boto_cli_arguments, get_boto, get_boto3, NAME
+from krux.cli import get_group
+from krux_boto.boto import add_boto_cli_arguments, get_boto, get_boto3, Boto3, NAME
+from krux_boto.latency import probe_regions, DEFAULT_SAMPLES
+from krux_boto.loadgen import (
+    parse_mix, LoadGenerator, MODELS, DEFAULT_MIX, DEFAULT_CONCURRENCY, DEFAULT_DURATION, DEFAULT_RETRIES,
+)
 from krux_boto.util import RegionCode
 
+# Version of krux-boto, see get_version()
+_VERSION = None
 
-class Application(krux.cli.Application):
 
-    def __init__(self, name=NAME, *args, **kwargs):
+def get_version():
+    """
+    Returns the version of krux-boto. version.json is only read on the first call.
+
+    :rtype: str
+    """
+    global _VERSION
+
+    if _VERSION is None:
         # Usually, a VERSION constant should be set in __init__.py and be imported.
         # However, krux-boto adds some basic classes to __init__.py and importing VERSION constant here
         # causes a dependency circle. Thus, set VERSION constant in version.json and import it.
@@ -34,16 +53,77 @@ class Application(krux.cli.Application):
         # under the root folder.
         _VERSION_PATH = path.join(path.dirname(path.dirname(__file__)), 'version.json')
         with open(_VERSION_PATH, 'r') as f:
-            self._VERSION = json.load(f).get('VERSION')
+            _VERSION = json.load(f).get('VERSION')
+
+    return _VERSION
+
+
+def _positive_int(value):
+    """
+    argparse type for an integer of at least 1.
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise ArgumentTypeError("expected an integer, got '{0}'".format(value))
+    if number < 1:
+        raise ArgumentTypeError("expected an integer of at least 1, got '{0}'".format(value))
+    return number
+
+
+class Application(krux.cli.Application):
+
+    def __init__(self, name=NAME, *args, **kwargs):
+        self._VERSION = get_version()
 
         self._VERSIONS[NAME] = self._VERSION
 
+        # GOTCHA: boto and boto3 are created on first access. Most applications only use one of them,
+        # and creating (and importing) the other one is a waste of start up time.
+        self._boto = None
+        self._boto3 = None
+
         # Call to the superclass to bootstrap.
         super(Application, self).__init__(name=name)
 
-        self.boto = get_boto(self.args, self.logger, self.stats)
+        # Log the AWS calls made by the application, so chatty code paths stand out
+        self.add_exit_hook(self._log_call_accounting)
+
+    @property
+    def boto(self):
+        """
+        The boto2 object, created on first access.
+
+        :rtype: krux_boto.boto.Boto
+        """
+        if self._boto is None:
+            self._boto = get_boto(self.args, self.logger, self.stats)
+        return self._boto
+
+    @boto.setter
+    def boto(self, value):
+        self._boto = value
+
+    @property
+    def boto3(self):
+        """
+        The boto3 object, created on first access.
+
+        :rtype: krux_boto.boto.Boto3
+        """
+        if self._boto3 is None:
+            self._boto3 = get_boto3(self.args, self.logger, self.stats)
+        return self._boto3
+
+    @boto3.setter
+    def boto3(self, value):
+        self._boto3 = value
 
-        self.boto3 = get_boto3(self.args, self.logger, self.stats)
+    def _log_call_accounting(self):
+        # GOTCHA: Do not create the boto objects just to find out they made no calls
+        for boto in (self._boto, self._boto3):
+            if boto is not None:
+                boto.call_accounting.log_summary(self.logger)
 
     def add_cli_arguments(self, parser):
         super(Application, self).add_cli_arguments(parser)
@@ -74,8 +154,202 @@ class Application(krux.cli.Application):
                 self.logger.warn('Region: %s', r)
 
 
+class BotoTestApplication(Application):
+    """
+    The krux-boto-test tool. Besides showing how the code works, it has a few diagnostic modes.
+    """
+    MODES = ('sample', 'latency', 'memory', 'loadgen')
+
+    def add_cli_arguments(self, parser):
+        super(BotoTestApplication, self).add_cli_arguments(parser)
+
+        group = get_group(parser, self.name)
+
+        group.add_argument(
+            'mode',
+            nargs='?',
+            default='sample',
+            choices=self.MODES,
+            help=(
+                "What to do. 'sample' lists the regions via boto2 and boto3, "
+                "'latency' measures the round trip time to every region, "
+                "'memory' measures the memory used by many boto3 sessions, "
+                "'loadgen' measures how many AWS calls per second boto3 can drive. (default: %(default)s)"
+            ),
+        )
+
+        group.add_argument(
+            '--latency-samples',
+            type=int,
+            default=DEFAULT_SAMPLES,
+            help="Number of round trips to measure per region in latency mode. (default: %(default)s)",
+        )
+
+        group.add_argument(
+            '--memory-sessions',
+            type=_positive_int,
+            default=10,
+            help="Number of sessions to create in memory mode. (default: %(default)s)",
+        )
+
+        group.add_argument(
+            '--memory-services',
+            type=lambda value: value.split(','),
+            default=['ec2', 's3'],
+            help="Comma separated list of services to create a client of per session in memory mode. (default: ec2,s3)",
+        )
+
+        group.add_argument(
+            '--loadgen-mix',
+            type=parse_mix,
+            default=parse_mix(DEFAULT_MIX),
+            help=(
+                "Operations to call in loadgen mode, as a comma separated list of service:operation[=weight], "
+                "or @ followed by the path of a JSON file listing service, operation, params and weight. "
+                "(default: {0})".format(DEFAULT_MIX)
+            ),
+        )
+
+        group.add_argument(
+            '--loadgen-model',
+            default='threads',
+            choices=MODELS,
+            help="How calls are made concurrently in loadgen mode. (default: %(default)s)",
+        )
+
+        group.add_argument(
+            '--loadgen-concurrency',
+            type=int,
+            default=DEFAULT_CONCURRENCY,
+            help="Number of calls in flight at once in loadgen mode. (default: %(default)s)",
+        )
+
+        group.add_argument(
+            '--loadgen-rate',
+            type=float,
+            default=None,
+            help="Calls per second to make in loadgen mode. Defaults to as many as the concurrency allows.",
+        )
+
+        group.add_argument(
+            '--loadgen-duration',
+            type=float,
+            default=DEFAULT_DURATION,
+            help="Seconds to run for in loadgen mode. (default: %(default)s)",
+        )
+
+        group.add_argument(
+            '--loadgen-processes',
+            type=int,
+            default=None,
+            help="Number of worker processes of the processes model in loadgen mode. Defaults to the number of CPUs.",
+        )
+
+        group.add_argument(
+            '--loadgen-retries',
+            type=int,
+            default=DEFAULT_RETRIES,
+            help="Number of retries allowed per call in loadgen mode. (default: %(default)s)",
+        )
+
+    def run(self):
+        if self.args.mode == 'latency':
+            self._latency()
+        elif self.args.mode == 'memory':
+            self._memory()
+        elif self.args.mode == 'loadgen':
+            self._loadgen()
+        else:
+            super(BotoTestApplication, self).run()
+
+    def _latency(self):
+        regions = self.boto3.get_valid_regions()
+        self.logger.warn('Probing %d regions with %d round trips each', len(regions), self.args.latency_samples)
+
+        self.logger.warn('%-16s %10s %10s %7s', 'Region', 'p50 (ms)', 'p99 (ms)', 'Errors')
+        for result in probe_regions(regions, samples=self.args.latency_samples):
+            if result.p50 is None:
+                self.logger.warn('%-16s %10s %10s %7d', result.region, '-', '-', result.errors)
+            else:
+                self.logger.warn(
+                    '%-16s %10.1f %10.1f %7d', result.region, result.p50, result.p99, result.errors
+                )
+
+    def _memory(self):
+        region = self.boto3.cli_region
+
+        def create_private():
+            # This is how a session was created before the loader was shared
+            return boto3.session.Session(region_name=region)
+
+        def create_shared():
+            return Boto3(
+                log_level=self.args.boto_log_level,
+                access_key=self.args.boto_access_key,
+                secret_key=self.args.boto_secret_key,
+                region=region,
+                logger=self.logger,
+                stats=self.stats,
+            )
+
+        tracemalloc.start()
+        try:
+            for label, create in (('private loaders', create_private), ('shared loader', create_shared)):
+                gc.collect()
+                before = tracemalloc.get_traced_memory()[0]
+
+                clients = []
+                for _ in range(self.args.memory_sessions):
+                    session = create()
+                    clients.extend(session.client(service) for service in self.args.memory_services)
+
+                used = tracemalloc.get_traced_memory()[0] - before
+                self.logger.warn(
+                    '%s: %d sessions with %s clients use %.1f MB (%.1f MB per session)',
+                    label,
+                    self.args.memory_sessions,
+                    ','.join(self.args.memory_services),
+                    used / 1024.0 / 1024.0,
+                    used / 1024.0 / 1024.0 / self.args.memory_sessions,
+                )
+
+                del clients
+                del session
+        finally:
+            tracemalloc.stop()
+
+    def _loadgen(self):
+        generator = LoadGenerator(
+            self.boto3,
+            self.args.loadgen_mix,
+            concurrency=self.args.loadgen_concurrency,
+            rate=self.args.loadgen_rate,
+            duration=self.args.loadgen_duration,
+            retries=self.args.loadgen_retries,
+            logger=self.logger,
+        )
+        report = generator.run(model=self.args.loadgen_model, processes=self.args.loadgen_processes)
+
+        self.logger.warn(
+            '%d calls in %.1fs: %.1f calls/s, %.2f ms of CPU per call',
+            report.calls, report.duration, report.throughput, report.cpu_per_call or 0,
+        )
+        if report.calls:
+            self.logger.warn(
+                'Latency (ms): p50 %.1f, p90 %.1f, p99 %.1f, max %.1f', report.p50, report.p90, report.p99, report.max,
+            )
+            self.logger.warn(
+                'Errors: %.2f%%, throttled: %.2f%%, retries: %d',
+                100.0 * report.errors / report.calls, 100.0 * report.throttles / report.calls, report.retries,
+            )
+
+        self.logger.warn('%-32s %10s %7s', 'Operation', 'Calls', 'Errors')
+        for name, (calls, errors) in sorted(report.operations.items()):
+            self.logger.warn('%-32s %10d %7d', name, calls, errors)
+
+
 def main():
-    app = Application()
+    app = BotoTestApplication()
     with app.context():
         app.run()
 
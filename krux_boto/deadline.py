@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from contextlib import contextmanager
+from functools import partial
+import re
+import threading
+import time
+
+#
+# Third party libraries
+#
+
+import botocore
+
+#
+# Internal libraries
+#
+
+from krux.logging import get_logger
+from krux_boto.util import Error, THROTTLING_ERROR_CODES
+
+# Error codes botocore retries even though their status code is not a 5xx
+_RETRYABLE_ERROR_CODES = THROTTLING_ERROR_CODES | frozenset([
+    'PriorRequestNotComplete',
+    'RequestTimeout',
+    'RequestTimeoutException',
+    'TransactionInProgressException',
+])
+
+_ATTEMPT_START_TIME_KEY = 'krux_boto_deadline_attempt_start_time'
+
+# botocore only honors a read timeout set in the context of a request from this version on
+_PER_REQUEST_READ_TIMEOUT_VERSION = (1, 43, 68)
+
+
+def _version(version):
+    return tuple(int(part) for part in re.findall(r'\d+', version)[:3])
+
+
+PER_REQUEST_READ_TIMEOUT = _version(botocore.__version__) >= _PER_REQUEST_READ_TIMEOUT_VERSION
+_warned = False
+
+_local = threading.local()
+
+
+class DeadlineExceededError(Error):
+    """
+    Raised when a call cannot complete before the deadline it was made under.
+    """
+    pass
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    Caps the total time of the calls made in the block by the clients of Boto3 objects, retries included,
+    to the given number of seconds from now. Deadlines only apply to calls made by the current thread.
+    A nested deadline can only make the deadline sooner.
+
+    :param seconds: Seconds from now
+    :type seconds: float
+    """
+    with deadline_at(time.time() + seconds):
+        yield
+
+
+@contextmanager
+def deadline_at(expires_at):
+    """
+    Like deadline(), with the deadline as a time since the epoch, i.e. to carry the deadline of a thread over
+    to the calls it hands to other threads. See current_deadline().
+
+    :param expires_at: Seconds since the epoch. Pass None to keep the deadline of the current thread, if any.
+    :type expires_at: float
+    """
+    previous = getattr(_local, 'expires_at', None)
+    if previous is not None and expires_at is not None:
+        expires_at = min(previous, expires_at)
+    elif expires_at is None:
+        expires_at = previous
+
+    _local.expires_at = expires_at
+    try:
+        yield
+    finally:
+        _local.expires_at = previous
+
+
+def current_deadline():
+    """
+    :return: Deadline of the current thread, in seconds since the epoch, or None if there is no deadline
+    :rtype: float
+    """
+    return getattr(_local, 'expires_at', None)
+
+
+def remaining():
+    """
+    :return: Seconds left before the deadline of the current thread, or None if there is no deadline
+    :rtype: float
+    """
+    expires_at = getattr(_local, 'expires_at', None)
+    if expires_at is None:
+        return None
+    return expires_at - time.time()
+
+
+def register_deadline(client):
+    """
+    Makes the calls of a boto3 client honor the deadline of the thread making them.
+
+    :param client: The client
+    :type client: botocore.client.BaseClient
+    """
+    client.meta.events.register_first('before-call.*.*', _before_call)
+    client.meta.events.register_first('before-send.*.*', partial(_before_send, client.meta.config.read_timeout))
+    client.meta.events.register_first('needs-retry.*.*', _needs_retry)
+
+
+def _check(left, operation_name):
+    if left <= 0:
+        raise DeadlineExceededError('Deadline exceeded before calling {0}'.format(operation_name))
+
+
+def _before_call(model, **kwargs):
+    left = remaining()
+    if left is not None:
+        _check(left, model.name)
+
+
+def _before_send(read_timeout, request, **kwargs):
+    global _warned
+
+    left = remaining()
+    if left is None:
+        return
+
+    _check(left, request.url)
+    if not PER_REQUEST_READ_TIMEOUT and not _warned:
+        _warned = True
+        get_logger('krux_boto').warn(
+            'botocore %s ignores per-request read timeouts. Deadlines only apply between attempts; '
+            'upgrade to botocore %s or later to shorten the attempts as well.',
+            botocore.__version__, '.'.join(str(part) for part in _PER_REQUEST_READ_TIMEOUT_VERSION),
+        )
+    # GOTCHA: botocore only lets the read timeout be overridden per request. The connect timeout stays.
+    request.context['read_timeout'] = min(read_timeout, left) if read_timeout else left
+    request.context[_ATTEMPT_START_TIME_KEY] = time.time()
+
+
+def _is_retryable(response, caught_exception):
+    if caught_exception is not None:
+        return True
+    http_response, parsed = response
+    if http_response.status_code >= 500:
+        return True
+    return parsed.get('Error', {}).get('Code') in _RETRYABLE_ERROR_CODES
+
+
+def _needs_retry(attempts, operation, request_dict, response=None, caught_exception=None, **kwargs):
+    left = remaining()
+    if left is None:
+        return None
+
+    if isinstance(caught_exception, DeadlineExceededError):
+        raise caught_exception
+    if not _is_retryable(response, caught_exception):
+        return None
+
+    # Stop retrying when there is less time left than the last attempt took
+    started_at = request_dict['context'].get(_ATTEMPT_START_TIME_KEY)
+    last_attempt = time.time() - started_at if started_at is not None else 0
+    if left <= last_attempt:
+        raise DeadlineExceededError(
+            'Deadline exceeded calling {0} after {1} attempts: {2}'.format(
+                operation.name, attempts, caught_exception or response[1].get('Error', {}).get('Code'),
+            )
+        )
+
+    # Let the retry handlers of botocore decide
+    return None
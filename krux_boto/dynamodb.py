@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+#
+# Third party libraries
+#
+
+from six.moves import queue
+
+#
+# Internal libraries
+#
+
+from krux.logging import get_logger
+
+# Constants
+DEFAULT_TOTAL_SEGMENTS = 8
+# Seconds a worker waits for room in the buffer before checking whether the scan was abandoned
+_PUT_TIMEOUT = 0.1
+
+
+class _ReadCapacityLimiter(object):
+    """
+    A token bucket shared by the segments of a scan, refilled with read_capacity units per second.
+
+    The capacity a page consumes is only known once it is returned, so each call waits until the
+    bucket is not in debt and then subtracts what the page actually consumed.
+    """
+
+    def __init__(self, read_capacity):
+        self._rate = float(read_capacity)
+        self._tokens = self._rate
+        self._updated_at = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self._tokens + (now - self._updated_at) * self._rate, self._rate)
+        self._updated_at = now
+
+    def wait(self, stop):
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 0:
+                    return
+                delay = -self._tokens / self._rate
+            if stop.wait(delay):
+                return
+
+    def consume(self, units):
+        with self._lock:
+            self._refill()
+            self._tokens -= units
+
+
+class DynamoDBParallelScan(object):
+    """
+    Scans a DynamoDB table with several segments in parallel, yielding the items of all the
+    segments as they arrive.
+
+    At most max_buffered_pages pages are held in memory, so slow consumers slow the scan down
+    instead of making it use more memory.
+
+    checkpoints maps each segment to the LastEvaluatedKey of the last page whose items were all
+    yielded, or to None once the segment is finished. Saving it and passing it back in resumes
+    the scan. Items may be yielded twice around a resume, but are never skipped.
+    """
+
+    def __init__(
+        self,
+        client,
+        table_name,
+        total_segments=DEFAULT_TOTAL_SEGMENTS,
+        max_workers=None,
+        max_buffered_pages=None,
+        read_capacity=None,
+        checkpoints=None,
+        scan_args=None,
+        logger=None,
+        stats=None,
+    ):
+        """
+        :param client: boto3 DynamoDB client
+        :type client: botocore.client.DynamoDB
+        :param table_name: Name of the table
+        :type table_name: str
+        :param total_segments: Number of segments the table is split into
+        :type total_segments: int
+        :param max_workers: Number of segments scanned at once. Defaults to all of them.
+        :type max_workers: int
+        :param max_buffered_pages: Maximum number of pages held in memory. Defaults to total_segments.
+        :type max_buffered_pages: int
+        :param read_capacity: Maximum number of read capacity units consumed per second. Defaults to no limit.
+        :type read_capacity: float
+        :param checkpoints: Checkpoints of a previous scan with the same total_segments, to resume it
+        :type checkpoints: dict[int, dict]
+        :param scan_args: Extra arguments for scan(), i.e. FilterExpression
+        :type scan_args: dict
+        :param logger: Logger, recommended to be obtained using krux.cli.Application
+        :type logger: logging.Logger
+        :param stats: Stats, recommended to be obtained using krux.cli.Application
+        :type stats: kruxstatsd.StatsClient
+        """
+        self._client = client
+        self._table_name = table_name
+        self._total_segments = total_segments
+        self._max_workers = max_workers or total_segments
+        self._max_buffered_pages = max_buffered_pages or total_segments
+        self._limiter = _ReadCapacityLimiter(read_capacity) if read_capacity else None
+        self._scan_args = scan_args or {}
+        self._logger = logger or get_logger('krux_boto')
+        self._stats = stats
+
+        self.checkpoints = dict((int(segment), key) for segment, key in (checkpoints or {}).items())
+
+    def __iter__(self):
+        segments = [
+            segment for segment in range(self._total_segments)
+            if segment not in self.checkpoints or self.checkpoints[segment] is not None
+        ]
+        if not segments:
+            return
+
+        self._logger.debug('Scanning %s with %d segments', self._table_name, len(segments))
+
+        pages = queue.Queue(maxsize=self._max_buffered_pages)
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=min(self._max_workers, len(segments)))
+        for segment in segments:
+            executor.submit(self._scan_segment, segment, self.checkpoints.get(segment), pages, stop)
+
+        try:
+            remaining = len(segments)
+            while remaining:
+                segment, items, last_key, error = pages.get()
+                if error is not None:
+                    raise error
+
+                for item in items:
+                    yield item
+
+                # GOTCHA: Only move the checkpoint once all the items of the page were consumed
+                self.checkpoints[segment] = last_key
+                if last_key is None:
+                    remaining -= 1
+        finally:
+            # Stops the workers if the caller stopped iterating early or a segment failed
+            stop.set()
+            executor.shutdown(wait=True)
+
+    def _scan_segment(self, segment, start_key, pages, stop):
+        args = dict(self._scan_args, TableName=self._table_name, Segment=segment, TotalSegments=self._total_segments)
+        if self._limiter is not None:
+            args['ReturnConsumedCapacity'] = 'TOTAL'
+
+        while not stop.is_set():
+            if start_key is not None:
+                args['ExclusiveStartKey'] = start_key
+
+            try:
+                if self._limiter is not None:
+                    self._limiter.wait(stop)
+                    if stop.is_set():
+                        return
+                start_time = time.time()
+                response = self._client.scan(**args)
+                if self._stats is not None:
+                    self._stats.timing('dynamodb.scan', (time.time() - start_time) * 1000)
+            except Exception as e:
+                self._put(pages, stop, (segment, None, None, e))
+                return
+
+            if self._limiter is not None:
+                self._limiter.consume(response.get('ConsumedCapacity', {}).get('CapacityUnits', 0))
+
+            start_key = response.get('LastEvaluatedKey')
+            self._put(pages, stop, (segment, response.get('Items', []), start_key, None))
+            if start_key is None:
+                return
+
+    def _put(self, pages, stop, page):
+        while not stop.is_set():
+            try:
+                pages.put(page, timeout=_PUT_TIMEOUT)
+                return
+            except queue.Full:
+                pass
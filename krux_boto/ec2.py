@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+#
+# Third party libraries
+#
+
+#
+# Internal libraries
+#
+
+from krux.logging import get_logger
+from krux_boto.records import RecordSchema, EC2_INSTANCE
+
+
+def _private_ips(instance):
+    ips = set()
+    if instance.get('PrivateIpAddress'):
+        ips.add(instance['PrivateIpAddress'])
+    for interface in instance.get('NetworkInterfaces', []):
+        for address in interface.get('PrivateIpAddresses', []):
+            if address.get('PrivateIpAddress'):
+                ips.add(address['PrivateIpAddress'])
+    return ips
+
+
+def _tags(instance):
+    return tuple((tag['Key'], tag['Value']) for tag in instance.get('Tags', []))
+
+
+class EC2Inventory(object):
+    """
+    An in-memory copy of the EC2 instances of several regions, indexed by instance ID, tag and private IP,
+    so looking instances up does not make any API call.
+
+    refresh() reads all the instances again and only updates the indexes of the instances that changed.
+    start() refreshes in a background thread every refresh_interval seconds. Lookups always see either
+    the previous or the new state of a region, never a mix of both.
+
+    With fields, instances are kept as records of those fields only (see krux_boto.records) instead of the
+    dicts returned by describe_instances(), which take an order of magnitude more memory. Lookups by tag
+    and private IP work whatever the fields.
+    """
+
+    def __init__(self, client_factory, regions, refresh_interval=None, logger=None, stats=None, fields=None):
+        """
+        :param client_factory: Function returning a boto3 EC2 client for a region name
+        :type client_factory: callable
+        :param regions: Names of the regions to read the instances of
+        :type regions: list[str]
+        :param refresh_interval: Seconds between refreshes in the background, once start() is called
+        :type refresh_interval: float
+        :param logger: Logger, recommended to be obtained using krux.cli.Application
+        :type logger: logging.Logger
+        :param stats: Stats, recommended to be obtained using krux.cli.Application
+        :type stats: kruxstatsd.StatsClient
+        :param fields: Names of the fields to keep of each instance, among krux_boto.records.FIELDS[EC2_INSTANCE].
+                       Defaults to keeping the whole dicts.
+        :type fields: list[str]
+        """
+        self._client_factory = client_factory
+        self._regions = [str(region) for region in regions]
+        self._refresh_interval = refresh_interval
+        self._logger = logger or get_logger('krux_boto')
+        self._stats = stats
+        self._schema = RecordSchema(EC2_INSTANCE, fields) if fields else None
+
+        self._lock = threading.RLock()
+        # Instances by ID, and the IDs of the instances of each region
+        self._instances = {}
+        self._region_ids = defaultdict(set)
+        # Tags and private IPs each instance is indexed by, by ID
+        self._index_keys = {}
+        # Indexes, from a key to a set of instance IDs
+        self._by_tag = defaultdict(set)
+        self._by_tag_key = defaultdict(set)
+        self._by_private_ip = defaultdict(set)
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Refreshes the inventory, then keeps refreshing it in a background thread every refresh_interval seconds.
+        """
+        self.refresh()
+        if self._refresh_interval is None or self._thread is not None:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='ec2-inventory')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops refreshing the inventory in the background.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def refresh(self):
+        """
+        Reads the instances of all the regions again and updates the indexes.
+        The previous state of a region is kept if it cannot be read.
+        """
+        start_time = time.time()
+
+        with ThreadPoolExecutor(max_workers=len(self._regions) or 1) as executor:
+            futures = dict((region, executor.submit(self._describe, region)) for region in self._regions)
+
+        for region, future in futures.items():
+            try:
+                instances = future.result()
+            except Exception as e:
+                self._logger.warn('Failed to refresh the EC2 instances of %s: %s', region, e)
+                continue
+            self._update_region(region, instances)
+
+        if self._stats is not None:
+            self._stats.timing('ec2.inventory_refresh', (time.time() - start_time) * 1000)
+
+    def get(self, instance_id):
+        """
+        :param instance_id: ID of the instance
+        :type instance_id: str
+        :return: The instance, as returned by describe_instances() or as a record, or None if it is unknown
+        :rtype: dict | tuple
+        """
+        return self._instances.get(instance_id)
+
+    def find_by_tag(self, key, value=None):
+        """
+        :param key: Key of the tag
+        :type key: str
+        :param value: Value of the tag. Defaults to any value.
+        :type value: str
+        :return: The instances with the tag, sorted by ID
+        :rtype: list[dict | tuple]
+        """
+        if value is None:
+            return self._lookup(self._by_tag_key, key)
+        return self._lookup(self._by_tag, (key, value))
+
+    def find_by_private_ip(self, ip):
+        """
+        :param ip: A private IP address of the instance, of any of its network interfaces
+        :type ip: str
+        :return: The instances with the IP, sorted by ID. There may be several across regions.
+        :rtype: list[dict | tuple]
+        """
+        return self._lookup(self._by_private_ip, ip)
+
+    def instances(self):
+        """
+        :return: All the instances, sorted by ID
+        :rtype: list[dict | tuple]
+        """
+        with self._lock:
+            return [self._instances[instance_id] for instance_id in sorted(self._instances)]
+
+    def __len__(self):
+        return len(self._instances)
+
+    def _run(self):
+        while not self._stop.wait(self._refresh_interval):
+            try:
+                self.refresh()
+            except Exception:
+                self._logger.exception('Failed to refresh the EC2 inventory')
+
+    def _describe(self, region):
+        client = self._client_factory(region)
+        instances = {}
+        for page in client.get_paginator('describe_instances').paginate():
+            for reservation in page.get('Reservations', []):
+                for instance in reservation.get('Instances', []):
+                    keys = (_tags(instance), _private_ips(instance))
+                    if self._schema is not None:
+                        instances[instance['InstanceId']] = (self._schema.record(instance), keys)
+                    else:
+                        instances[instance['InstanceId']] = (instance, keys)
+        return instances
+
+    def _lookup(self, index, key):
+        with self._lock:
+            return [self._instances[instance_id] for instance_id in sorted(index.get(key, ()))]
+
+    def _update_region(self, region, instances):
+        with self._lock:
+            previous_ids = self._region_ids[region]
+
+            for instance_id in previous_ids - set(instances):
+                del self._instances[instance_id]
+                self._unindex(instance_id)
+
+            changed = 0
+            for instance_id, (instance, keys) in instances.items():
+                # GOTCHA: Records may not have the tags and IPs. Compare those separately.
+                if self._instances.get(instance_id) == instance and self._index_keys.get(instance_id) == keys:
+                    continue
+                self._unindex(instance_id)
+                self._instances[instance_id] = instance
+                self._index(instance_id, keys)
+                changed += 1
+
+            self._region_ids[region] = set(instances)
+
+        self._logger.debug(
+            'Refreshed %d EC2 instances in %s: %d added or changed, %d removed',
+            len(instances), region, changed, len(previous_ids - set(instances)),
+        )
+
+    def _index(self, instance_id, keys):
+        tags, ips = keys
+        self._index_keys[instance_id] = keys
+        for key, value in tags:
+            self._by_tag[(key, value)].add(instance_id)
+            self._by_tag_key[key].add(instance_id)
+        for ip in ips:
+            self._by_private_ip[ip].add(instance_id)
+
+    def _unindex(self, instance_id):
+        keys = self._index_keys.pop(instance_id, None)
+        if keys is None:
+            return
+        tags, ips = keys
+        for index, keys in (
+            (self._by_tag, tags),
+            (self._by_tag_key, [key for key, _ in tags]),
+            (self._by_private_ip, ips),
+        ):
+            for key in keys:
+                ids = index.get(key)
+                if ids is not None:
+                    ids.discard(instance_id)
+                    if not ids:
+                        del index[key]
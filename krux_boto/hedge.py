@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from functools import wraps
+import threading
+import time
+
+#
+# Third party libraries
+#
+
+#
+# Internal libraries
+#
+
+from krux.logging import get_logger
+from krux_boto.deadline import current_deadline, deadline_at
+from krux_boto.latency import percentile
+
+# Constants
+# Idempotent reads whose latency is worth hedging
+DEFAULT_HEDGED_OPERATIONS = ('get_object', 'head_object', 'get_item')
+# Delay before hedging, in seconds, until enough latencies were observed to use their p95
+DEFAULT_HEDGE_DELAY = 0.1
+# Maximum number of hedges, as a fraction of the calls
+DEFAULT_MAX_EXTRA_LOAD = 0.05
+DEFAULT_HEDGE_WORKERS = 32
+# Number of recent latencies the p95 of each operation is computed from
+_LATENCY_WINDOW = 1000
+_MIN_LATENCY_SAMPLES = 50
+
+
+class _OperationLatency(object):
+    """
+    Recent latencies of an operation, and their p95.
+    """
+
+    def __init__(self):
+        self._latencies = deque(maxlen=_LATENCY_WINDOW)
+        # GOTCHA: Count the additions. The length of the window stops growing once it is full.
+        self._added = 0
+        self._p95 = None
+        self._lock = threading.Lock()
+
+    def add(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+            self._added += 1
+            # GOTCHA: Sorting the window on every call would cost more than the hedging saves
+            if self._added % _MIN_LATENCY_SAMPLES == 0:
+                self._p95 = percentile(list(self._latencies), 95)
+
+    @property
+    def p95(self):
+        return self._p95
+
+
+def _call_with_deadline(expires_at, method, args, kwargs):
+    # GOTCHA: Deadlines are per thread. Carry the one of the caller over to the thread of the executor.
+    with deadline_at(expires_at):
+        return method(*args, **kwargs)
+
+
+def _close_body(future):
+    """
+    Releases the connection of a response nobody is going to read.
+    """
+    if future.cancelled() or future.exception() is not None:
+        return
+    body = future.result().get('Body')
+    if body is not None:
+        body.close()
+
+
+class HedgedClient(object):
+    """
+    Wraps a boto3 client so slow calls of idempotent reads are hedged: if a call has not returned
+    after a delay, the same call is made again, and whichever returns first is used. The other one
+    cannot be interrupted, but its result is discarded and its connection released.
+
+    The delay is either fixed or, by default, the p95 latency observed for the operation. Hedges are
+    capped at max_extra_load times the number of calls, so a slow endpoint does not get twice the load.
+    Every other attribute is the one of the wrapped client.
+
+    The calls run in a thread pool of the HedgedClient. Close it once done with it, or use it as a context manager.
+    """
+
+    def __init__(
+        self,
+        client,
+        operations=DEFAULT_HEDGED_OPERATIONS,
+        delay=None,
+        max_extra_load=DEFAULT_MAX_EXTRA_LOAD,
+        max_workers=DEFAULT_HEDGE_WORKERS,
+        logger=None,
+        stats=None,
+    ):
+        """
+        :param client: boto3 client to wrap
+        :type client: botocore.client.BaseClient
+        :param operations: Names of the client methods to hedge. They must be idempotent.
+        :type operations: list[str]
+        :param delay: Seconds to wait before hedging. Defaults to the p95 latency observed for the operation.
+        :type delay: float
+        :param max_extra_load: Maximum number of hedges, as a fraction of the calls
+        :type max_extra_load: float
+        :param max_workers: Maximum number of calls in progress at once, hedges included
+        :type max_workers: int
+        :param logger: Logger, recommended to be obtained using krux.cli.Application
+        :type logger: logging.Logger
+        :param stats: Stats, recommended to be obtained using krux.cli.Application
+        :type stats: kruxstatsd.StatsClient
+        """
+        self._client = client
+        self._operations = frozenset(operations)
+        self._delay = delay
+        self._max_extra_load = max_extra_load
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._logger = logger or get_logger('krux_boto')
+        self._stats = stats
+
+        self._latencies = dict((operation, _OperationLatency()) for operation in self._operations)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Shuts down the thread pool, waiting for the calls in progress, then closes the wrapped client.
+        """
+        self._executor.shutdown(wait=True)
+        # GOTCHA: This hides the close() of the wrapped client, which older versions of botocore do not have
+        close = getattr(self._client, 'close', None)
+        if close is not None:
+            close()
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name not in self._operations:
+            return attr
+
+        @wraps(attr)
+        def hedged(*args, **kwargs):
+            return self._call(name, attr, args, kwargs)
+        return hedged
+
+    def _incr(self, stat):
+        if self._stats is not None:
+            self._stats.incr(stat)
+
+    def _hedge_delay(self, operation):
+        if self._delay is not None:
+            return self._delay
+        p95 = self._latencies[operation].p95
+        return p95 if p95 is not None else DEFAULT_HEDGE_DELAY
+
+    def _reserve_hedge(self):
+        with self._lock:
+            if self.hedges + 1 > self.calls * self._max_extra_load:
+                return False
+            self.hedges += 1
+            return True
+
+    def _call(self, operation, method, args, kwargs):
+        with self._lock:
+            self.calls += 1
+
+        start_time = time.time()
+        expires_at = current_deadline()
+        primary = self._executor.submit(_call_with_deadline, expires_at, method, args, kwargs)
+        done, _ = wait([primary], timeout=self._hedge_delay(operation))
+        if done or not self._reserve_hedge():
+            result = primary.result()
+            self._latencies[operation].add(time.time() - start_time)
+            return result
+
+        self._incr('hedge.{0}.sent'.format(operation))
+        hedge = self._executor.submit(_call_with_deadline, expires_at, method, args, kwargs)
+        pending = set([primary, hedge])
+        winner = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            # Prefer a successful response. Only give up when both calls failed.
+            for future in done:
+                if future.exception() is None:
+                    winner = future
+                    break
+            if winner is not None:
+                break
+        if winner is None:
+            winner = primary
+
+        for future in (primary, hedge):
+            if future is not winner:
+                future.cancel()
+                future.add_done_callback(_close_body)
+
+        if winner is hedge:
+            with self._lock:
+                self.hedge_wins += 1
+            self._incr('hedge.{0}.won'.format(operation))
+
+        self._latencies[operation].add(time.time() - start_time)
+        return winner.result()
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import json
+import math
+import os
+import socket
+import time
+
+#
+# Third party libraries
+#
+
+#
+# Internal libraries
+#
+
+from krux.logging import get_logger
+from krux_boto.util import Error, RegionCode, write_json
+
+# Constants
+DEFAULT_SAMPLES = 5
+DEFAULT_TIMEOUT = 2
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'krux-boto', 'region-latency.json')
+DEFAULT_CACHE_TTL = 24 * 60 * 60
+_PROBE_PORT = 443
+
+RegionLatency = namedtuple('RegionLatency', ['region', 'p50', 'p99', 'errors'])
+
+
+def percentile(samples, pct):
+    """
+    Returns the nearest-rank percentile of the samples.
+
+    :param samples: List of numbers
+    :type samples: list[float]
+    :param pct: Percentile, between 0 and 100
+    :type pct: float
+    :return: The percentile, or None if there are no samples
+    :rtype: float
+    """
+    if not samples:
+        return None
+
+    ordered = sorted(samples)
+    rank = max(int(math.ceil(pct / 100.0 * len(ordered))), 1)
+    return ordered[rank - 1]
+
+
+def _endpoint_host(region):
+    # GOTCHA: The China regions live under a different domain
+    suffix = 'amazonaws.com.cn' if region.startswith('cn-') else 'amazonaws.com'
+    return 'ec2.{0}.{1}'.format(region, suffix)
+
+
+def probe_region(region, samples=DEFAULT_SAMPLES, timeout=DEFAULT_TIMEOUT):
+    """
+    Measures the round trip time to the EC2 endpoint of a region.
+
+    Each sample is the time a TCP handshake takes, which is one round trip. The host is resolved
+    up front so DNS does not count towards the samples.
+
+    :param region: Name of the region, i.e. 'us-east-1'
+    :type region: str
+    :param samples: Number of round trips to measure
+    :type samples: int
+    :param timeout: Timeout of each round trip, in seconds
+    :type timeout: float
+    :return: Latency of the region, in milliseconds
+    :rtype: krux_boto.latency.RegionLatency
+    """
+    try:
+        address = socket.getaddrinfo(_endpoint_host(region), _PROBE_PORT, 0, socket.SOCK_STREAM)[0][4]
+    except socket.error:
+        return RegionLatency(region=region, p50=None, p99=None, errors=samples)
+
+    rtts = []
+    errors = 0
+    for _ in range(samples):
+        start = time.time()
+        try:
+            sock = socket.create_connection(address[:2], timeout=timeout)
+        except socket.error:
+            errors += 1
+            continue
+        rtts.append((time.time() - start) * 1000)
+        sock.close()
+
+    return RegionLatency(region=region, p50=percentile(rtts, 50), p99=percentile(rtts, 99), errors=errors)
+
+
+def probe_regions(regions, samples=DEFAULT_SAMPLES, timeout=DEFAULT_TIMEOUT):
+    """
+    Measures the round trip time to the EC2 endpoints of all the regions concurrently.
+
+    :param regions: Names of the regions
+    :type regions: list[str]
+    :param samples: Number of round trips to measure per region
+    :type samples: int
+    :param timeout: Timeout of each round trip, in seconds
+    :type timeout: float
+    :return: Latency of the regions, fastest first. Regions that could not be reached come last.
+    :rtype: list[krux_boto.latency.RegionLatency]
+    """
+    regions = [str(region) for region in regions]
+    if not regions:
+        return []
+
+    with ThreadPoolExecutor(max_workers=len(regions)) as executor:
+        results = list(executor.map(lambda region: probe_region(region, samples, timeout), regions))
+
+    return sorted(results, key=lambda result: (result.p50 is None, result.p50))
+
+
+def get_nearest_region(regions=None, cache_path=DEFAULT_CACHE_PATH, ttl=DEFAULT_CACHE_TTL, samples=DEFAULT_SAMPLES):
+    """
+    Returns the region with the lowest latency from here.
+
+    The result is cached on disk for ttl seconds, since probing every region takes a while.
+
+    :param regions: Names of the regions to choose from. Defaults to the regions in RegionCode.
+    :type regions: list[str]
+    :param cache_path: Path of the cache file. Pass None to disable the cache.
+    :type cache_path: str
+    :param ttl: Lifetime of the cache, in seconds
+    :type ttl: int
+    :param samples: Number of round trips to measure per region
+    :type samples: int
+    :return: Name of the nearest region
+    :rtype: str
+    """
+    if regions is None:
+        regions = list(RegionCode.Region)
+    regions = sorted(str(region) for region in regions)
+
+    logger = get_logger('krux_boto')
+
+    if cache_path is not None:
+        try:
+            with open(cache_path, 'r') as f:
+                cache = json.load(f)
+            if cache.get('regions') == regions and time.time() - cache.get('timestamp', 0) < ttl:
+                return cache['region']
+        except (IOError, OSError, ValueError):
+            pass
+
+    results = probe_regions(regions, samples=samples)
+    if not results or results[0].p50 is None:
+        raise Error('Could not reach any of the regions: {0}'.format(', '.join(regions)))
+
+    nearest = results[0].region
+    logger.debug('Nearest region is %s (%.1f ms)', nearest, results[0].p50)
+
+    if cache_path is not None:
+        try:
+            write_json(cache_path, {'timestamp': time.time(), 'regions': regions, 'region': nearest})
+        except (IOError, OSError) as e:
+            logger.debug('Failed to cache the nearest region in %s: %s', cache_path, e)
+
+    return nearest
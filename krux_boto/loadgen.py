@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import json
+import multiprocessing
+import random
+import threading
+import time
+
+#
+# Third party libraries
+#
+
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+#
+# Internal libraries
+#
+
+from krux.logging import get_logger
+from krux_boto.latency import percentile
+from krux_boto.util import THROTTLING_ERROR_CODES
+
+# Constants
+MODELS = ('threads', 'processes', 'asyncio')
+DEFAULT_MIX = 'sts:get_caller_identity'
+DEFAULT_CONCURRENCY = 10
+DEFAULT_DURATION = 10
+DEFAULT_RETRIES = 0
+
+Operation = namedtuple('Operation', ['service', 'name', 'params', 'weight'])
+
+LoadReport = namedtuple('LoadReport', [
+    'calls', 'errors', 'throttles', 'retries', 'duration', 'throughput',
+    'p50', 'p90', 'p99', 'max', 'cpu_per_call', 'operations',
+])
+
+
+def parse_mix(value):
+    """
+    Parses an operation mix. It is either a comma separated list of service:operation, each optionally
+    followed by =weight, i.e. 's3:list_buckets=3,sqs:list_queues', or '@' followed by the path of a JSON file
+    holding a list of objects with service, operation, and optionally params and weight.
+
+    :param value: The operation mix
+    :type value: str
+    :return: The operations of the mix
+    :rtype: list[krux_boto.loadgen.Operation]
+    """
+    if value.startswith('@'):
+        with open(value[1:], 'r') as f:
+            specs = json.load(f)
+        operations = [
+            Operation(spec['service'], spec['operation'], spec.get('params', {}), float(spec.get('weight', 1)))
+            for spec in specs
+        ]
+    else:
+        operations = []
+        for item in value.split(','):
+            item = item.strip()
+            if not item:
+                continue
+            name, _, weight = item.partition('=')
+            service, separator, operation = name.partition(':')
+            if not separator or not service or not operation:
+                raise ValueError('Expected service:operation[=weight], got {0}'.format(item))
+            operations.append(Operation(service.strip(), operation.strip(), {}, float(weight) if weight else 1.0))
+
+    if not operations or any(operation.weight <= 0 for operation in operations):
+        raise ValueError('The operation mix needs at least one operation, and all weights must be positive')
+    return operations
+
+
+class _Recorder(object):
+    """
+    Outcome of the calls made by a load run. Shared by the workers of a process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+        self.throttles = 0
+        self.retries = 0
+        self.operations = {}
+
+    def record(self, operation, latency, retries=0, error_code=None, failed=False):
+        with self._lock:
+            self.latencies.append(latency)
+            self.retries += retries
+            counts = self.operations.setdefault(operation, [0, 0])
+            counts[0] += 1
+            if failed:
+                self.errors += 1
+                counts[1] += 1
+                if error_code in THROTTLING_ERROR_CODES:
+                    self.throttles += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'latencies': list(self.latencies),
+                'errors': self.errors,
+                'throttles': self.throttles,
+                'retries': self.retries,
+                'operations': dict((name, list(counts)) for name, counts in self.operations.items()),
+            }
+
+    def merge(self, state):
+        with self._lock:
+            self.latencies.extend(state['latencies'])
+            self.errors += state['errors']
+            self.throttles += state['throttles']
+            self.retries += state['retries']
+            for name, (calls, errors) in state['operations'].items():
+                counts = self.operations.setdefault(name, [0, 0])
+                counts[0] += calls
+                counts[1] += errors
+
+
+class _Pacer(object):
+    """
+    Open loop schedule of calls at a fixed rate, shared by the workers of a process.
+    """
+
+    def __init__(self, rate, start_time):
+        self._interval = 1.0 / rate
+        self._start_time = start_time
+        self._sent = 0
+        self._lock = threading.Lock()
+
+    def next(self):
+        """
+        :return: When the next call is due
+        :rtype: float
+        """
+        with self._lock:
+            due = self._start_time + self._sent * self._interval
+            self._sent += 1
+            return due
+
+
+class LoadGenerator(object):
+    """
+    Drives a weighted mix of AWS calls through the clients of a Boto3 object for a fixed duration, and
+    reports the throughput, latency, errors and client side CPU time of the calls.
+
+    Without a rate, every worker makes its next call as soon as the previous one returns (closed loop).
+    With a rate, calls are scheduled at fixed intervals whether or not the previous ones returned (open loop),
+    and their latency is measured from when they were due. This way, a stack that cannot keep up shows
+    its queueing delay in the percentiles instead of silently lowering the rate.
+    """
+
+    def __init__(
+        self,
+        boto3,
+        mix,
+        concurrency=DEFAULT_CONCURRENCY,
+        rate=None,
+        duration=DEFAULT_DURATION,
+        retries=DEFAULT_RETRIES,
+        seed=None,
+        logger=None,
+    ):
+        """
+        :param boto3: Boto3 object to create the clients from
+        :type boto3: krux_boto.boto.Boto3
+        :param mix: Operations to call, see parse_mix()
+        :type mix: list[krux_boto.loadgen.Operation]
+        :param concurrency: Number of calls in flight at once
+        :type concurrency: int
+        :param rate: Calls per second to schedule. Defaults to as many as the concurrency allows.
+        :type rate: float
+        :param duration: Seconds to run for
+        :type duration: float
+        :param retries: Number of retries botocore is allowed per call. Defaults to none, so throttling
+                        shows up as errors instead of as latency.
+        :type retries: int
+        :param seed: Seed of the choice of operations, for repeatable runs
+        :type seed: int
+        :param logger: Logger, recommended to be obtained using krux.cli.Application
+        :type logger: logging.Logger
+        """
+        self._boto3 = boto3
+        self._mix = list(mix)
+        self._concurrency = concurrency
+        self._rate = rate
+        self._duration = duration
+        self._retries = retries
+        self._seed = seed
+        self._logger = logger or get_logger('krux_boto')
+
+        total = float(sum(operation.weight for operation in self._mix))
+        self._cumulative_weights = []
+        cumulative = 0
+        for operation in self._mix:
+            cumulative += operation.weight / total
+            self._cumulative_weights.append(cumulative)
+
+    def run(self, model='threads', processes=None):
+        """
+        Runs the load.
+
+        :param model: How calls are made concurrently: 'threads', 'processes' (concurrency and rate are split
+                      across the worker processes) or 'asyncio' (an event loop offloading the calls to threads)
+        :type model: str
+        :param processes: Number of worker processes of the 'processes' model. Defaults to the number of CPUs.
+        :type processes: int
+        :rtype: krux_boto.loadgen.LoadReport
+        """
+        if model not in MODELS:
+            raise ValueError('Unknown concurrency model {0}, expected one of {1}'.format(model, ', '.join(MODELS)))
+
+        self._logger.info(
+            'Running %s for %ss with %s concurrency %d and rate %s',
+            ','.join('{0}:{1}'.format(op.service, op.name) for op in self._mix),
+            self._duration, model, self._concurrency, self._rate or 'unbounded',
+        )
+
+        recorder = _Recorder()
+        start_time = time.time()
+        if model == 'processes':
+            cpu_time = self._run_processes(recorder, processes)
+        else:
+            cpu_start = time.process_time()
+            if model == 'threads':
+                self._run_threads(recorder)
+            else:
+                self._run_asyncio(recorder)
+            cpu_time = time.process_time() - cpu_start
+        duration = time.time() - start_time
+
+        return self._report(recorder, duration, cpu_time)
+
+    def _settings(self, concurrency, rate, seed):
+        return {
+            'mix': self._mix,
+            'concurrency': concurrency,
+            'rate': rate,
+            'duration': self._duration,
+            'retries': self._retries,
+            'seed': seed,
+        }
+
+    def _clients(self):
+        # GOTCHA: The connection pool must be at least as large as the concurrency, or calls queue for a connection
+        config = Config(
+            max_pool_connections=max(self._concurrency, 10),
+            retries={'total_max_attempts': self._retries + 1, 'mode': 'standard'},
+        )
+        services = set(operation.service for operation in self._mix)
+        return dict((service, self._boto3.client(service, config=config)) for service in services)
+
+    def _pick(self, rng):
+        draw = rng.random()
+        for operation, cumulative in zip(self._mix, self._cumulative_weights):
+            if draw < cumulative:
+                return operation
+        return self._mix[-1]
+
+    def _call(self, client, operation, recorder, due):
+        start_time = time.time() if due is None else due
+        try:
+            response = getattr(client, operation.name)(**operation.params)
+            # Streaming bodies must be read for the connection to go back to the pool
+            body = response.get('Body')
+            if body is not None:
+                body.read()
+                body.close()
+        except ClientError as e:
+            error = e.response.get('Error', {})
+            retries = e.response.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+            recorder.record(
+                operation.name, time.time() - start_time, retries=retries, error_code=error.get('Code'), failed=True,
+            )
+        except Exception as e:
+            self._logger.debug('Call to %s.%s failed: %s', operation.service, operation.name, e)
+            recorder.record(operation.name, time.time() - start_time, failed=True)
+        else:
+            retries = response.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+            recorder.record(operation.name, time.time() - start_time, retries=retries)
+
+    def _next_call(self, pacer, stop_time):
+        """
+        :return: Whether the run goes on, and when the next call is due. The due time is None without a rate.
+        :rtype: tuple[bool, float]
+        """
+        if pacer is None:
+            return time.time() < stop_time, None
+        due = pacer.next()
+        return due < stop_time, due
+
+    def _run_threads(self, recorder):
+        clients = self._clients()
+        start_time = time.time()
+        stop_time = start_time + self._duration
+        pacer = _Pacer(self._rate, start_time) if self._rate else None
+
+        def work(index):
+            rng = random.Random(None if self._seed is None else self._seed + index)
+            while True:
+                running, due = self._next_call(pacer, stop_time)
+                if not running:
+                    return
+                if due is not None:
+                    delay = due - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                operation = self._pick(rng)
+                self._call(clients[operation.service], operation, recorder, due)
+
+        threads = [threading.Thread(target=work, args=(index,)) for index in range(self._concurrency)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _run_asyncio(self, recorder):
+        clients = self._clients()
+        # GOTCHA: boto3 has no asynchronous API; the event loop only schedules, the calls run in threads
+        executor = ThreadPoolExecutor(max_workers=self._concurrency)
+        loop = asyncio.new_event_loop()
+
+        async def work(index, pacer, stop_time):
+            rng = random.Random(None if self._seed is None else self._seed + index)
+            while True:
+                running, due = self._next_call(pacer, stop_time)
+                if not running:
+                    return
+                if due is not None:
+                    delay = due - time.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                operation = self._pick(rng)
+                await loop.run_in_executor(
+                    executor, self._call, clients[operation.service], operation, recorder, due,
+                )
+
+        async def run():
+            start_time = time.time()
+            pacer = _Pacer(self._rate, start_time) if self._rate else None
+            await asyncio.gather(*[
+                work(index, pacer, start_time + self._duration) for index in range(self._concurrency)
+            ])
+
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+            executor.shutdown(wait=True)
+
+    def _run_processes(self, recorder, processes):
+        processes = processes or multiprocessing.cpu_count()
+        processes = min(processes, self._concurrency)
+        tasks = []
+        for index in range(processes):
+            # Spread the remainder over the first processes so the total concurrency is the requested one
+            concurrency = self._concurrency // processes + (1 if index < self._concurrency % processes else 0)
+            rate = self._rate / processes if self._rate else None
+            seed = None if self._seed is None else self._seed + index * self._concurrency
+            tasks.append(self._settings(concurrency, rate, seed))
+
+        cpu_time = 0
+        for state, worker_cpu_time in self._boto3.process_map(_run_process_worker, tasks, processes=processes):
+            recorder.merge(state)
+            cpu_time += worker_cpu_time
+        return cpu_time
+
+    def _report(self, recorder, duration, cpu_time):
+        latencies = [latency * 1000 for latency in recorder.latencies]
+        calls = len(latencies)
+        return LoadReport(
+            calls=calls,
+            errors=recorder.errors,
+            throttles=recorder.throttles,
+            retries=recorder.retries,
+            duration=duration,
+            throughput=calls / duration if duration > 0 else 0.0,
+            p50=percentile(latencies, 50),
+            p90=percentile(latencies, 90),
+            p99=percentile(latencies, 99),
+            max=max(latencies) if latencies else None,
+            cpu_per_call=cpu_time * 1000 / calls if calls else None,
+            operations=dict((name, tuple(counts)) for name, counts in recorder.operations.items()),
+        )
+
+
+def _run_process_worker(boto3, settings):
+    """
+    Runs a share of the load in a worker process of LoadGenerator.run(model='processes').
+    """
+    recorder = _Recorder()
+    cpu_start = time.process_time()
+    LoadGenerator(boto3, **settings)._run_threads(recorder)
+    return recorder.to_dict(), time.process_time() - cpu_start
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from array import array
+from collections import namedtuple
+import calendar
+import threading
+
+#
+# Third party libraries
+#
+
+from six.moves import intern
+
+#
+# Internal libraries
+#
+
+# Kinds of fields, which decide how they are stored in columns
+INT = 'int'
+STR = 'str'
+# A string with few distinct values, i.e. an instance type. Stored once per value.
+CATEGORY = 'category'
+OBJECT = 'object'
+
+S3_OBJECT = 's3_object'
+EC2_INSTANCE = 'ec2_instance'
+
+Field = namedtuple('Field', ['kind', 'extract'])
+
+
+def _get(*path):
+    def extract(item):
+        for name in path:
+            if item is None:
+                return None
+            item = item.get(name)
+        return item
+    return extract
+
+
+def _epoch(*path):
+    get = _get(*path)
+
+    def extract(item):
+        value = get(item)
+        # GOTCHA: botocore parses timestamps into timezone aware datetimes
+        return calendar.timegm(value.utctimetuple()) if value is not None else 0
+    return extract
+
+
+def _int(*path):
+    get = _get(*path)
+    return lambda item: get(item) or 0
+
+
+def _etag(item):
+    etag = item.get('ETag')
+    return etag.strip('"') if etag is not None else None
+
+
+def _tags(item):
+    return tuple(sorted((tag['Key'], tag['Value']) for tag in item.get('Tags', [])))
+
+
+# The fields records of each kind can have, and how to read them from the items returned by botocore
+FIELDS = {
+    S3_OBJECT: {
+        'key': Field(STR, _get('Key')),
+        'size': Field(INT, _int('Size')),
+        'etag': Field(STR, _etag),
+        'last_modified': Field(INT, _epoch('LastModified')),
+        'storage_class': Field(CATEGORY, _get('StorageClass')),
+    },
+    EC2_INSTANCE: {
+        'instance_id': Field(STR, _get('InstanceId')),
+        'instance_type': Field(CATEGORY, _get('InstanceType')),
+        'state': Field(CATEGORY, _get('State', 'Name')),
+        'availability_zone': Field(CATEGORY, _get('Placement', 'AvailabilityZone')),
+        'image_id': Field(CATEGORY, _get('ImageId')),
+        'key_name': Field(CATEGORY, _get('KeyName')),
+        'vpc_id': Field(CATEGORY, _get('VpcId')),
+        'subnet_id': Field(CATEGORY, _get('SubnetId')),
+        'private_ip': Field(STR, _get('PrivateIpAddress')),
+        'public_ip': Field(STR, _get('PublicIpAddress')),
+        'launch_time': Field(INT, _epoch('LaunchTime')),
+        'tags': Field(OBJECT, _tags),
+    },
+}
+
+DEFAULT_FIELDS = {
+    S3_OBJECT: ('key', 'size', 'etag', 'last_modified'),
+    EC2_INSTANCE: ('instance_id', 'instance_type', 'state', 'private_ip', 'launch_time', 'tags'),
+}
+
+# Record classes, by kind and fields
+_record_classes = {}
+_record_classes_lock = threading.Lock()
+
+
+def _make_record(kind, fields, values):
+    return RecordSchema(kind, fields).record_class(*values)
+
+
+def _record_class(kind, fields):
+    with _record_classes_lock:
+        record_class = _record_classes.get((kind, fields))
+        if record_class is None:
+            name = ''.join(part.title() for part in kind.split('_')) + 'Record'
+            # GOTCHA: Classes created on the fly cannot be pickled by reference. Pickle the values instead.
+            record_class = type(name, (namedtuple(name, fields),), {
+                '__slots__': (),
+                '__reduce__': lambda self: (_make_record, (kind, fields, tuple(self))),
+            })
+            _record_classes[(kind, fields)] = record_class
+        return record_class
+
+
+class RecordSchema(object):
+    """
+    Turns the items returned by botocore, i.e. the objects of a ListObjectsV2 page, into records holding only
+    the given fields. Records are named tuples, a fraction of the size of the dicts they are read from.
+    """
+
+    def __init__(self, kind, fields=None):
+        """
+        :param kind: Kind of the items, S3_OBJECT or EC2_INSTANCE
+        :type kind: str
+        :param fields: Names of the fields to keep, among the keys of FIELDS[kind]. Defaults to DEFAULT_FIELDS[kind].
+        :type fields: list[str]
+        """
+        if kind not in FIELDS:
+            raise ValueError('Unknown kind of records {0}, expected one of {1}'.format(kind, ', '.join(sorted(FIELDS))))
+        fields = tuple(fields or DEFAULT_FIELDS[kind])
+        unknown = [field for field in fields if field not in FIELDS[kind]]
+        if unknown:
+            raise ValueError('Unknown fields of {0} records: {1}'.format(kind, ', '.join(unknown)))
+
+        self.kind = kind
+        self.fields = fields
+        self.record_class = _record_class(kind, fields)
+        self._specs = [FIELDS[kind][field] for field in fields]
+
+    def __reduce__(self):
+        return RecordSchema, (self.kind, self.fields)
+
+    def values(self, item):
+        """
+        :param item: An item returned by botocore
+        :type item: dict
+        :return: The values of the fields of the item, in order
+        :rtype: list
+        """
+        values = []
+        for spec in self._specs:
+            value = spec.extract(item)
+            if spec.kind == CATEGORY and value is not None:
+                value = intern(str(value))
+            values.append(value)
+        return values
+
+    def record(self, item):
+        """
+        :param item: An item returned by botocore
+        :type item: dict
+        :return: A record of the item
+        :rtype: tuple
+        """
+        return self.record_class(*self.values(item))
+
+    def columns(self, items=()):
+        """
+        :param items: Items returned by botocore to start with
+        :type items: collections.Iterable[dict]
+        :return: Columns holding the items
+        :rtype: krux_boto.records.Columns
+        """
+        columns = Columns(self)
+        columns.extend(items)
+        return columns
+
+
+class Columns(object):
+    """
+    Items held as one column per field, for listings too large to hold even as records: integers are packed
+    in arrays of 8 bytes per item, and strings with few distinct values are stored once and referred to by
+    a 4 byte code. Indexing and iterating yield records.
+    """
+
+    def __init__(self, schema):
+        """
+        :param schema: Schema of the items
+        :type schema: krux_boto.records.RecordSchema
+        """
+        self.schema = schema
+        self._columns = []
+        # Per CATEGORY column, the distinct values and their codes
+        self._categories = {}
+        for field, spec in zip(schema.fields, schema._specs):
+            if spec.kind == INT:
+                self._columns.append(array('q'))
+            elif spec.kind == CATEGORY:
+                self._columns.append(array('i'))
+                self._categories[field] = ([], {})
+            else:
+                self._columns.append([])
+        self._length = 0
+
+    def append(self, item):
+        """
+        :param item: An item returned by botocore
+        :type item: dict
+        """
+        for field, column, value in zip(self.schema.fields, self._columns, self.schema.values(item)):
+            if field in self._categories:
+                values, codes = self._categories[field]
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(values)
+                    values.append(value)
+                value = code
+            column.append(value)
+        self._length += 1
+
+    def extend(self, items):
+        """
+        :param items: Items returned by botocore
+        :type items: collections.Iterable[dict]
+        """
+        for item in items:
+            self.append(item)
+
+    def column(self, field):
+        """
+        :param field: Name of the field
+        :type field: str
+        :return: The values of the field, in order. Integers are returned as an array.array, without a copy.
+        :rtype: collections.Sequence
+        """
+        try:
+            column = self._columns[self.schema.fields.index(field)]
+        except ValueError:
+            raise KeyError(field)
+        if field in self._categories:
+            values = self._categories[field][0]
+            return [values[code] for code in column]
+        return column
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('Columns index out of range')
+
+        values = []
+        for field, column in zip(self.schema.fields, self._columns):
+            value = column[index]
+            if field in self._categories:
+                value = self._categories[field][0][value]
+            values.append(value)
+        return self.schema.record_class(*values)
+
+    def __iter__(self):
+        for index in range(self._length):
+            yield self[index]
@@ -0,0 +1,1205 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from abc import ABCMeta, abstractmethod
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_EXCEPTION, wait
+import hashlib
+import json
+import math
+import mmap
+import os
+import random
+import re
+import threading
+import time
+
+#
+# Third party libraries
+#
+
+from botocore.exceptions import ClientError
+from six.moves.urllib.parse import urlencode
+
+#
+# Internal libraries
+#
+
+from krux.logging import get_logger
+from krux_boto.util import Error, THROTTLING_ERROR_CODES, write_json
+
+# Constants
+MB = 1024 * 1024
+DEFAULT_PART_SIZE = 8 * MB
+DEFAULT_MAX_WORKERS = 10
+DEFAULT_MAX_IN_FLIGHT = 4
+# S3 rejects multipart uploads whose parts (except the last one) are smaller than this
+MIN_PART_SIZE = 5 * MB
+# CopyObject and UploadPartCopy copy at most this many bytes per call
+MAX_COPY_SIZE = 5 * 1024 * MB
+MAX_PARTS = 10000
+DEFAULT_COPY_PART_SIZE = 64 * MB
+# Objects up to this size are copied with a single CopyObject call
+DEFAULT_MULTIPART_COPY_THRESHOLD = 64 * MB
+# Headers of the source object the copy keeps
+_COPIED_HEADERS = (
+    'CacheControl', 'ContentDisposition', 'ContentEncoding', 'ContentLanguage', 'ContentType', 'Expires',
+    'Metadata', 'WebsiteRedirectLocation',
+)
+# DeleteObjects takes at most this many keys per call
+MAX_DELETE_BATCH_SIZE = 1000
+# Keys copied in turn by a worker before it takes the next batch
+DEFAULT_COPY_BATCH_SIZE = 10
+DEFAULT_BULK_RETRIES = 3
+DEFAULT_PROGRESS_INTERVAL = 10
+# Seconds of the first backoff between retries of failed keys, doubled on every retry
+_BULK_BACKOFF = 0.5
+_BULK_MAX_BACKOFF = 20
+# Per-key errors worth retrying. The others, i.e. AccessDenied, fail the key right away.
+_RETRYABLE_KEY_ERRORS = THROTTLING_ERROR_CODES | frozenset([
+    'InternalError',
+    'OperationAborted',
+    'RequestTimeout',
+    'ServiceUnavailable',
+])
+
+# Seconds a discovered bucket region is trusted
+DEFAULT_BUCKET_REGION_TTL = 24 * 60 * 60
+DEFAULT_BUCKET_REGION_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'krux-boto', 'bucket-regions.json')
+# S3 returns the region of a bucket in this header, on errors and redirects too
+_BUCKET_REGION_HEADER = 'x-amz-bucket-region'
+
+# An ETag of a single-part, non-KMS upload is the hex MD5 of the object.
+# A multipart ETag is the MD5 of the concatenated part MD5s, followed by '-<number of parts>'.
+_ETAG_PATTERN = re.compile(r'^([0-9a-f]{32})(?:-(\d+))?$')
+
+
+class ChecksumMismatchError(Error):
+    pass
+
+
+class IncompleteReadError(Error):
+    pass
+
+
+def _readinto(body, view):
+    """
+    Reads from a botocore StreamingBody directly into the given memoryview until it is full.
+
+    :param body: Body of a get_object() response
+    :type body: botocore.response.StreamingBody
+    :param view: Writable memoryview to fill
+    :type view: memoryview
+    :return: Number of bytes read
+    :rtype: int
+    """
+    # GOTCHA: StreamingBody only gained readinto() in later versions of botocore. The wrapped urllib3 response
+    #         has always supported it, but is private, so fall back to copying what read() returns.
+    readinto = getattr(body, 'readinto', None) or getattr(getattr(body, '_raw_stream', None), 'readinto', None)
+
+    total = 0
+    while total < len(view):
+        if readinto is not None:
+            n = readinto(view[total:])
+        else:
+            data = body.read(len(view) - total)
+            n = len(data)
+            view[total:total + n] = data
+        if not n:
+            break
+        total += n
+
+    return total
+
+
+def _multipart_etag(view, part_sizes=None):
+    """
+    Computes the S3 ETag of the data in view, as if it were uploaded in parts of the given sizes,
+    or with a single PUT if part_sizes is None.
+    """
+    if part_sizes is None:
+        return hashlib.md5(view).hexdigest()
+
+    digests = []
+    start = 0
+    for part_size in part_sizes:
+        digests.append(hashlib.md5(view[start:start + part_size]).digest())
+        start += part_size
+    return '{0}-{1}'.format(hashlib.md5(b''.join(digests)).hexdigest(), len(part_sizes))
+
+
+class S3Downloader(object):
+    """
+    Downloads an S3 object with concurrent ranged GETs, writing each part directly into
+    a memory-mapped file or a caller-supplied buffer.
+    """
+
+    def __init__(self, client, part_size=DEFAULT_PART_SIZE, max_workers=DEFAULT_MAX_WORKERS, logger=None, stats=None):
+        """
+        :param client: boto3 S3 client. Its max_pool_connections should be at least max_workers.
+        :type client: botocore.client.S3
+        :param part_size: Size of each ranged GET, in bytes
+        :type part_size: int
+        :param max_workers: Number of concurrent ranged GETs
+        :type max_workers: int
+        :param logger: Logger, recommended to be obtained using krux.cli.Application
+        :type logger: logging.Logger
+        :param stats: Stats, recommended to be obtained using krux.cli.Application
+        :type stats: kruxstatsd.StatsClient
+        """
+        if part_size < 1:
+            raise ValueError('part_size must be a positive integer')
+        if max_workers < 1:
+            raise ValueError('max_workers must be a positive integer')
+
+        self._client = client
+        self._part_size = part_size
+        self._max_workers = max_workers
+        self._logger = logger or get_logger('krux_boto')
+        self._stats = stats
+
+    def download(self, bucket, key, target, version_id=None, verify=True):
+        """
+        Downloads s3://bucket/key into target.
+
+        :param bucket: Name of the bucket
+        :type bucket: str
+        :param key: Key of the object
+        :type key: str
+        :param target: Path of the file to write to, or a writable buffer (bytearray, mmap, ...)
+                       at least as large as the object
+        :type target: str | bytearray | memoryview
+        :param version_id: Version of the object to download. Defaults to the latest version.
+        :type version_id: str
+        :param verify: Whether to verify the downloaded data against the object's ETag
+        :type verify: bool
+        :return: Size of the object in bytes
+        :rtype: int
+        """
+        start_time = time.time()
+
+        head_args = {'Bucket': bucket, 'Key': key}
+        if version_id is not None:
+            head_args['VersionId'] = version_id
+        head = self._client.head_object(**head_args)
+        size = head['ContentLength']
+        etag = head['ETag']
+
+        self._logger.debug('Downloading s3://%s/%s (%d bytes) in parts of %d bytes', bucket, key, size, self._part_size)
+
+        if isinstance(target, (str, bytes)):
+            with open(target, 'w+b') as f:
+                f.truncate(size)
+                # GOTCHA: An empty file cannot be memory-mapped.
+                if size == 0:
+                    return 0
+
+                mapped = mmap.mmap(f.fileno(), size)
+                try:
+                    # GOTCHA: The mmap cannot be closed while a memoryview of it is alive.
+                    with memoryview(mapped) as view:
+                        self._download_into(view, head_args, etag, size)
+                        if verify:
+                            self._verify(view, head_args, head)
+                    mapped.flush()
+                finally:
+                    mapped.close()
+        else:
+            view = memoryview(target).cast('B')
+            if view.readonly:
+                raise ValueError('target buffer must be writable')
+            if len(view) < size:
+                raise ValueError('target buffer is {0} bytes, but the object is {1} bytes'.format(len(view), size))
+
+            self._download_into(view, head_args, etag, size)
+            if verify:
+                self._verify(view[:size], head_args, head)
+
+        if self._stats is not None:
+            self._stats.timing('s3.download', (time.time() - start_time) * 1000)
+
+        return size
+
+    def _download_into(self, view, head_args, etag, size):
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            futures = [
+                executor.submit(self._fetch_part, view, head_args, etag, start, min(start + self._part_size, size))
+                for start in range(0, size, self._part_size)
+            ]
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in not_done:
+                future.cancel()
+            # Re-raise the first failure, if any
+            for future in done:
+                future.result()
+
+    def _fetch_part(self, view, head_args, etag, start, end):
+        # GOTCHA: Pin every part to the ETag seen by head_object() so an object overwritten
+        #         in the middle of the download fails instead of producing a mix of both versions.
+        response = self._client.get_object(
+            Range='bytes={0}-{1}'.format(start, end - 1),
+            IfMatch=etag,
+            **head_args
+        )
+
+        body = response['Body']
+        try:
+            with view[start:end] as part:
+                read = _readinto(body, part)
+        finally:
+            body.close()
+
+        if read != end - start:
+            raise IncompleteReadError(
+                'Expected {0} bytes for range {1}-{2}, but got {3}'.format(end - start, start, end - 1, read)
+            )
+
+    def _verify(self, view, head_args, head):
+        if head.get('ServerSideEncryption') == 'aws:kms' or head.get('SSECustomerAlgorithm'):
+            # The ETag of an object encrypted with KMS or a customer key is not an MD5 of its data.
+            self._logger.debug('Skipping checksum verification of an encrypted object')
+            return
+
+        match = _ETAG_PATTERN.match(head['ETag'].strip('"'))
+        if match is None:
+            self._logger.debug('Skipping checksum verification of an unrecognized ETag %s', head['ETag'])
+            return
+
+        part_sizes = None
+        if match.group(2) is not None:
+            part_sizes = self._part_sizes(head_args, int(match.group(2)), len(view))
+            if part_sizes is None or sum(part_sizes) != len(view):
+                self._logger.debug('Skipping checksum verification, the part sizes of the object are unknown')
+                return
+
+        actual = _multipart_etag(view, part_sizes)
+        expected = match.group(0)
+        if actual != expected:
+            raise ChecksumMismatchError('Expected ETag {0}, but the downloaded data has {1}'.format(expected, actual))
+
+    def _part_sizes(self, head_args, parts, size):
+        """
+        :return: The sizes of the parts the object was uploaded in, or None if they cannot be found out
+        :rtype: list[int]
+        """
+        try:
+            part_size = self._client.head_object(PartNumber=1, **head_args)['ContentLength']
+        except ClientError as e:
+            self._logger.debug('Failed to get the part size of the object: %s', e)
+            return None
+
+        # GOTCHA: Only the first part is looked up, not to send a request per part. The others are taken to be
+        #         of the same size but the last, as uploaded by boto3, the AWS CLI and S3MultipartWriter.
+        #         Objects whose size does not add up that way are not verified.
+        if part_size < 1 or not (parts - 1) * part_size < size <= parts * part_size:
+            return None
+        return [part_size] * (parts - 1) + [size - (parts - 1) * part_size]
+
+
+class S3MultipartWriter(object):
+    """
+    A file-like object that uploads to S3 as data is written to it.
+
+    Data is buffered until a part is full, and full parts are uploaded in parallel as a multipart upload.
+    At most max_in_flight parts are held in memory; writes block until a slot frees up.
+    Payloads smaller than a single part are uploaded with a single put_object() call instead.
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket,
+        key,
+        part_size=DEFAULT_PART_SIZE,
+        max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+        extra_args=None,
+        logger=None,
+        stats=None,
+    ):
+        """
+        :param client: boto3 S3 client. Its max_pool_connections should be at least max_in_flight.
+        :type client: botocore.client.S3
+        :param bucket: Name of the bucket
+        :type bucket: str
+        :param key: Key of the object
+        :type key: str
+        :param part_size: Size of each part, in bytes. Must be at least 5 MB.
+        :type part_size: int
+        :param max_in_flight: Maximum number of parts buffered or being uploaded at once
+        :type max_in_flight: int
+        :param extra_args: Extra arguments for put_object() / create_multipart_upload(), i.e. ContentType
+        :type extra_args: dict
+        :param logger: Logger, recommended to be obtained using krux.cli.Application
+        :type logger: logging.Logger
+        :param stats: Stats, recommended to be obtained using krux.cli.Application
+        :type stats: kruxstatsd.StatsClient
+        """
+        if part_size < MIN_PART_SIZE:
+            raise ValueError('part_size must be at least {0} bytes'.format(MIN_PART_SIZE))
+        if max_in_flight < 1:
+            raise ValueError('max_in_flight must be a positive integer')
+
+        self._client = client
+        self._bucket = bucket
+        self._key = key
+        self._part_size = part_size
+        self._extra_args = extra_args or {}
+        self._logger = logger or get_logger('krux_boto')
+        self._stats = stats
+
+        self._buffer = bytearray()
+        # Whether the buffer holds a slot, which it hands over to the upload of its part
+        self._buffer_slot = False
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self._futures = []
+        self._upload_id = None
+        self._error = None
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._abort_quietly()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        """
+        Buffers data, uploading every part that fills up.
+
+        :param data: Bytes to write
+        :type data: bytes | bytearray | memoryview
+        :return: Number of bytes written
+        :rtype: int
+        """
+        if self.closed:
+            raise ValueError('I/O operation on closed writer')
+        self._raise_error()
+
+        # GOTCHA: Take the data one part at a time, so a large write never buffers more than a part.
+        #         Starting a part blocks until a slot frees up.
+        view = memoryview(data).cast('B')
+        offset = 0
+        while offset < len(view):
+            if not self._buffer_slot:
+                self._acquire_slot()
+            end = offset + min(self._part_size - len(self._buffer), len(view) - offset)
+            self._buffer += view[offset:end]
+            offset = end
+            if len(self._buffer) >= self._part_size:
+                part = bytes(self._buffer)
+                self._buffer = bytearray()
+                self._submit_part(part)
+
+        return len(view)
+
+    def writelines(self, chunks):
+        """
+        Writes every chunk of an iterable of bytes.
+
+        :param chunks: Iterable of bytes
+        :type chunks: collections.Iterable[bytes]
+        """
+        for chunk in chunks:
+            self.write(chunk)
+
+    def write_from(self, source):
+        """
+        Writes everything from a file-like object or an iterable of bytes.
+
+        :param source: Readable file-like object, or an iterable of bytes
+        :type source: io.RawIOBase | collections.Iterable[bytes]
+        """
+        read = getattr(source, 'read', None)
+        if read is None:
+            self.writelines(source)
+            return
+
+        while True:
+            chunk = read(self._part_size)
+            if not chunk:
+                break
+            self.write(chunk)
+
+    def close(self):
+        """
+        Uploads the remaining data and completes the upload. If anything fails, the upload is aborted.
+        """
+        if self.closed:
+            return
+
+        try:
+            if self._upload_id is None:
+                self._client.put_object(Bucket=self._bucket, Key=self._key, Body=bytes(self._buffer), **self._extra_args)
+                self._logger.debug('Uploaded s3://%s/%s with a single PUT', self._bucket, self._key)
+            else:
+                if self._buffer:
+                    self._submit_part(bytes(self._buffer))
+
+                parts = [future.result() for future in self._futures]
+                self._client.complete_multipart_upload(
+                    Bucket=self._bucket,
+                    Key=self._key,
+                    UploadId=self._upload_id,
+                    MultipartUpload={'Parts': parts},
+                )
+                self._logger.debug('Uploaded s3://%s/%s in %d parts', self._bucket, self._key, len(parts))
+        except Exception:
+            self._abort_quietly()
+            raise
+        finally:
+            self._buffer = bytearray()
+            self._executor.shutdown(wait=True)
+            self.closed = True
+
+    def abort(self):
+        """
+        Stops uploading and aborts the multipart upload, discarding every uploaded part.
+        """
+        for future in self._futures:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        self._buffer = bytearray()
+        self.closed = True
+
+        if self._upload_id is not None:
+            self._logger.debug('Aborting multipart upload %s of s3://%s/%s', self._upload_id, self._bucket, self._key)
+            self._client.abort_multipart_upload(Bucket=self._bucket, Key=self._key, UploadId=self._upload_id)
+            self._upload_id = None
+
+    def _abort_quietly(self):
+        """
+        Aborts on behalf of an error, which a failure to abort must not replace.
+        """
+        try:
+            self.abort()
+        except Exception as e:
+            self._logger.warn('Failed to abort multipart upload %s of s3://%s/%s: %s', self._upload_id, self._bucket,
+                              self._key, e)
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _acquire_slot(self):
+        # Blocks until one of the in-flight parts is done, which caps the memory used
+        self._slots.acquire()
+        if self._error is not None:
+            self._slots.release()
+            raise self._error
+        self._buffer_slot = True
+
+    def _submit_part(self, data):
+        if self._upload_id is None:
+            response = self._client.create_multipart_upload(Bucket=self._bucket, Key=self._key, **self._extra_args)
+            self._upload_id = response['UploadId']
+
+        # The upload of the part takes over the slot of the buffer, and releases it once done
+        self._buffer_slot = False
+        future = self._executor.submit(self._upload_part, len(self._futures) + 1, data)
+        future.add_done_callback(self._part_done)
+        self._futures.append(future)
+
+    def _part_done(self, future):
+        self._slots.release()
+        if not future.cancelled() and future.exception() is not None and self._error is None:
+            self._error = future.exception()
+
+    def _upload_part(self, part_number, data):
+        start_time = time.time()
+
+        response = self._client.upload_part(
+            Bucket=self._bucket,
+            Key=self._key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+
+        if self._stats is not None:
+            self._stats.timing('s3.upload_part', (time.time() - start_time) * 1000)
+
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+
+CopyResult = namedtuple('CopyResult', ['etag', 'size', 'parts', 'elapsed', 'part_timings'])
+
+
+class S3MultipartCopier(object):
+    """
+    Copies S3 objects server side, between buckets of the same or different regions.
+
+    Objects up to multipart_threshold are copied with a single CopyObject call. Larger ones, including those
+    above the 5 GB limit of CopyObject, are copied as a multipart upload whose parts are copied concurrently
+    with UploadPartCopy. Either way, the metadata, content headers and tags of the source object are kept.
+    """
+
+    def __init__(
+        self,
+        source_client,
+        destination_client,
+        part_size=DEFAULT_COPY_PART_SIZE,
+        max_workers=DEFAULT_MAX_WORKERS,
+        multipart_threshold=DEFAULT_MULTIPART_COPY_THRESHOLD,
+        logger=None,
+        stats=None,
+    ):
+        """
+        :param source_client: boto3 S3 client of the region of the source bucket
+        :type source_client: botocore.client.S3
+        :param destination_client: boto3 S3 client of the region of the destination bucket.
+                                   Its max_pool_connections should be at least max_workers.
+        :type destination_client: botocore.client.S3
+        :param part_size: Size of each part, in bytes, between 5 MB and 5 GB. It is raised for objects
+                          that would need more than 10,000 parts.
+        :type part_size: int
+        :param max_workers: Number of parts copied concurrently
+        :type max_workers: int
+        :param multipart_threshold: Size in bytes above which objects are copied in parts, at most 5 GB
+        :type multipart_threshold: int
+        :param logger: Logger, recommended to be obtained using krux.cli.Application
+        :type logger: logging.Logger
+        :param stats: Stats, recommended to be obtained using krux.cli.Application
+        :type stats: kruxstatsd.StatsClient
+        """
+        if not MIN_PART_SIZE <= part_size <= MAX_COPY_SIZE:
+            raise ValueError('part_size must be between {0} and {1} bytes'.format(MIN_PART_SIZE, MAX_COPY_SIZE))
+        if multipart_threshold > MAX_COPY_SIZE:
+            raise ValueError('multipart_threshold must be at most {0} bytes'.format(MAX_COPY_SIZE))
+        if max_workers < 1:
+            raise ValueError('max_workers must be a positive integer')
+
+        self._source_client = source_client
+        self._destination_client = destination_client
+        self._part_size = part_size
+        self._max_workers = max_workers
+        self._multipart_threshold = multipart_threshold
+        self._logger = logger or get_logger('krux_boto')
+        self._stats = stats
+
+    def copy(self, source_bucket, source_key, destination_bucket, destination_key, version_id=None, extra_args=None):
+        """
+        Copies s3://source_bucket/source_key to s3://destination_bucket/destination_key.
+
+        :param source_bucket: Name of the bucket to copy from
+        :type source_bucket: str
+        :param source_key: Key of the object to copy
+        :type source_key: str
+        :param destination_bucket: Name of the bucket to copy to
+        :type destination_bucket: str
+        :param destination_key: Key of the copy
+        :type destination_key: str
+        :param version_id: Version of the object to copy. Defaults to the latest version.
+        :type version_id: str
+        :param extra_args: Extra arguments for copy_object() / create_multipart_upload(), i.e. StorageClass.
+                           They take precedence over the headers of the source object.
+        :type extra_args: dict
+        :return: The outcome. Its part_timings are the seconds each part took to copy, in order.
+        :rtype: krux_boto.s3.CopyResult
+        """
+        start_time = time.time()
+
+        source = {'Bucket': source_bucket, 'Key': source_key}
+        if version_id is not None:
+            source['VersionId'] = version_id
+        head = self._source_client.head_object(**source)
+        size = head['ContentLength']
+
+        if size <= self._multipart_threshold:
+            copy_args = dict(extra_args or {})
+            if any(name in copy_args for name in _COPIED_HEADERS):
+                # GOTCHA: CopyObject ignores new metadata and content headers unless told to replace them, and
+                #         then drops the ones not given. Keep those of the source, like the multipart copy does.
+                copy_args = dict(
+                    [(name, head[name]) for name in _COPIED_HEADERS if name in head] + list(copy_args.items())
+                )
+                copy_args.setdefault('MetadataDirective', 'REPLACE')
+
+            copy_start_time = time.time()
+            response = self._destination_client.copy_object(
+                Bucket=destination_bucket, Key=destination_key, CopySource=source, CopySourceIfMatch=head['ETag'],
+                **copy_args
+            )
+            etag = response['CopyObjectResult']['ETag']
+            parts = 1
+            part_timings = [time.time() - copy_start_time]
+        else:
+            etag, parts, part_timings = self._copy_parts(
+                source, head, destination_bucket, destination_key, extra_args or {},
+            )
+
+        elapsed = time.time() - start_time
+        if self._stats is not None:
+            self._stats.timing('s3.copy', elapsed * 1000)
+        self._logger.debug(
+            'Copied s3://%s/%s to s3://%s/%s (%d bytes) in %d parts',
+            source_bucket, source_key, destination_bucket, destination_key, size, parts,
+        )
+
+        return CopyResult(etag=etag, size=size, parts=parts, elapsed=elapsed, part_timings=part_timings)
+
+    def _create_args(self, source, head, extra_args):
+        args = dict((name, head[name]) for name in _COPIED_HEADERS if name in head)
+
+        tags = self._source_client.get_object_tagging(**source).get('TagSet', [])
+        if tags:
+            args['Tagging'] = urlencode([(tag['Key'], tag['Value']) for tag in tags])
+
+        args.update(extra_args)
+        return args
+
+    def _copy_parts(self, source, head, bucket, key, extra_args):
+        size = head['ContentLength']
+        # GOTCHA: A multipart upload has at most 10,000 parts
+        part_size = max(self._part_size, int(math.ceil(size / float(MAX_PARTS))))
+
+        upload_id = self._destination_client.create_multipart_upload(
+            Bucket=bucket, Key=key, **self._create_args(source, head, extra_args)
+        )['UploadId']
+
+        try:
+            with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+                futures = [
+                    executor.submit(
+                        self._copy_part, source, head['ETag'], bucket, key, upload_id,
+                        part_number, start, min(start + part_size, size) - 1,
+                    )
+                    for part_number, start in enumerate(range(0, size, part_size), 1)
+                ]
+                done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+                for future in not_done:
+                    future.cancel()
+                # In order, re-raising the first failure, if any
+                results = [future.result() for future in futures]
+
+            response = self._destination_client.complete_multipart_upload(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': [part for part, _ in results]},
+            )
+        except Exception:
+            self._logger.debug('Aborting multipart copy %s to s3://%s/%s', upload_id, bucket, key)
+            try:
+                self._destination_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            except Exception as e:
+                # GOTCHA: Raise the error the copy failed with, not this one
+                self._logger.warn('Failed to abort multipart copy %s to s3://%s/%s: %s', upload_id, bucket, key, e)
+            raise
+
+        return response['ETag'], len(results), [timing for _, timing in results]
+
+    def _copy_part(self, source, etag, bucket, key, upload_id, part_number, start, end):
+        start_time = time.time()
+
+        # GOTCHA: Pin every part to the same version of the source, in case it is overwritten during the copy
+        response = self._destination_client.upload_part_copy(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            CopySource=source,
+            CopySourceRange='bytes={0}-{1}'.format(start, end),
+            CopySourceIfMatch=etag,
+        )
+
+        elapsed = time.time() - start_time
+        if self._stats is not None:
+            self._stats.timing('s3.copy_part', elapsed * 1000)
+
+        return {'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']}, elapsed
+
+
+BulkProgress = namedtuple('BulkProgress', ['submitted', 'succeeded', 'failed', 'elapsed', 'throughput'])
+BulkResult = namedtuple('BulkResult', ['succeeded', 'failed', 'elapsed', 'throughput', 'errors'])
+
+
+def iter_s3_objects(client, bucket, prefix='', start_after=None):
+    """
+    Yields the objects of a bucket, as returned by list_objects_v2(), page by page, without holding the whole
+    listing in memory.
+
+    :param client: boto3 S3 client
+    :type client: botocore.client.S3
+    :param bucket: Name of the bucket
+    :type bucket: str
+    :param prefix: Only yield the objects whose key starts with this
+    :type prefix: str
+    :param start_after: Only yield the objects after this key, i.e. to resume a listing
+    :type start_after: str
+    :rtype: collections.Iterator[dict]
+    """
+    args = {'Bucket': bucket, 'Prefix': prefix}
+    if start_after is not None:
+        args['StartAfter'] = start_after
+
+    for page in client.get_paginator('list_objects_v2').paginate(**args):
+        for item in page.get('Contents', []):
+            yield item
+
+
+def iter_s3_keys(client, bucket, prefix='', start_after=None):
+    """
+    Yields the keys of the objects of a bucket, page by page, without holding the whole listing in memory.
+
+    :param client: boto3 S3 client
+    :type client: botocore.client.S3
+    :param bucket: Name of the bucket
+    :type bucket: str
+    :param prefix: Only yield the keys starting with this
+    :type prefix: str
+    :param start_after: Only yield the keys after this one, i.e. to resume a listing
+    :type start_after: str
+    :rtype: collections.Iterator[str]
+    """
+    for item in iter_s3_objects(client, bucket, prefix=prefix, start_after=start_after):
+        yield item['Key']
+
+
+def _batches(keys, batch_size):
+    batch = []
+    for key in keys:
+        batch.append(key)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class S3BulkOperation(metaclass=ABCMeta):
+    """
+    Applies an operation to a stream of S3 keys, i.e. from iter_s3_keys(), in batches run by a pool of workers.
+
+    The keys are consumed as the workers keep up: at most twice as many batches as workers are pending at once,
+    so a listing of millions of keys is never held in memory. Keys failing with a transient error are retried
+    with exponential backoff; the others are reported as failed. Progress is reported every progress_interval
+    seconds to the progress callback, or logged.
+
+    Subclasses implement _stat_name() and _process_batch().
+    """
+    MAX_BATCH_SIZE = None
+
+    def __init__(
+        self,
+        client,
+        batch_size,
+        max_workers=DEFAULT_MAX_WORKERS,
+        max_retries=DEFAULT_BULK_RETRIES,
+        progress_interval=DEFAULT_PROGRESS_INTERVAL,
+        progress=None,
+        logger=None,
+        stats=None,
+    ):
+        """
+        :param client: boto3 S3 client. Its max_pool_connections should be at least max_workers.
+        :type client: botocore.client.S3
+        :param batch_size: Number of keys per batch
+        :type batch_size: int
+        :param max_workers: Number of batches processed concurrently
+        :type max_workers: int
+        :param max_retries: Number of times a key failing with a transient error is retried
+        :type max_retries: int
+        :param progress_interval: Seconds between progress reports
+        :type progress_interval: float
+        :param progress: Called with a krux_boto.s3.BulkProgress on every report. Defaults to logging it.
+        :type progress: callable
+        :param logger: Logger, recommended to be obtained using krux.cli.Application
+        :type logger: logging.Logger
+        :param stats: Stats, recommended to be obtained using krux.cli.Application
+        :type stats: kruxstatsd.StatsClient
+        """
+        if batch_size < 1:
+            raise ValueError('batch_size must be a positive integer')
+        if self.MAX_BATCH_SIZE is not None and batch_size > self.MAX_BATCH_SIZE:
+            raise ValueError('batch_size must be at most {0}'.format(self.MAX_BATCH_SIZE))
+        if max_workers < 1:
+            raise ValueError('max_workers must be a positive integer')
+
+        self._client = client
+        self._batch_size = batch_size
+        self._max_workers = max_workers
+        self._max_retries = max_retries
+        self._progress_interval = progress_interval
+        self._progress = progress
+        self._logger = logger or get_logger('krux_boto')
+        self._stats = stats
+
+        self._lock = threading.Condition()
+        self._pending = 0
+        self._submitted = 0
+        self._succeeded = 0
+        self._errors = {}
+        self._start_time = None
+        self._last_report = None
+
+    def run(self, keys):
+        """
+        Processes every key.
+
+        :param keys: Keys to process
+        :type keys: collections.Iterable[str]
+        :return: The outcome. Its errors map every failed key to the code of its last error.
+        :rtype: krux_boto.s3.BulkResult
+        """
+        self._start_time = self._last_report = time.time()
+        executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        try:
+            for batch in _batches(keys, self._batch_size):
+                # Backpressure: stop consuming keys until the workers catch up
+                self._wait(lambda: self._pending < self._max_workers * 2)
+                with self._lock:
+                    self._pending += 1
+                    self._submitted += len(batch)
+                executor.submit(self._run_batch, batch)
+                self._maybe_report()
+
+            self._wait(lambda: not self._pending)
+        finally:
+            executor.shutdown(wait=True)
+
+        progress = self._snapshot()
+        self._report(progress)
+        return BulkResult(
+            succeeded=progress.succeeded,
+            failed=progress.failed,
+            elapsed=progress.elapsed,
+            throughput=progress.throughput,
+            errors=dict(self._errors),
+        )
+
+    def _snapshot(self):
+        with self._lock:
+            elapsed = time.time() - self._start_time
+            done = self._succeeded + len(self._errors)
+            return BulkProgress(
+                submitted=self._submitted,
+                succeeded=self._succeeded,
+                failed=len(self._errors),
+                elapsed=elapsed,
+                throughput=done / elapsed if elapsed > 0 else 0.0,
+            )
+
+    def _wait(self, ready):
+        # GOTCHA: Report outside of the lock, so that the workers are not held up by the progress callback
+        while True:
+            with self._lock:
+                if ready():
+                    return
+                self._lock.wait(self._progress_interval)
+            self._maybe_report()
+
+    def _maybe_report(self):
+        if time.time() - self._last_report >= self._progress_interval:
+            self._last_report = time.time()
+            self._report(self._snapshot())
+
+    def _report(self, progress):
+        if self._progress is not None:
+            self._progress(progress)
+        else:
+            self._logger.info(
+                '%s: %d of %d keys done, %d failed, %.1f keys/s',
+                self.__class__.__name__, progress.succeeded + progress.failed, progress.submitted,
+                progress.failed, progress.throughput,
+            )
+
+    def _run_batch(self, keys):
+        start_time = time.time()
+        try:
+            attempt = 0
+            while True:
+                transient = False
+                try:
+                    errors = self._process_batch(keys)
+                except ClientError as e:
+                    # The whole call failed, even after the retries of botocore
+                    code = e.response.get('Error', {}).get('Code')
+                    errors = dict((key, code) for key in keys)
+                except Exception as e:
+                    # i.e. the connection kept failing
+                    self._logger.debug('Batch of %d keys failed: %s', len(keys), e)
+                    errors = dict((key, e.__class__.__name__) for key in keys)
+                    transient = True
+
+                retryable = [
+                    key for key in keys if key in errors and (transient or errors[key] in _RETRYABLE_KEY_ERRORS)
+                ]
+                with self._lock:
+                    self._succeeded += len(keys) - len(errors)
+                    for key in keys:
+                        if key in errors and (attempt >= self._max_retries or key not in retryable):
+                            self._errors[key] = errors[key]
+
+                if attempt >= self._max_retries or not retryable:
+                    return
+                attempt += 1
+                keys = retryable
+                time.sleep(random.uniform(0, min(_BULK_BACKOFF * 2 ** attempt, _BULK_MAX_BACKOFF)))
+        finally:
+            if self._stats is not None:
+                self._stats.timing('s3.{0}'.format(self._stat_name()), (time.time() - start_time) * 1000)
+            with self._lock:
+                self._pending -= 1
+                self._lock.notify()
+
+    @abstractmethod
+    def _stat_name(self):
+        """
+        :return: Name of the operation in the stats, i.e. bulk_delete for s3.bulk_delete
+        :rtype: str
+        """
+        pass
+
+    @abstractmethod
+    def _process_batch(self, keys):
+        """
+        Applies the operation to a batch of keys.
+
+        :param keys: Keys to process
+        :type keys: list[str]
+        :return: Code of the error of every key that failed
+        :rtype: dict[str, str]
+        """
+        pass
+
+
+class S3BulkDeleter(S3BulkOperation):
+    """
+    Deletes the objects of a stream of keys with DeleteObjects calls of up to 1,000 keys each.
+    """
+    MAX_BATCH_SIZE = MAX_DELETE_BATCH_SIZE
+
+    def __init__(self, client, bucket, batch_size=MAX_DELETE_BATCH_SIZE, **kwargs):
+        """
+        :param client: boto3 S3 client. Its max_pool_connections should be at least max_workers.
+        :type client: botocore.client.S3
+        :param bucket: Name of the bucket
+        :type bucket: str
+        :param batch_size: Number of keys per DeleteObjects call, at most 1,000
+        :type batch_size: int
+        :param kwargs: Other arguments of S3BulkOperation
+        """
+        super(S3BulkDeleter, self).__init__(client, batch_size, **kwargs)
+        self._bucket = bucket
+
+    def _stat_name(self):
+        return 'bulk_delete'
+
+    def _process_batch(self, keys):
+        response = self._client.delete_objects(
+            Bucket=self._bucket,
+            # GOTCHA: Quiet mode only lists the keys that failed, which keeps the responses small
+            Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True},
+        )
+        return dict((error['Key'], error.get('Code')) for error in response.get('Errors', []))
+
+
+class S3BulkCopier(S3BulkOperation):
+    """
+    Copies the objects of a stream of keys to another bucket or prefix, one CopyObject call per key,
+    with the keys of a batch copied in turn by the same worker.
+
+    CopyObject only copies objects of up to 5 GB.
+    """
+
+    def __init__(
+        self,
+        client,
+        source_bucket,
+        destination_bucket,
+        key_map=None,
+        batch_size=DEFAULT_COPY_BATCH_SIZE,
+        extra_args=None,
+        **kwargs
+    ):
+        """
+        :param client: boto3 S3 client of the region of the destination bucket.
+                       Its max_pool_connections should be at least max_workers.
+        :type client: botocore.client.S3
+        :param source_bucket: Name of the bucket to copy from
+        :type source_bucket: str
+        :param destination_bucket: Name of the bucket to copy to
+        :type destination_bucket: str
+        :param key_map: Returns the destination key of a source key. Defaults to the same key.
+        :type key_map: callable
+        :param batch_size: Number of keys handed to a worker at a time
+        :type batch_size: int
+        :param extra_args: Extra arguments for copy_object(), i.e. StorageClass
+        :type extra_args: dict
+        :param kwargs: Other arguments of S3BulkOperation
+        """
+        super(S3BulkCopier, self).__init__(client, batch_size, **kwargs)
+        self._source_bucket = source_bucket
+        self._destination_bucket = destination_bucket
+        self._key_map = key_map or (lambda key: key)
+        self._extra_args = extra_args or {}
+
+    def _stat_name(self):
+        return 'bulk_copy'
+
+    def _process_batch(self, keys):
+        errors = {}
+        for key in keys:
+            try:
+                self._client.copy_object(
+                    Bucket=self._destination_bucket,
+                    Key=self._key_map(key),
+                    CopySource={'Bucket': self._source_bucket, 'Key': key},
+                    **self._extra_args
+                )
+            except ClientError as e:
+                errors[key] = e.response.get('Error', {}).get('Code')
+        return errors
+
+
+class BucketRegionCache(object):
+    """
+    Finds out the region of S3 buckets and remembers it, so requests can be sent to the right region right away
+    instead of being redirected there.
+
+    The region is read from the x-amz-bucket-region header of a HeadBucket call, which S3 returns even when the
+    call is redirected or denied. Regions are kept for ttl seconds, and optionally in a JSON file shared by
+    every process using the same cache_path.
+    """
+
+    def __init__(self, client, ttl=DEFAULT_BUCKET_REGION_TTL, cache_path=None, logger=None):
+        """
+        :param client: boto3 S3 client, of any region
+        :type client: botocore.client.S3
+        :param ttl: Seconds a region is kept
+        :type ttl: int
+        :param cache_path: Path of a file to keep the regions in across processes. Pass None to only keep them
+                           in memory.
+        :type cache_path: str
+        :param logger: Logger, recommended to be obtained using krux.cli.Application
+        :type logger: logging.Logger
+        """
+        self._client = client
+        self._ttl = ttl
+        self._cache_path = cache_path
+        self._logger = logger or get_logger('krux_boto')
+        self._lock = threading.Lock()
+        # Bucket name -> (region, time it was found out)
+        self._regions = {}
+        # Bucket name -> Future of the region, while a thread finds it out
+        self._discoveries = {}
+        # Serializes writes of the cache file, which happen outside of self._lock
+        self._save_lock = threading.Lock()
+
+        if cache_path is not None:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self._cache_path, 'r') as f:
+                buckets = json.load(f).get('buckets', {})
+        except (IOError, OSError, ValueError):
+            return
+
+        self._regions = dict((bucket, (entry['region'], entry['timestamp'])) for bucket, entry in buckets.items())
+
+    def _save(self, merge=True):
+        with self._save_lock:
+            # GOTCHA: Copy the regions within the save lock, so an older copy never overwrites a newer one
+            with self._lock:
+                regions = dict(self._regions)
+            self._write(regions, merge)
+
+    def _write(self, regions, merge):
+        buckets = {}
+        if merge:
+            # Keep what other processes found out in the meantime
+            try:
+                with open(self._cache_path, 'r') as f:
+                    buckets = json.load(f).get('buckets', {})
+            except (IOError, OSError, ValueError):
+                pass
+        for bucket, (region, timestamp) in regions.items():
+            if timestamp >= buckets.get(bucket, {}).get('timestamp', 0):
+                buckets[bucket] = {'region': region, 'timestamp': timestamp}
+
+        try:
+            write_json(self._cache_path, {'buckets': buckets})
+        except (IOError, OSError) as e:
+            self._logger.debug('Failed to cache the bucket regions in %s: %s', self._cache_path, e)
+
+    def get_region(self, bucket):
+        """
+        :param bucket: Name of the bucket
+        :type bucket: str
+        :return: Name of the region of the bucket
+        :rtype: str
+        """
+        with self._lock:
+            cached = self._regions.get(bucket)
+            if cached is not None and time.time() - cached[1] < self._ttl:
+                return cached[0]
+
+            # Only one thread finds out the region of a bucket, the others wait for it
+            future = self._discoveries.get(bucket)
+            if future is not None:
+                discovering = False
+            else:
+                future = self._discoveries[bucket] = Future()
+                discovering = True
+
+        if not discovering:
+            return future.result()
+
+        try:
+            region = self._discover(bucket)
+        except Exception as e:
+            with self._lock:
+                del self._discoveries[bucket]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._regions[bucket] = (region, time.time())
+            del self._discoveries[bucket]
+        future.set_result(region)
+
+        if self._cache_path is not None:
+            self._save()
+        return region
+
+    def _discover(self, bucket):
+        try:
+            response = self._client.head_bucket(Bucket=bucket)
+        except ClientError as e:
+            # i.e. AccessDenied, with the header still set. A missing bucket has none.
+            response = e.response
+            if _BUCKET_REGION_HEADER not in response.get('ResponseMetadata', {}).get('HTTPHeaders', {}):
+                raise
+
+        region = response['ResponseMetadata']['HTTPHeaders'][_BUCKET_REGION_HEADER]
+        self._logger.debug('Bucket %s is in %s', bucket, region)
+        return region
+
+    def invalidate(self, bucket=None):
+        """
+        Forgets the region of a bucket, i.e. after it was deleted and created again elsewhere.
+
+        :param bucket: Name of the bucket. Defaults to every bucket.
+        :type bucket: str
+        """
+        with self._lock:
+            if bucket is None:
+                self._regions = {}
+            else:
+                self._regions.pop(bucket, None)
+        if self._cache_path is not None:
+            self._save(merge=False)
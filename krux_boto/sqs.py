@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+#
+# Third party libraries
+#
+
+from six.moves import queue
+
+#
+# Internal libraries
+#
+
+from krux.logging import get_logger
+
+# Constants
+DEFAULT_RECEIVERS = 2
+DEFAULT_WORKERS = 10
+DEFAULT_WAIT_TIME = 20
+DEFAULT_VISIBILITY_TIMEOUT = 30
+# SQS returns and deletes at most this many messages per call
+MAX_BATCH_SIZE = 10
+# Seconds to wait before receiving again after a failed receive
+_RECEIVE_ERROR_DELAY = 1
+# Seconds the deleter waits for a batch to fill up before deleting what it has
+_DELETE_DELAY = 0.1
+
+
+class SQSConsumer(object):
+    """
+    Consumes an SQS queue with several long-polling receiver threads and a pool of worker threads.
+
+    Each message is passed to the handler in a worker thread. Messages handled without an exception
+    are deleted in batches. Messages whose handler raises are left in the queue, so they are received
+    again once their visibility timeout expires. The visibility of messages still being handled is
+    extended automatically, so a slow handler does not cause a message to be handled twice.
+
+    At most one message per worker is received at a time, so messages never wait in memory for
+    a worker while their visibility timeout runs.
+    """
+
+    def __init__(
+        self,
+        client,
+        queue_url,
+        handler,
+        receivers=DEFAULT_RECEIVERS,
+        workers=DEFAULT_WORKERS,
+        wait_time=DEFAULT_WAIT_TIME,
+        visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT,
+        logger=None,
+        stats=None,
+    ):
+        """
+        :param client: boto3 SQS client
+        :type client: botocore.client.SQS
+        :param queue_url: URL of the queue
+        :type queue_url: str
+        :param handler: Function called with each message, as returned by receive_message()
+        :type handler: callable
+        :param receivers: Number of long-polling receiver threads
+        :type receivers: int
+        :param workers: Number of worker threads calling the handler
+        :type workers: int
+        :param wait_time: Seconds each receive call waits for messages
+        :type wait_time: int
+        :param visibility_timeout: Visibility timeout of the received messages, in seconds
+        :type visibility_timeout: int
+        :param logger: Logger, recommended to be obtained using krux.cli.Application
+        :type logger: logging.Logger
+        :param stats: Stats, recommended to be obtained using krux.cli.Application
+        :type stats: kruxstatsd.StatsClient
+        """
+        self._client = client
+        self._queue_url = queue_url
+        self._handler = handler
+        self._receivers = receivers
+        self._workers = workers
+        self._wait_time = wait_time
+        self._visibility_timeout = visibility_timeout
+        self._logger = logger or get_logger('krux_boto')
+        self._stats = stats
+
+        self._stop = threading.Event()
+        # GOTCHA: The extender has an event of its own, as it must keep running until the workers are done
+        self._stop_extender = threading.Event()
+        self._threads = []
+        self._deleter = None
+        self._extender = None
+        self._executor = None
+
+        # Number of messages received and not handled yet, capped at the number of workers
+        self._in_flight = 0
+        self._in_flight_cond = threading.Condition()
+
+        # Receipt handle of each message being handled, by message ID, and when its visibility expires
+        self._visible = {}
+        self._visible_lock = threading.Lock()
+
+        self._delete_queue = queue.Queue()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """
+        Starts consuming the queue in background threads.
+        """
+        self._stop.clear()
+        self._stop_extender.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self._workers)
+
+        self._threads = [self._start_thread(self._receive_loop, 'sqs-receiver-{0}'.format(i)) for i in range(self._receivers)]
+        self._deleter = self._start_thread(self._delete_loop, 'sqs-deleter')
+        self._extender = self._start_thread(self._extend_loop, 'sqs-visibility')
+
+        self._logger.debug(
+            'Consuming %s with %d receivers and %d workers', self._queue_url, self._receivers, self._workers,
+        )
+
+    def stop(self):
+        """
+        Stops receiving messages, waits for the messages being handled and deletes them.
+        This may take up to wait_time seconds, for the receive calls in progress to return.
+        Does nothing if the consumer is not started.
+        """
+        if self._executor is None:
+            return
+
+        self._stop.set()
+        with self._in_flight_cond:
+            self._in_flight_cond.notify_all()
+
+        for thread in self._threads:
+            thread.join()
+        # The visibility of the messages still being handled keeps being extended meanwhile
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+        # GOTCHA: Deletes are queued by the workers, so only stop the deleter once they are all done
+        self._delete_queue.put(None)
+        self._deleter.join()
+        self._stop_extender.set()
+        self._extender.join()
+
+    def run(self):
+        """
+        Consumes the queue until interrupted, i.e. with Ctrl-C.
+        """
+        self.start()
+        try:
+            while not self._stop.wait(1):
+                pass
+        finally:
+            self.stop()
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _timing(self, stat, start_time):
+        if self._stats is not None:
+            self._stats.timing(stat, (time.time() - start_time) * 1000)
+
+    def _reserve(self):
+        """
+        Waits until a worker is free and reserves as many free workers as a receive call can fill.
+        Returns 0 when the consumer is stopped.
+        """
+        with self._in_flight_cond:
+            while self._in_flight >= self._workers and not self._stop.is_set():
+                self._in_flight_cond.wait()
+            if self._stop.is_set():
+                return 0
+
+            count = min(self._workers - self._in_flight, MAX_BATCH_SIZE)
+            self._in_flight += count
+            return count
+
+    def _release(self, count):
+        with self._in_flight_cond:
+            self._in_flight -= count
+            self._in_flight_cond.notify_all()
+
+    def _receive_loop(self):
+        while not self._stop.is_set():
+            count = self._reserve()
+            if count == 0:
+                return
+
+            start_time = time.time()
+            try:
+                response = self._client.receive_message(
+                    QueueUrl=self._queue_url,
+                    MaxNumberOfMessages=count,
+                    WaitTimeSeconds=self._wait_time,
+                    VisibilityTimeout=self._visibility_timeout,
+                    AttributeNames=['All'],
+                    MessageAttributeNames=['All'],
+                )
+            except Exception as e:
+                self._release(count)
+                self._logger.warn('Failed to receive messages from %s: %s', self._queue_url, e)
+                self._stop.wait(_RECEIVE_ERROR_DELAY)
+                continue
+            self._timing('sqs.receive', start_time)
+
+            messages = response.get('Messages', [])
+            self._release(count - len(messages))
+
+            expires_at = time.time() + self._visibility_timeout
+            with self._visible_lock:
+                for message in messages:
+                    self._visible[message['MessageId']] = [message['ReceiptHandle'], expires_at]
+
+            for message in messages:
+                self._executor.submit(self._process, message)
+
+    def _process(self, message):
+        start_time = time.time()
+        try:
+            self._handler(message)
+        except Exception:
+            self._logger.exception('Failed to handle message %s', message['MessageId'])
+            if self._stats is not None:
+                self._stats.incr('sqs.process_error')
+        else:
+            self._delete_queue.put(message['ReceiptHandle'])
+        finally:
+            with self._visible_lock:
+                self._visible.pop(message['MessageId'], None)
+            self._release(1)
+            self._timing('sqs.process', start_time)
+
+    def _delete_loop(self):
+        stopping = False
+        while not stopping:
+            receipt_handles = []
+            try:
+                receipt_handle = self._delete_queue.get()
+                deadline = time.time() + _DELETE_DELAY
+                while True:
+                    if receipt_handle is None:
+                        stopping = True
+                        break
+                    receipt_handles.append(receipt_handle)
+                    if len(receipt_handles) == MAX_BATCH_SIZE:
+                        break
+                    receipt_handle = self._delete_queue.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                pass
+
+            if receipt_handles:
+                self._delete(receipt_handles)
+
+    def _delete(self, receipt_handles):
+        start_time = time.time()
+        try:
+            response = self._client.delete_message_batch(
+                QueueUrl=self._queue_url,
+                Entries=[{'Id': str(i), 'ReceiptHandle': handle} for i, handle in enumerate(receipt_handles)],
+            )
+        except Exception as e:
+            self._logger.warn('Failed to delete %d messages from %s: %s', len(receipt_handles), self._queue_url, e)
+            return
+        self._timing('sqs.delete', start_time)
+
+        for failure in response.get('Failed', []):
+            self._logger.warn('Failed to delete a message from %s: %s', self._queue_url, failure.get('Message'))
+
+    def _extend_loop(self):
+        # GOTCHA: Check often enough that a message is always extended well before it becomes visible again
+        interval = self._visibility_timeout / 4.0
+        while not self._stop_extender.wait(interval):
+            self._extend_visibility()
+
+    def _extend_visibility(self):
+        threshold = time.time() + self._visibility_timeout / 2.0
+        with self._visible_lock:
+            expiring = [
+                (message_id, visible[0]) for message_id, visible in self._visible.items() if visible[1] < threshold
+            ]
+        if not expiring:
+            return
+
+        for start in range(0, len(expiring), MAX_BATCH_SIZE):
+            batch = expiring[start:start + MAX_BATCH_SIZE]
+            expires_at = time.time() + self._visibility_timeout
+            try:
+                response = self._client.change_message_visibility_batch(
+                    QueueUrl=self._queue_url,
+                    Entries=[
+                        {'Id': str(i), 'ReceiptHandle': receipt_handle, 'VisibilityTimeout': self._visibility_timeout}
+                        for i, (_, receipt_handle) in enumerate(batch)
+                    ],
+                )
+            except Exception as e:
+                self._logger.warn('Failed to extend the visibility of %d messages: %s', len(batch), e)
+                continue
+
+            failed = set(int(failure['Id']) for failure in response.get('Failed', []))
+            with self._visible_lock:
+                for i, (message_id, _) in enumerate(batch):
+                    if i not in failed and message_id in self._visible:
+                        self._visible[message_id][1] = expires_at
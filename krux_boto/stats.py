@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from datetime import datetime
+from functools import wraps
+import atexit
+import random
+import threading
+import time
+
+#
+# Third party libraries
+#
+
+#
+# Internal libraries
+#
+
+from krux.logging import get_logger
+
+# Constants
+DEFAULT_FLUSH_INTERVAL = 60
+# Maximum number of distinct metrics buffered between flushes. Datapoints of new metrics beyond it are dropped.
+DEFAULT_MAX_METRICS = 10000
+# Maximum number of metrics PutMetricData accepts in one call
+DEFAULT_BATCH_SIZE = 1000
+
+
+class _Timer(object):
+    """
+    Times a block of code, as a context manager or a decorator, like statsd's Timer.
+    """
+
+    def __init__(self, client, stat, rate=1):
+        self._client = client
+        self._stat = stat
+        self._rate = rate
+        self._start = None
+        self.ms = None
+
+    def __call__(self, f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with _Timer(self._client, self._stat, self._rate):
+                return f(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self._start = time.time()
+        return self
+
+    def stop(self, send=True):
+        self.ms = (time.time() - self._start) * 1000
+        if send:
+            self._client.timing(self._stat, self.ms, self._rate)
+        return self
+
+
+class CloudWatchStatsClient(object):
+    """
+    A stats client with the same interface as the statsd client returned by krux.stats.get_stats(),
+    which sends the stats to CloudWatch instead.
+
+    The stats are aggregated in memory (counters are summed, timers are reduced to their count, sum,
+    minimum and maximum, gauges keep their last value) and sent in PutMetricData batches from
+    a background thread every flush_interval seconds. Like statsd gauges, gauges keep their value
+    across flushes and are sent on every flush.
+    """
+
+    def __init__(
+        self,
+        client,
+        namespace,
+        prefix=None,
+        dimensions=None,
+        flush_interval=DEFAULT_FLUSH_INTERVAL,
+        max_metrics=DEFAULT_MAX_METRICS,
+        batch_size=DEFAULT_BATCH_SIZE,
+        logger=None,
+    ):
+        """
+        :param client: boto3 CloudWatch client
+        :type client: botocore.client.CloudWatch
+        :param namespace: CloudWatch namespace of the metrics
+        :type namespace: str
+        :param prefix: Prefix of the metric names
+        :type prefix: str
+        :param dimensions: Dimensions added to every metric, i.e. {'Environment': 'prod'}
+        :type dimensions: dict[str, str]
+        :param flush_interval: Seconds between flushes. Pass None to only flush when flush() is called.
+        :type flush_interval: float
+        :param max_metrics: Maximum number of distinct metrics buffered between flushes
+        :type max_metrics: int
+        :param batch_size: Maximum number of metrics sent per PutMetricData call
+        :type batch_size: int
+        :param logger: Logger, recommended to be obtained using krux.cli.Application
+        :type logger: logging.Logger
+        """
+        self._client = client
+        self._namespace = namespace
+        self._prefix = prefix
+        self._dimensions = [{'Name': name, 'Value': value} for name, value in sorted((dimensions or {}).items())]
+        self._max_metrics = max_metrics
+        self._batch_size = batch_size
+        self._logger = logger or get_logger('krux_boto')
+
+        self._lock = threading.Lock()
+        # Last value of each gauge. Unlike the other buffers, it is not emptied by flushes.
+        self._gauges = {}
+        self._reset_buffers()
+        # Number of datapoints dropped because the buffer was full or PutMetricData failed
+        self.dropped = 0
+
+        self._stop = threading.Event()
+        self._thread = None
+        if flush_interval is not None:
+            self._thread = threading.Thread(target=self._run, args=(flush_interval,), name='cloudwatch-stats')
+            self._thread.daemon = True
+            self._thread.start()
+            # Do not lose the last datapoints when the process exits
+            atexit.register(self.close)
+
+    def incr(self, stat, count=1, rate=1):
+        """Increments a counter."""
+        if not self._sampled(rate):
+            return
+        self._add(self._counters, stat, lambda value: (value or 0) + count / float(rate))
+
+    def decr(self, stat, count=1, rate=1):
+        """Decrements a counter."""
+        self.incr(stat, -count, rate)
+
+    def gauge(self, stat, value, rate=1, delta=False):
+        """Sets a gauge, or changes it by value if delta is True."""
+        if not self._sampled(rate):
+            return
+        if delta:
+            self._add(self._gauges, stat, lambda current: (current or 0) + value)
+        else:
+            self._add(self._gauges, stat, lambda current: value)
+
+    def set(self, stat, value, rate=1):
+        """Counts the distinct values seen between flushes."""
+        if not self._sampled(rate):
+            return
+
+        def update(values):
+            values = values or set()
+            values.add(value)
+            return values
+        self._add(self._sets, stat, update)
+
+    def timing(self, stat, delta, rate=1):
+        """Records a duration, in milliseconds."""
+        if not self._sampled(rate):
+            return
+
+        def update(values):
+            if values is None:
+                return [1, delta, delta, delta]
+            values[0] += 1
+            values[1] += delta
+            values[2] = min(values[2], delta)
+            values[3] = max(values[3], delta)
+            return values
+        self._add(self._timers, stat, update)
+
+    def timer(self, stat, rate=1):
+        """Returns a timer usable as a context manager or a decorator."""
+        return _Timer(self, stat, rate)
+
+    def flush(self):
+        """
+        Sends everything buffered so far to CloudWatch.
+        """
+        with self._lock:
+            # GOTCHA: Gauges are kept, so a delta applies to the last value and an unchanged gauge is still sent
+            counters, timers, gauges, sets = self._counters, self._timers, dict(self._gauges), self._sets
+            self._reset_buffers()
+
+        timestamp = datetime.utcnow()
+        metric_data = []
+        for stat, value in counters.items():
+            metric_data.append(self._datum(stat, timestamp, 'Count', Value=value))
+        for stat, (count, total, minimum, maximum) in timers.items():
+            metric_data.append(self._datum(stat, timestamp, 'Milliseconds', StatisticValues={
+                'SampleCount': count,
+                'Sum': total,
+                'Minimum': minimum,
+                'Maximum': maximum,
+            }))
+        for stat, value in gauges.items():
+            metric_data.append(self._datum(stat, timestamp, 'None', Value=value))
+        for stat, values in sets.items():
+            metric_data.append(self._datum(stat, timestamp, 'Count', Value=len(values)))
+
+        for start in range(0, len(metric_data), self._batch_size):
+            batch = metric_data[start:start + self._batch_size]
+            try:
+                self._client.put_metric_data(Namespace=self._namespace, MetricData=batch)
+            except Exception as e:
+                # GOTCHA: Do not retry. Stats must never pile up in memory or hold up the application.
+                with self._lock:
+                    self.dropped += len(batch)
+                self._logger.warn('Failed to send %d metrics to CloudWatch: %s', len(batch), e)
+
+    def close(self):
+        """
+        Stops the background thread and sends everything buffered so far.
+        """
+        if self._stop.is_set():
+            return
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            # GOTCHA: atexit would otherwise keep a reference to this object until the process exits
+            atexit.unregister(self.close)
+        self.flush()
+
+    def _run(self, flush_interval):
+        while not self._stop.wait(flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                self._logger.exception('Failed to flush stats to CloudWatch')
+
+    def _reset_buffers(self):
+        self._counters = {}
+        self._timers = {}
+        self._sets = {}
+
+    def _sampled(self, rate):
+        return rate >= 1 or random.random() < rate
+
+    def _add(self, buffer, stat, update):
+        with self._lock:
+            if stat not in buffer and self._size() >= self._max_metrics:
+                self.dropped += 1
+                return
+            buffer[stat] = update(buffer.get(stat))
+
+    def _size(self):
+        return len(self._counters) + len(self._timers) + len(self._gauges) + len(self._sets)
+
+    def _datum(self, stat, timestamp, unit, **values):
+        datum = {
+            'MetricName': '.'.join([self._prefix, stat]) if self._prefix else stat,
+            'Timestamp': timestamp,
+            'Unit': unit,
+        }
+        if self._dimensions:
+            datum['Dimensions'] = self._dimensions
+        datum.update(values)
+        return datum
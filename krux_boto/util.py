@@ -8,14 +8,20 @@
 #
 
 from builtins import range
+from http.client import HTTPConnection, HTTPException
+import json
+import os
 import string
-from collections import Mapping
+import tempfile
+import threading
+import time
+# GOTCHA: The ABCs are no longer importable directly from collections as of Python 3.10
+from collections.abc import Mapping
 
 #
 # Third party libraries
 #
 
-import boto.utils
 from enum import Enum
 
 #
@@ -24,22 +30,222 @@ from enum import Enum
 
 from krux.logging import get_logger
 
+# Constants
+METADATA_HOST = '169.254.169.254'
+METADATA_PORT = 80
+# The metadata service is link-local; if it does not answer quickly, we are most likely not on EC2.
+METADATA_TIMEOUT = 1
+METADATA_TOKEN_TTL = 21600
+# Refresh the IMDSv2 token a bit before it expires so an in-flight request never uses an expired one
+_METADATA_TOKEN_REFRESH_MARGIN = 60
+# Error codes AWS services answer with when a caller is being throttled
+THROTTLING_ERROR_CODES = frozenset([
+    'BandwidthLimitExceeded',
+    'EC2ThrottledException',
+    'LimitExceededException',
+    'ProvisionedThroughputExceededException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'SlowDown',
+    'ThrottledException',
+    'Throttling',
+    'ThrottlingException',
+    'TooManyRequestsException',
+])
+
+
 class Error(Exception):
     pass
 
 
+class InstanceMetadata(object):
+    """
+    A client for the EC2 instance metadata service.
+
+    It keeps a single persistent connection to the service, caches the IMDSv2 session token until
+    it expires, and fetches only the paths asked for. If the service does not hand out IMDSv2 tokens,
+    i.e. it rejects or never answers the token request, it falls back to IMDSv1 requests for as long
+    as a token would have lasted.
+    """
+
+    def __init__(
+        self,
+        host=METADATA_HOST,
+        port=METADATA_PORT,
+        timeout=METADATA_TIMEOUT,
+        token_ttl=METADATA_TOKEN_TTL,
+    ):
+        """
+        :param host: Host of the metadata service. Only change this for testing.
+        :type host: str
+        :param port: Port of the metadata service. Only change this for testing.
+        :type port: int
+        :param timeout: Timeout of each request, in seconds
+        :type timeout: float
+        :param token_ttl: Lifetime of the IMDSv2 session token, in seconds
+        :type token_ttl: int
+        """
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+        self._token_ttl = token_ttl
+
+        # GOTCHA: HTTPConnection is not thread-safe. Serialize the requests on the shared connection.
+        self._lock = threading.Lock()
+        self._conn = None
+        self._token = None
+        # Until then, the cached token is used, or IMDSv1 if there is none
+        self._token_expires_at = 0
+
+    def get(self, path):
+        """
+        Fetches a single metadata path, i.e. 'placement/availability-zone'.
+
+        :param path: Path under /latest/meta-data/
+        :type path: str
+        :return: The value of the path, or None if the path does not exist
+        :rtype: str
+        """
+        url = '/latest/meta-data/' + path.lstrip('/')
+
+        with self._lock:
+            try:
+                status, body = self._get(url)
+                if status == 401:
+                    # The token was revoked or expired early, or IMDSv2 became required.
+                    # Get a new one and try once more.
+                    self._token = None
+                    self._token_expires_at = 0
+                    status, body = self._get(url)
+            except (HTTPException, OSError) as e:
+                self._close()
+                raise Error('Failed to contact the instance metadata service: {0}'.format(e))
+
+        if status == 404:
+            return None
+        if status != 200:
+            raise Error('Instance metadata service returned HTTP {0} for {1}'.format(status, path))
+
+        return body.decode('utf-8')
+
+    def instance_id(self):
+        """
+        :return: ID of this instance, i.e. 'i-0123456789abcdef0'
+        :rtype: str
+        """
+        return self.get('instance-id')
+
+    def availability_zone(self):
+        """
+        :return: Availability zone of this instance, i.e. 'us-east-1a'
+        :rtype: str
+        """
+        return self.get('placement/availability-zone')
+
+    def region(self):
+        """
+        :return: Region of this instance, i.e. 'us-east-1'
+        :rtype: str
+        """
+        zone = self.availability_zone()
+        if zone is None:
+            return None
+        return zone.rstrip(string.ascii_lowercase)
+
+    def iam_role(self):
+        """
+        :return: Name of the IAM role attached to this instance, or None if there is none
+        :rtype: str
+        """
+        roles = self.get('iam/security-credentials/')
+        if not roles:
+            return None
+        return roles.splitlines()[0]
+
+    def _get(self, url):
+        headers = {}
+        token = self._get_token()
+        if token is not None:
+            headers['X-aws-ec2-metadata-token'] = token
+
+        return self._request('GET', url, headers)
+
+    def _get_token(self):
+        if time.time() < self._token_expires_at:
+            return self._token
+
+        self._token = None
+        try:
+            status, body = self._request('PUT', '/latest/api/token', {
+                'X-aws-ec2-metadata-token-ttl-seconds': str(self._token_ttl),
+            })
+        except (HTTPException, OSError) as e:
+            # GOTCHA: A PUT may never be answered, i.e. from a container beyond the hop limit of the token.
+            #         Drop the connection, which may still get the late response.
+            self._close()
+            status, body = e, None
+
+        # GOTCHA: Without a token, use IMDSv1 until the next token would be due, rather than asking on every call.
+        self._token_expires_at = time.time() + self._token_ttl - _METADATA_TOKEN_REFRESH_MARGIN
+        if status == 200:
+            self._token = body.decode('utf-8')
+        else:
+            get_logger('krux_boto').debug('Instance metadata service gave no token (%s); using IMDSv1', status)
+
+        return self._token
+
+    def _request(self, method, url, headers):
+        for attempt in (1, 2):
+            if self._conn is None:
+                self._conn = HTTPConnection(self._host, self._port, timeout=self._timeout)
+
+            try:
+                self._conn.request(method, url, headers=headers)
+                response = self._conn.getresponse()
+                return response.status, response.read()
+            except (HTTPException, ConnectionError):
+                # The service may have closed the idle connection. Reconnect once.
+                self._close()
+                if attempt == 2:
+                    raise
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+_instance_metadata = None
+
+
+def get_instance_metadata():
+    """
+    Returns the process-wide InstanceMetadata client, so every caller shares its connection and token.
+
+    :rtype: krux_boto.util.InstanceMetadata
+    """
+    global _instance_metadata
+    if _instance_metadata is None:
+        _instance_metadata = InstanceMetadata()
+    return _instance_metadata
+
+
 def get_instance_region():
     """
     Query the instance metadata service and return the region this instance is
-    placed in. If the metadata service can't be contacted, return a generic
-    default instead.
+    placed in. If the metadata service can't be contacted, raise an Error.
     """
     # TODO: XXX This shouldn't get called if we're not on EC2.
-    zone = boto.utils.get_instance_metadata().get('placement', {}).get('availability-zone', None)
-    if zone is None:
+    try:
+        region = get_instance_metadata().region()
+    except Error:
+        region = None
+
+    if region is None:
         get_logger('krux_boto').warn('get_instance_region failed to get the local instance region')
         raise Error('get_instance_region failed to get the local instance region')
-    return zone.rstrip(string.ascii_lowercase)
+    return region
 
 def setup_hosts(hosts, accepted_domains, default):
     """
@@ -61,6 +267,31 @@ def setup_hosts(hosts, accepted_domains, default):
             new_hostnames.append(hosts[i] + '.' + default)
     return new_hostnames
 
+
+def write_json(path, data):
+    """
+    Writes data to a JSON file, creating its directory if needed. Readers never see a partial file, and
+    concurrent writers, whether threads or processes, never mix their data.
+
+    :param path: Path of the file
+    :type path: str
+    :param data: Data to write
+    :type data: dict
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+
+    # GOTCHA: Write to a temporary file of our own and rename it over the file, which is atomic
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.{0}.'.format(os.path.basename(path)))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
 # Region codes
 class __RegionCode(Mapping):
 
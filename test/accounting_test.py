@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, division, print_function
+import socket
+import unittest
+
+#
+# Third party libraries
+#
+
+import boto3
+from botocore.awsrequest import AWSResponse
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from mock import MagicMock, patch
+
+#
+# Internal libraries
+#
+
+from krux_boto.accounting import CallAccounting
+
+
+class _FakeRaw(object):
+
+    def __init__(self, body):
+        self._body = body
+
+    def stream(self, **kwargs):
+        yield self._body
+
+
+class FakeConnection(object):
+    """
+    A boto2 connection whose requests get the next of the given statuses, or raise it if it is an exception.
+    """
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+
+    def make_request(self, action, params=None, path='/', verb='GET'):
+        status = self.statuses.pop(0)
+        if isinstance(status, Exception):
+            raise status
+        return MagicMock(status=status)
+
+
+class CallAccountingTest(unittest.TestCase):
+    TABLE_NAME = 'fake-table'
+
+    def setUp(self):
+        session = boto3.session.Session(
+            region_name='us-east-1', aws_access_key_id='fake-key', aws_secret_access_key='fake-secret',
+        )
+        self.client = session.client('dynamodb', config=Config(retries={'max_attempts': 3, 'mode': 'standard'}))
+        self.accounting = CallAccounting(logger=MagicMock())
+        self.accounting.register(self.client)
+
+        # Responses of the next attempts, as status codes, or exceptions to raise
+        self.responses = []
+        self.client.meta.events.register('before-send.*.*', self._fake_send)
+
+    def _fake_send(self, request, **kwargs):
+        status_code = self.responses.pop(0)
+        if isinstance(status_code, Exception):
+            raise status_code
+        body = b'{}' if status_code < 300 else b'{"__type": "ResourceNotFoundException", "message": "fake"}'
+        return AWSResponse(request.url, status_code, {}, _FakeRaw(body))
+
+    def _get_item(self):
+        return self.client.get_item(TableName=self.TABLE_NAME, Key={'id': {'S': 'fake'}})
+
+    @patch('botocore.endpoint.time.sleep')
+    def test_boto3(self, mock_sleep):
+        """
+        CallAccounting counts the calls, retries and errors of a boto3 client per operation
+        """
+        self.responses = [200, 500, 200, 400, 200]
+
+        self._get_item()
+        self._get_item()
+        with self.assertRaises(ClientError):
+            self._get_item()
+        self.client.list_tables()
+
+        get_item, list_tables = self.accounting.snapshot()
+        self.assertEqual(('dynamodb', 'GetItem', 3, 1, 1), get_item[:5])
+        self.assertEqual(('dynamodb', 'ListTables', 1, 0, 0), list_tables[:5])
+        self.assertGreaterEqual(get_item.latency, get_item.max_latency)
+
+    @patch('botocore.endpoint.time.sleep')
+    def test_boto3_connection_error(self, mock_sleep):
+        """
+        CallAccounting counts calls failing without a response as errors
+        """
+        self.responses = [socket.error('fake failure')] * 3
+
+        with self.assertRaises(Exception):
+            self._get_item()
+
+        self.assertEqual([('dynamodb', 'GetItem', 1, 0, 1)], [op[:5] for op in self.accounting.snapshot()])
+
+    def test_boto2(self):
+        """
+        CallAccounting counts the calls and errors of a boto2 connection per action
+        """
+        connection = FakeConnection([200, 500, socket.error('fake failure'), 200])
+        self.accounting.register_boto2(connection, 'ec2')
+
+        connection.make_request('DescribeInstances')
+        connection.make_request('DescribeInstances')
+        with self.assertRaises(socket.error):
+            connection.make_request(action='DescribeInstances')
+        connection.make_request('DescribeRegions', {}, '/', 'POST')
+
+        self.assertEqual(
+            [('ec2', 'DescribeInstances', 3, 0, 2), ('ec2', 'DescribeRegions', 1, 0, 0)],
+            [op[:5] for op in self.accounting.snapshot()],
+        )
+
+    def test_log_summary(self):
+        """
+        CallAccounting logs a table of the calls, the most frequent first
+        """
+        logger = MagicMock()
+        self.accounting.record('s3', 'ListObjectsV2', 0.5, retries=2)
+        self.accounting.record('s3', 'ListObjectsV2', 1.5, error=True)
+        self.accounting.record('sqs', 'ReceiveMessage', 0.1)
+
+        self.accounting.log_summary(logger)
+
+        lines = logger.info.call_args_list
+        self.assertEqual(('AWS calls: %d, retries: %d, errors: %d', 3, 2, 1), lines[0][0])
+        self.assertEqual(('s3', 'ListObjectsV2', 2, 2, 1, 2000.0, 1000.0, 1500.0), lines[2][0][1:])
+        self.assertEqual('ReceiveMessage', lines[3][0][2])
+
+        self.accounting.reset()
+        logger.reset_mock()
+        self.accounting.log_summary(logger)
+        self.assertFalse(logger.info.called)
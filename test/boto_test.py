@@ -9,6 +9,11 @@
 
 from __future__ import absolute_import, division, print_function
 from builtins import str
+import gzip
+import json
+import os
+import shutil
+import tempfile
 import unittest
 from logging import Logger, INFO
 
@@ -18,7 +23,7 @@ from logging import Logger, INFO
 
 import boto
 from argparse import ArgumentParser
-from mock import MagicMock, patch
+from mock import MagicMock, call, patch
 from six import iteritems
 
 #
@@ -26,11 +31,19 @@ from six import iteritems
 #
 
 import krux_boto.boto
+from krux_boto.boto import _reset_after_fork, _ConnectionProxy, get_shared_loader
 import krux.cli
 import krux.logging
 from krux_boto.boto import (
-    Boto, Boto3, add_boto_cli_arguments, ACCESS_KEY, SECRET_KEY, REGION, get_boto, get_boto3, DEFAULT
+    Boto, Boto3, add_boto_cli_arguments, ACCESS_KEY, SECRET_KEY, REGION, get_boto, get_boto3, DEFAULT,
+    reset_boto_instances,
 )
+from krux_boto.cassette import CassetteError
+from krux_boto.deadline import DeadlineExceededError
+
+
+def _process_map_fn(boto3, item):
+    return os.getpid(), id(boto3), boto3.cli_region, item * 2
 
 
 class GetBotoTest(unittest.TestCase):
@@ -38,6 +51,9 @@ class GetBotoTest(unittest.TestCase):
     FAKE_ACCESS_KEY = 'FAKE_ACCESS_KEY'
     FAKE_SECRET_KEY = 'FAKE_SECRET_KEY'
     FAKE_REGION = 'us-gov-west-1'  # This is a region that Krux will never use.
+    FAKE_PREWARM = ('ec2', 's3')
+    FAKE_ENDPOINT_URL = 'http://localhost:5000'
+    FAKE_ENDPOINTS = (('s3', 'http://localhost:9000'), ('dynamodb', 'http://localhost:8000'))
 
     _FAKE_COMMAND = [
         'krux-boto',
@@ -45,6 +61,10 @@ class GetBotoTest(unittest.TestCase):
         '--boto-access-key', FAKE_ACCESS_KEY,
         '--boto-secret-key', FAKE_SECRET_KEY,
         '--boto-region', FAKE_REGION,
+        '--boto-prewarm', 'ec2,s3',
+        '--boto-endpoint-url', FAKE_ENDPOINT_URL,
+        '--boto-endpoint', 's3=http://localhost:9000',
+        '--boto-endpoint', 'dynamodb = http://localhost:8000',
         '--foo',  # Adding an extra CLI argument to make sure this gets ignored without an error
     ]
 
@@ -53,12 +73,17 @@ class GetBotoTest(unittest.TestCase):
             boto_log_level=self.FAKE_LOG_LEVEL,
             boto_access_key=self.FAKE_ACCESS_KEY,
             boto_secret_key=self.FAKE_SECRET_KEY,
-            boto_region=self.FAKE_REGION
+            boto_region=self.FAKE_REGION,
+            boto_prewarm=self.FAKE_PREWARM,
+            boto_endpoint_url=self.FAKE_ENDPOINT_URL,
+            boto_endpoint=list(self.FAKE_ENDPOINTS),
         )
 
         self.logger = MagicMock()
         self.stats = MagicMock()
 
+        reset_boto_instances()
+
     @patch('krux_boto.boto.Boto')
     def test_get_boto_with_args(self, mock_boto):
         """
@@ -71,6 +96,8 @@ class GetBotoTest(unittest.TestCase):
             access_key=self.args.boto_access_key,
             secret_key=self.args.boto_secret_key,
             region=self.args.boto_region,
+            endpoint_url=self.FAKE_ENDPOINT_URL,
+            endpoints=self.FAKE_ENDPOINTS,
             logger=self.logger,
             stats=self.stats,
         )
@@ -93,6 +120,8 @@ class GetBotoTest(unittest.TestCase):
             access_key=self.args.boto_access_key,
             secret_key=self.args.boto_secret_key,
             region=self.args.boto_region,
+            endpoint_url=self.FAKE_ENDPOINT_URL,
+            endpoints=self.FAKE_ENDPOINTS,
             logger=self.logger,
             stats=self.stats,
         )
@@ -109,6 +138,9 @@ class GetBotoTest(unittest.TestCase):
             access_key=self.args.boto_access_key,
             secret_key=self.args.boto_secret_key,
             region=self.args.boto_region,
+            endpoint_url=self.FAKE_ENDPOINT_URL,
+            endpoints=self.FAKE_ENDPOINTS,
+            prewarm=self.args.boto_prewarm,
             logger=self.logger,
             stats=self.stats,
         )
@@ -131,6 +163,9 @@ class GetBotoTest(unittest.TestCase):
             access_key=self.args.boto_access_key,
             secret_key=self.args.boto_secret_key,
             region=self.args.boto_region,
+            endpoint_url=self.FAKE_ENDPOINT_URL,
+            endpoints=self.FAKE_ENDPOINTS,
+            prewarm=self.args.boto_prewarm,
             logger=self.logger,
             stats=self.stats,
         )
@@ -155,6 +190,8 @@ class GetBotoTest(unittest.TestCase):
             access_key=self.FAKE_ACCESS_KEY,
             secret_key=self.FAKE_SECRET_KEY,
             region=self.FAKE_REGION,
+            endpoint_url=None,
+            endpoints=None,
             logger=self.logger,
             stats=self.stats,
         )
@@ -179,11 +216,53 @@ class GetBotoTest(unittest.TestCase):
             access_key=self.FAKE_ACCESS_KEY,
             secret_key=self.FAKE_SECRET_KEY,
             region=self.FAKE_REGION,
+            endpoint_url=None,
+            endpoints=None,
+            prewarm=None,
             logger=self.logger,
             stats=self.stats,
         )
 
 
+    @patch('krux_boto.boto.Boto3')
+    def test_get_boto3_shared(self, mock_boto3):
+        """
+        get_boto3() returns the same object for the same settings
+        """
+        first = get_boto3(self.args, self.logger, self.stats)
+        second = get_boto3(self.args, MagicMock(), MagicMock())
+
+        self.assertIs(first, second)
+        self.assertEqual(1, mock_boto3.call_count)
+
+    @patch('krux_boto.boto.Boto3')
+    def test_get_boto3_different_settings(self, mock_boto3):
+        """
+        get_boto3() returns different objects for different settings
+        """
+        mock_boto3.side_effect = lambda **kwargs: MagicMock()
+
+        first = get_boto3(self.args, self.logger, self.stats)
+        self.args.boto_region = 'us-west-2'
+        second = get_boto3(self.args, self.logger, self.stats)
+
+        self.assertIsNot(first, second)
+        self.assertEqual(2, mock_boto3.call_count)
+
+    @patch('krux_boto.boto.Boto3')
+    def test_reset_boto_instances(self, mock_boto3):
+        """
+        reset_boto_instances() makes get_boto3() create a new object
+        """
+        mock_boto3.side_effect = lambda **kwargs: MagicMock()
+
+        first = get_boto3(self.args, self.logger, self.stats)
+        reset_boto_instances()
+        second = get_boto3(self.args, self.logger, self.stats)
+
+        self.assertIsNot(first, second)
+
+
 class BotoTest(unittest.TestCase):
 
     def test_region_no_env(self):
@@ -241,9 +320,19 @@ class BotoTest(unittest.TestCase):
             self.assertNotEqual(self.boto.cli_region, krux_boto.boto.os.environ[REGION])
             self.assertEqual(self.boto.cli_region, region)
 
+    @patch('krux_boto.boto.get_nearest_region', return_value='eu-west-1')
+    def test_region_auto(self, mock_get_nearest_region):
+        """
+        --boto-region auto uses the nearest region
+        """
+        self.boto = Boto3(region='auto', logger=MagicMock(spec=Logger, autospec=True))
+
+        self.assertEqual('eu-west-1', self.boto.cli_region)
+        mock_get_nearest_region.assert_called_once_with()
+
     def test_credential_logging_success(self):
         """
-        --boto-access-key and --boto-secret-key sets corresponding environment variables correctly
+        --boto-access-key and --boto-secret-key are passed to the session without touching the environment
         """
         # Mocking the logger to check for calls later
         mock_logger = MagicMock(spec=Logger, autospec=True)
@@ -255,16 +344,19 @@ class BotoTest(unittest.TestCase):
 
         # Mocking the os.environ dictionary as an empty dictionary
         with patch.dict('krux_boto.boto.os.environ', clear=True):
-            self.boto = Boto(
+            self.boto = Boto3(
                 access_key=credential_map[ACCESS_KEY],
                 secret_key=credential_map[SECRET_KEY],
                 logger=mock_logger,
             )
-            # Check the passed boto credentials are correctly set in the mocked os.environ dictionary
-            self.assertIn(ACCESS_KEY, krux_boto.boto.os.environ)
-            self.assertEqual(credential_map[ACCESS_KEY], krux_boto.boto.os.environ[ACCESS_KEY])
-            self.assertIn(SECRET_KEY, krux_boto.boto.os.environ)
-            self.assertEqual(credential_map[SECRET_KEY], krux_boto.boto.os.environ[SECRET_KEY])
+            # Check the environment is left alone
+            self.assertNotIn(ACCESS_KEY, krux_boto.boto.os.environ)
+            self.assertNotIn(SECRET_KEY, krux_boto.boto.os.environ)
+
+        # Check the passed boto credentials are used by the session
+        credentials = self.boto._boto.get_credentials()
+        self.assertEqual(credential_map[ACCESS_KEY], credentials.access_key)
+        self.assertEqual(credential_map[SECRET_KEY], credentials.secret_key)
 
         # Verify logging
         for key, val in iteritems(credential_map):
@@ -278,6 +370,23 @@ class BotoTest(unittest.TestCase):
                 not in mock_logger.info.call_args_list
             )
 
+    def test_credential_isolation(self):
+        """
+        Boto objects with different credentials do not interfere with each other
+        """
+        with patch.dict('krux_boto.boto.os.environ', clear=True):
+            boto_a = Boto(access_key='ACCESS_A', secret_key='SECRET_A')
+            boto_b = Boto(access_key='ACCESS_B', secret_key='SECRET_B')
+            boto3_a = Boto3(access_key='ACCESS_A', secret_key='SECRET_A')
+            boto3_b = Boto3(access_key='ACCESS_B', secret_key='SECRET_B')
+
+            # boto2 connections get the credentials of the object they were created through
+            self.assertEqual('ACCESS_A', boto_a.connect_ec2().aws_access_key_id)
+            self.assertEqual('ACCESS_B', boto_b.ec2.connect_to_region('us-east-1').aws_access_key_id)
+
+        self.assertEqual('ACCESS_A', boto3_a._boto.get_credentials().access_key)
+        self.assertEqual('ACCESS_B', boto3_b._boto.get_credentials().access_key)
+
     def test_credential_logging_empty(self):
         """
         Boto handles invalid --boto-access-key and --boto-secret-key values
@@ -298,9 +407,11 @@ class BotoTest(unittest.TestCase):
                 logger=mock_logger,
             )
 
-            # Check the passed boto credentials are correctly set in the mocked os.environ dictionary
+            # Check the environment is left alone
             self.assertNotIn(ACCESS_KEY, krux_boto.boto.os.environ)
             self.assertNotIn(SECRET_KEY, krux_boto.boto.os.environ)
+            # Check boto is left to resolve the credentials on its own
+            self.assertEqual({}, self.boto._credentials)
 
         # Verify the warning is logged
         for key, val in iteritems(credential_map):
@@ -389,7 +500,10 @@ class BotoTest(unittest.TestCase):
 
         # Verify a property is returned
         # GOTCHA: ec2 property is arbitrarily chosen. Any property is sufficient to test
-        self.assertEqual(boto.ec2, self.boto.ec2)
+        # Modules are proxied, so the connections they create get the settings of this object
+        ec2 = self.boto.ec2
+        self.assertIsInstance(ec2, _ConnectionProxy)
+        self.assertIs(boto.ec2, ec2._target)
 
         # Verify logging
         mock_logger.debug.assert_called_once_with('Calling wrapped boto attribute: %s on %s', 'ec2', self.boto)
@@ -404,11 +518,26 @@ class BotoTest(unittest.TestCase):
 
         self.boto = Boto(
             logger=mock_logger,
+            access_key='FAKE_ACCESS_KEY',
+            secret_key='FAKE_SECRET_KEY',
+            endpoints={'ec2': 'http://localhost:5000'},
         )
 
-        # Verify a function can be called directly from krux_boto and returns the correct value
+        # Verify the function is the boto one, proxied
         # GOTCHA: connect_ec2 function is arbitrarily chosen. Any function is sufficient to test
-        self.assertIsInstance(self.boto.connect_ec2(), boto.ec2.EC2Connection)
+        self.assertIs(boto.connect_ec2, self.boto._boto.connect_ec2.__wrapped__)
+
+        # Verify it can be called directly from krux_boto and returns the correct value
+        connection = self.boto.connect_ec2()
+        self.assertIsInstance(connection, boto.ec2.EC2Connection)
+
+        # Verify the credentials, endpoint and call accounting of this object are injected into the connection
+        self.assertEqual(
+            ('FAKE_ACCESS_KEY', 'FAKE_SECRET_KEY'), (connection.aws_access_key_id, connection.aws_secret_access_key),
+        )
+        self.assertEqual(('localhost', 5000), (connection.host, connection.port))
+        self.assertIn('make_request', vars(connection))
+        self.assertEqual(connection.make_request.__wrapped__, boto.ec2.EC2Connection.make_request.__get__(connection))
 
         # Verify logging
         mock_logger.debug.assert_any_call('Calling wrapped boto attribute: %s on %s', 'connect_ec2', self.boto)
@@ -429,10 +558,398 @@ class BotoTest(unittest.TestCase):
         mock_logger.debug.reset_mock()
 
         # We test the stringified version, because all the classes are autogenerated
-        # and assertIsIntance is not finding the class of the client. However, we want
+        # and assertIsIntance is not finding the class of the resource. However, we want
         # to still be sure the object returned is of the class we thing it is, hence
         # the workaround.
-        self.assertIn('botocore.client.EC2', str(self.boto.client('ec2')))
+        self.assertIn('ec2.ServiceResource', str(self.boto.resource('ec2')))
 
         # Verify logging
-        mock_logger.debug.assert_any_call('Calling wrapped boto attribute: %s on %s', 'client', self.boto)
+        mock_logger.debug.assert_any_call('Calling wrapped boto attribute: %s on %s', 'resource', self.boto)
+
+    def test_client_boto3(self):
+        """
+        Boto3.client() shares one client per service and region, unless extra arguments are passed
+        """
+        self.boto = Boto3(
+            logger=MagicMock(spec=Logger, autospec=True),
+        )
+
+        client = self.boto.client('ec2')
+        self.assertIn('botocore.client.EC2', str(client))
+        self.assertIs(client, self.boto.client('ec2'))
+        self.assertIsNot(client, self.boto.client('ec2', region_name='us-west-2'))
+        self.assertIsNot(client, self.boto.client('ec2', use_ssl=True))
+
+    def test_prewarm_boto3(self):
+        """
+        Boto3.prewarm() creates the clients in the background and caches them
+        """
+        self.boto = Boto3(
+            logger=MagicMock(spec=Logger, autospec=True),
+        )
+
+        futures = self.boto.prewarm(['ec2', 's3'], connect=False)
+
+        self.assertEqual(set(['ec2', 's3']), set(futures))
+        for service, future in iteritems(futures):
+            self.assertIs(self.boto.client(service), future.result())
+
+    @patch('krux_boto.boto.Boto3.prewarm')
+    def test_prewarm_boto3_init(self, mock_prewarm):
+        """
+        Boto3 prewarms the clients passed to the constructor
+        """
+        Boto3(
+            logger=MagicMock(spec=Logger, autospec=True),
+            prewarm=('sqs',),
+        )
+
+        mock_prewarm.assert_called_once_with(('sqs',))
+
+    def test_reset_after_fork(self):
+        """
+        Boto3 drops its session and clients in a forked child
+        """
+        self.boto = Boto3(
+            logger=MagicMock(spec=Logger, autospec=True),
+        )
+        client = self.boto.client('ec2')
+        session = self.boto._boto
+
+        with patch.object(self.boto, '_create_session', wraps=self.boto._create_session) as mock_create_session:
+            _reset_after_fork()
+
+            # The session is only created again once used
+            self.assertIsNone(self.boto._session)
+            self.assertFalse(mock_create_session.called)
+            self.assertIsNot(session, self.boto._boto)
+            mock_create_session.assert_called_once_with()
+
+        self.assertIsNot(client, self.boto.client('ec2'))
+
+    def test_process_map(self):
+        """
+        Boto3.process_map() runs the function in worker processes, each with its own Boto3 object
+        """
+        self.boto = Boto3(
+            logger=MagicMock(spec=Logger, autospec=True),
+            region='us-west-2',
+        )
+
+        results = self.boto.process_map(_process_map_fn, range(10), processes=2)
+
+        self.assertEqual([i * 2 for i in range(10)], [result[3] for result in results])
+        self.assertEqual(set(['us-west-2']), set(result[2] for result in results))
+
+        # Every worker process reuses a single Boto3 object
+        objects = {}
+        for pid, object_id, _, _ in results:
+            objects.setdefault(pid, set()).add(object_id)
+        for pid, object_ids in objects.items():
+            self.assertNotEqual(os.getpid(), pid)
+            self.assertEqual(1, len(object_ids))
+
+    def test_shared_loader(self):
+        """
+        Boto3 sessions share one botocore loader, whose search paths do not grow with each session
+        """
+        first = Boto3(logger=MagicMock(spec=Logger, autospec=True))
+        second = Boto3(logger=MagicMock(spec=Logger, autospec=True))
+        search_paths = list(get_shared_loader().search_paths)
+
+        third = Boto3(logger=MagicMock(spec=Logger, autospec=True))
+
+        for boto3_object in (first, second, third):
+            self.assertIs(get_shared_loader(), boto3_object._boto._session.get_component('data_loader'))
+        self.assertEqual(search_paths, get_shared_loader().search_paths)
+
+    def test_get_cloudwatch_stats(self):
+        """
+        Boto3.get_cloudwatch_stats() creates a stats client that sends to CloudWatch with a Boto3 client
+        """
+        self.boto = Boto3(
+            logger=MagicMock(spec=Logger, autospec=True),
+        )
+
+        stats = self.boto.get_cloudwatch_stats('FakeNamespace', flush_interval=None)
+
+        self.assertIs(self.boto.client('cloudwatch'), stats._client)
+
+    def test_get_sqs_consumer(self):
+        """
+        Boto3.get_sqs_consumer() creates a consumer with a client pooling enough connections for the receivers
+        """
+        self.boto = Boto3(
+            logger=MagicMock(spec=Logger, autospec=True),
+        )
+
+        consumer = self.boto.get_sqs_consumer('https://fake-queue-url', MagicMock(), receivers=12)
+
+        self.assertEqual(14, consumer._client.meta.config.max_pool_connections)
+
+    def test_bulk_delete_s3_objects(self):
+        """
+        Boto3.bulk_delete_s3_objects() deletes the listed keys with a client sized for the workers
+        """
+        self.boto = Boto3(
+            logger=MagicMock(spec=Logger, autospec=True),
+        )
+        self.boto.client = MagicMock()
+        self.boto.client.return_value.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [{'Key': 'fake/a'}, {'Key': 'fake/b'}]},
+        ]
+        self.boto.client.return_value.delete_objects.return_value = {}
+
+        result = self.boto.bulk_delete_s3_objects(
+            'fake-bucket', self.boto.iter_s3_keys('fake-bucket', prefix='fake/'), max_workers=20,
+        )
+
+        self.assertEqual(2, result.succeeded)
+        self.assertEqual(20, self.boto.client.call_args_list[-1][1]['config'].max_pool_connections)
+        self.boto.client.return_value.delete_objects.assert_called_once_with(
+            Bucket='fake-bucket', Delete={'Objects': [{'Key': 'fake/a'}, {'Key': 'fake/b'}], 'Quiet': True},
+        )
+
+    def test_copy_s3_object(self):
+        """
+        Boto3.copy_s3_object() reads the source with a client of its region and copies with one of the destination
+        """
+        self.boto = Boto3(
+            logger=MagicMock(spec=Logger, autospec=True),
+        )
+        self.boto.client = MagicMock()
+        self.boto.client.return_value.head_object.return_value = {'ContentLength': 10, 'ETag': '"fake-etag"'}
+        self.boto.client.return_value.copy_object.return_value = {'CopyObjectResult': {'ETag': '"fake-etag"'}}
+
+        result = self.boto.copy_s3_object(
+            'source-bucket', 'fake-key', 'destination-bucket',
+            source_region='us-west-2', destination_region='eu-west-1', max_workers=20, StorageClass='GLACIER',
+        )
+
+        self.assertEqual(('"fake-etag"', 10, 1), result[:3])
+        self.assertEqual(('s3', 'us-west-2'), self.boto.client.call_args_list[0][0])
+        self.assertEqual(('s3', 'eu-west-1'), self.boto.client.call_args_list[1][0])
+        self.assertEqual(20, self.boto.client.call_args_list[1][1]['config'].max_pool_connections)
+        self.boto.client.return_value.copy_object.assert_called_once_with(
+            Bucket='destination-bucket', Key='fake-key', CopySource={'Bucket': 'source-bucket', 'Key': 'fake-key'},
+            CopySourceIfMatch='"fake-etag"', StorageClass='GLACIER',
+        )
+
+    def test_s3_client_for_bucket(self):
+        """
+        Boto3.s3_client_for_bucket() returns a client of the region of the bucket, found out once
+        """
+        self.boto = Boto3(
+            logger=MagicMock(spec=Logger, autospec=True),
+            region='us-east-1',
+        )
+        self.boto.client = MagicMock()
+        self.boto.client.return_value.head_bucket.return_value = {
+            'ResponseMetadata': {'HTTPHeaders': {'x-amz-bucket-region': 'eu-west-1'}},
+        }
+
+        self.boto.s3_client_for_bucket('fake-bucket')
+        self.boto.iter_s3_keys('fake-bucket')
+
+        self.boto.client.return_value.head_bucket.assert_called_once_with(Bucket='fake-bucket')
+        self.assertEqual([call('s3'), call('s3', 'eu-west-1'), call('s3', 'eu-west-1')], self.boto.client.call_args_list)
+
+    def test_s3_client_for_bucket_endpoint(self):
+        """
+        Boto3.s3_client_for_bucket() does not look for the region of buckets of an S3 endpoint override
+        """
+        self.boto = Boto3(
+            logger=MagicMock(spec=Logger, autospec=True),
+            region='us-west-2',
+            endpoints={'s3': 'http://localhost:9000'},
+        )
+
+        client = self.boto.s3_client_for_bucket('fake-bucket')
+
+        self.assertIs(self.boto.client('s3'), client)
+        self.assertIsNone(self.boto._bucket_regions)
+
+    def test_list_s3_objects(self):
+        """
+        Boto3.list_s3_objects() lists the objects as records or columns of the given fields
+        """
+        self.boto = Boto3(
+            logger=MagicMock(spec=Logger, autospec=True),
+        )
+        self.boto.s3_client_for_bucket = MagicMock()
+        self.boto.s3_client_for_bucket.return_value.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [{'Key': 'fake/a', 'Size': 1}, {'Key': 'fake/b', 'Size': 2}]},
+        ]
+
+        records = self.boto.list_s3_objects('fake-bucket', prefix='fake/', fields=['key', 'size'])
+        columns = self.boto.list_s3_objects('fake-bucket', prefix='fake/', fields=['size'], columnar=True)
+
+        self.assertEqual([('fake/a', 1), ('fake/b', 2)], records)
+        self.assertEqual([1, 2], list(columns.column('size')))
+        self.boto.s3_client_for_bucket.return_value.get_paginator.return_value.paginate.assert_called_with(
+            Bucket='fake-bucket', Prefix='fake/',
+        )
+
+    def test_scan_dynamodb_table(self):
+        """
+        Boto3.scan_dynamodb_table() creates a parallel scan passing the extra arguments to scan()
+        """
+        self.boto = Boto3(
+            logger=MagicMock(spec=Logger, autospec=True),
+        )
+
+        scan = self.boto.scan_dynamodb_table('fake-table', total_segments=16, FilterExpression='fake')
+
+        self.assertEqual(16, scan._client.meta.config.max_pool_connections)
+        self.assertEqual({'FilterExpression': 'fake'}, scan._scan_args)
+
+    def test_get_ec2_inventory(self):
+        """
+        Boto3.get_ec2_inventory() reads the instances of each region with a client for that region
+        """
+        self.boto = Boto3(
+            logger=MagicMock(spec=Logger, autospec=True),
+        )
+        self.boto.client = MagicMock()
+        self.boto.client.return_value.get_paginator.return_value.paginate.return_value = [
+            {'Reservations': [{'Instances': [{'InstanceId': 'i-fake'}]}]},
+        ]
+
+        inventory = self.boto.get_ec2_inventory(regions=['us-east-1', 'us-west-2'])
+
+        self.assertEqual(['i-fake'], [instance['InstanceId'] for instance in inventory.instances()])
+        self.boto.client.assert_any_call('ec2', region_name='us-east-1')
+        self.boto.client.assert_any_call('ec2', region_name='us-west-2')
+
+    def test_enable_circuit_breaker(self):
+        """
+        Boto3.enable_circuit_breaker() guards the cached clients and the clients created afterwards
+        """
+        self.boto = Boto3(
+            logger=MagicMock(spec=Logger, autospec=True),
+        )
+        cached = self.boto.client('sqs')
+
+        with patch('krux_boto.boto.CircuitBreaker.register') as mock_register:
+            self.boto.enable_circuit_breaker(failure_threshold=3)
+            created = self.boto.client('sqs', region_name='us-west-2')
+
+        self.assertEqual([call(cached), call(created)], mock_register.call_args_list)
+
+    def test_hedged_client(self):
+        """
+        Boto3.hedged_client() wraps a client of the service with a connection per hedged call
+        """
+        self.boto = Boto3(
+            logger=MagicMock(spec=Logger, autospec=True),
+        )
+
+        client = self.boto.hedged_client('s3', max_workers=40)
+
+        self.assertEqual(40, client._client.meta.config.max_pool_connections)
+        self.assertEqual('s3', client.meta.service_model.service_name)
+
+    def test_deadline(self):
+        """
+        The clients of Boto3 fail calls made once the deadline has passed
+        """
+        self.boto = Boto3(
+            logger=MagicMock(spec=Logger, autospec=True),
+        )
+
+        with self.boto.deadline(0):
+            with self.assertRaises(DeadlineExceededError):
+                self.boto.client('sqs').list_queues()
+
+    def test_replay_cassette(self):
+        """
+        Boto3.replay_cassette() serves the calls of its clients from the cassette
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'cassette.jsonl.gz')
+        with gzip.open(path, 'wt') as f:
+            f.write(json.dumps({
+                'service': 'dynamodb', 'operation': 'ListTables', 'key': 'fake', 'method': 'POST', 'url': 'fake',
+                'status': 200, 'headers': {}, 'body': 'eyJUYWJsZU5hbWVzIjogWyJmYWtlLXRhYmxlIl19', 'latency': 0.1,
+            }) + '\n')
+        self.boto = Boto3(
+            logger=MagicMock(spec=Logger, autospec=True),
+        )
+        # Clients created before the cassette is replayed are served from it too
+        client = self.boto.client('dynamodb')
+
+        self.boto.replay_cassette(path)
+
+        self.assertEqual(['fake-table'], client.list_tables()['TableNames'])
+        with self.assertRaises(CassetteError):
+            self.boto.client('sqs').list_queues()
+
+    def test_call_accounting_boto3(self):
+        """
+        Boto3 counts the calls of its clients
+        """
+        self.boto = Boto3(
+            logger=MagicMock(spec=Logger, autospec=True),
+        )
+        client = self.boto.client('sqs')
+        client.meta.events.register(
+            'before-call.*.*', lambda **kwargs: (MagicMock(status_code=200), {'QueueUrls': []}),
+        )
+
+        client.list_queues()
+        client.list_queues()
+
+        self.assertEqual([('sqs', 'ListQueues', 2, 0, 0)], [op[:5] for op in self.boto.call_accounting.snapshot()])
+
+    def test_call_accounting_boto(self):
+        """
+        Boto counts the calls of the connections it creates
+        """
+        self.boto = Boto(
+            logger=MagicMock(spec=Logger, autospec=True),
+            access_key='FAKE_ACCESS_KEY',
+            secret_key='FAKE_SECRET_KEY',
+        )
+
+        ec2 = self.boto.ec2.connect_to_region('us-east-1')
+
+        self.assertTrue(hasattr(ec2.make_request, '__wrapped__'))
+
+    def test_endpoints_boto3(self):
+        """
+        Boto3 creates the clients with the endpoint of their service, or the default endpoint
+        """
+        self.boto = Boto3(
+            logger=MagicMock(spec=Logger, autospec=True),
+            endpoint_url='http://localhost:5000',
+            endpoints={'s3': 'http://localhost:9000'},
+        )
+
+        self.assertEqual('http://localhost:9000', self.boto.client('s3').meta.endpoint_url)
+        self.assertEqual('http://localhost:5000', self.boto.client('sqs').meta.endpoint_url)
+        self.assertEqual(
+            'http://localhost:6000',
+            self.boto.client('sqs', endpoint_url='http://localhost:6000').meta.endpoint_url,
+        )
+
+    def test_endpoints_boto(self):
+        """
+        Boto passes the endpoint of the service to the boto2 connect functions
+        """
+        self.boto = Boto(
+            logger=MagicMock(spec=Logger, autospec=True),
+            access_key='FAKE_ACCESS_KEY',
+            secret_key='FAKE_SECRET_KEY',
+            endpoint_url='http://localhost:5000',
+            endpoints={'s3': 'https://localhost:9000'},
+        )
+
+        s3 = self.boto.connect_s3()
+        self.assertEqual(('localhost', 9000, True), (s3.host, s3.port, s3.is_secure))
+
+        s3 = self.boto.s3.connect_to_region('us-east-1')
+        self.assertEqual(('localhost', 9000), (s3.host, s3.port))
+
+        ec2 = self.boto.connect_ec2()
+        self.assertEqual(('localhost', 5000, False), (ec2.host, ec2.port, ec2.is_secure))
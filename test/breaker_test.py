@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, division, print_function
+import unittest
+
+#
+# Third party libraries
+#
+
+import boto3
+from botocore.exceptions import ClientError
+from mock import MagicMock, patch
+
+#
+# Internal libraries
+#
+
+from krux_boto.breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/123456789012/fake-queue'
+
+    def setUp(self):
+        session = boto3.session.Session(
+            region_name='us-east-1', aws_access_key_id='fake-key', aws_secret_access_key='fake-secret',
+        )
+        self.client = session.client('sqs')
+        self.stats = MagicMock()
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, logger=MagicMock(), stats=self.stats)
+        self.breaker.register(self.client)
+
+        # Status codes of the responses of the next calls, returned without making any request
+        self.status_codes = []
+        self.client.meta.events.register('before-call.*.*', self._fake_response)
+
+    def _fake_response(self, **kwargs):
+        status_code = self.status_codes.pop(0)
+        parsed = {'ResponseMetadata': {'HTTPStatusCode': status_code}}
+        if status_code >= 300:
+            parsed['Error'] = {'Code': 'FakeError', 'Message': 'fake failure'}
+        return MagicMock(status_code=status_code), parsed
+
+    def _call(self, status_code):
+        self.status_codes.append(status_code)
+        self.client.get_queue_attributes(QueueUrl=self.QUEUE_URL)
+
+    def _fail(self):
+        with self.assertRaises(ClientError):
+            self._call(500)
+
+    def _succeed(self):
+        self._call(200)
+
+    def test_open(self):
+        """
+        CircuitBreaker opens after consecutive failures and fails calls fast while open
+        """
+        self._fail()
+        self._succeed()
+        self._fail()
+        self.assertEqual(CLOSED, self.breaker.state('sqs', 'us-east-1'))
+
+        self._fail()
+        self.assertEqual(OPEN, self.breaker.state('sqs', 'us-east-1'))
+
+        with self.assertRaises(CircuitOpenError):
+            self.client.get_queue_attributes(QueueUrl=self.QUEUE_URL)
+        self.stats.incr.assert_called_once_with('circuit_breaker.sqs.us-east-1.open')
+
+        # Other regions are not affected
+        self.assertEqual(CLOSED, self.breaker.state('sqs', 'us-west-2'))
+
+    def test_client_errors(self):
+        """
+        CircuitBreaker does not count 4xx errors as failures
+        """
+        for _ in range(3):
+            with self.assertRaises(ClientError):
+                self._call(403)
+
+        self.assertEqual(CLOSED, self.breaker.state('sqs', 'us-east-1'))
+
+    @patch('krux_boto.breaker.time')
+    def test_half_open(self, mock_time):
+        """
+        CircuitBreaker lets a trial call through after reset_timeout, closing on success and reopening on failure
+        """
+        mock_time.time.return_value = 1000
+        self._fail()
+        self._fail()
+
+        mock_time.time.return_value = 1031
+        self._fail()
+        self.assertEqual(OPEN, self.breaker.state('sqs', 'us-east-1'))
+        with self.assertRaises(CircuitOpenError):
+            self.client.get_queue_attributes(QueueUrl=self.QUEUE_URL)
+
+        mock_time.time.return_value = 1062
+        self._succeed()
+        self.assertEqual(CLOSED, self.breaker.state('sqs', 'us-east-1'))
+
+        self.assertEqual(
+            ['open', 'half_open', 'open', 'half_open', 'closed'],
+            [args[0][0].split('.')[-1] for args in self.stats.incr.call_args_list],
+        )
+
+    def test_single_trial(self):
+        """
+        CircuitBreaker lets only one trial call through at a time while half open
+        """
+        key = ('sqs', 'us-east-1')
+        self.breaker._circuits[key] = MagicMock(state=HALF_OPEN, trial_in_flight=True)
+
+        with self.assertRaises(CircuitOpenError):
+            self.breaker._before_call(key, context={})
+
+    def test_slow_calls(self):
+        """
+        CircuitBreaker counts calls slower than slow_call_threshold as failures
+        """
+        breaker = CircuitBreaker(failure_threshold=1, slow_call_threshold=5, logger=MagicMock())
+        key = ('sqs', 'us-east-1')
+
+        breaker._after_call(key, http_response=MagicMock(status_code=200), context={'krux_boto_breaker_start_time': 0})
+
+        self.assertEqual(OPEN, breaker.state(*key))
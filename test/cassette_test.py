@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, division, print_function
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+#
+# Third party libraries
+#
+
+import boto3
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError
+from mock import MagicMock, patch
+
+#
+# Internal libraries
+#
+
+from krux_boto.cassette import Cassette, CassetteError, RECORD, REPLAY
+
+
+class _FakeRaw(object):
+
+    def __init__(self, body):
+        self._body = body
+        self._read = False
+
+    def stream(self, **kwargs):
+        yield self._body
+
+    def read(self, amt=None):
+        if self._read:
+            return b''
+        self._read = True
+        return self._body
+
+
+class CassetteTest(unittest.TestCase):
+    TABLE_NAME = 'fake-table'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'cassette.jsonl.gz')
+
+        # Responses of the next requests, as (status code, headers, body)
+        self.responses = []
+
+    def _client(self, service, **credentials):
+        session = boto3.session.Session(region_name='us-east-1', **credentials)
+        return session.client(service)
+
+    def _fake_send(self, request, **kwargs):
+        status_code, headers, body = self.responses.pop(0)
+        return AWSResponse(request.url, status_code, headers, _FakeRaw(body))
+
+    def _record(self, service, calls):
+        """
+        Records the calls, made with a client of the service, against self.responses.
+        """
+        client = self._client(service, aws_access_key_id='fake-key', aws_secret_access_key='fake-secret')
+        with Cassette(self.path, mode=RECORD, logger=MagicMock()) as cassette:
+            cassette.register(client)
+            client.meta.events.register('before-send.*.*', self._fake_send)
+            return [call(client) for call in calls]
+
+    def _replay(self, service, **kwargs):
+        cassette = Cassette(self.path, mode=REPLAY, logger=MagicMock(), **kwargs)
+        # GOTCHA: No credentials, to make sure replayed requests are not signed
+        client = self._client(service)
+        client._request_signer._credentials = None
+        cassette.register(client)
+        return client
+
+    def _get_item(self, key):
+        return lambda client: client.get_item(TableName=self.TABLE_NAME, Key={'id': {'S': key}})
+
+    def _item(self, value):
+        return (200, {}, json.dumps({'Item': {'id': {'S': value}}}).encode())
+
+    def test_replay(self):
+        """
+        Cassette replays the responses of the recorded requests, in the order they were recorded
+        """
+        self.responses = [self._item('first'), self._item('second'), self._item('other')]
+        self._record('dynamodb', [self._get_item('a'), self._get_item('a'), self._get_item('b')])
+
+        client = self._replay('dynamodb')
+
+        self.assertEqual('other', self._get_item('b')(client)['Item']['id']['S'])
+        values = [self._get_item('a')(client)['Item']['id']['S'] for _ in range(3)]
+        self.assertEqual(['first', 'second', 'first'], values)
+
+    def test_operation_fallback(self):
+        """
+        Cassette serves requests that were not recorded with the next response of the same operation
+        """
+        self.responses = [self._item('first'), self._item('second')]
+        self._record('dynamodb', [self._get_item('a'), self._get_item('b')])
+
+        client = self._replay('dynamodb')
+
+        self.assertEqual('first', self._get_item('c')(client)['Item']['id']['S'])
+        self.assertEqual('second', self._get_item('d')(client)['Item']['id']['S'])
+
+        with self.assertRaises(CassetteError):
+            client.list_tables()
+
+    def test_errors(self):
+        """
+        Cassette replays error responses as errors
+        """
+        self.responses = [(400, {}, b'{"__type": "ResourceNotFoundException", "message": "fake"}')]
+        with self.assertRaises(ClientError):
+            self._record('dynamodb', [self._get_item('a')])
+
+        client = self._replay('dynamodb')
+
+        with self.assertRaises(client.exceptions.ResourceNotFoundException):
+            self._get_item('a')(client)
+
+    def test_scrubbed(self):
+        """
+        Cassette does not write credentials to the cassette
+        """
+        body = (
+            b'<AssumeRoleResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/"><AssumeRoleResult><Credentials>'
+            b'<AccessKeyId>fake-key-id</AccessKeyId><SecretAccessKey>fake-role-secret</SecretAccessKey>'
+            b'<SessionToken>fake-token</SessionToken><Expiration>2030-01-01T00:00:00Z</Expiration>'
+            b'</Credentials></AssumeRoleResult></AssumeRoleResponse>'
+        )
+        self.responses = [(200, {'x-amz-security-token': 'fake-token', 'content-length': str(len(body))}, body)]
+        assume_role = lambda client: client.assume_role(RoleArn='arn:aws:iam::1:role/fake', RoleSessionName='fake')
+        self._record('sts', [assume_role])
+
+        with gzip.open(self.path, 'rt') as f:
+            recorded = f.read()
+        for secret in ('fake-secret', 'fake-role-secret', 'fake-token', 'Authorization'):
+            self.assertNotIn(secret, recorded)
+
+        credentials = assume_role(self._replay('sts'))
+        self.assertEqual('SCRUBBED', credentials['Credentials']['SecretAccessKey'])
+        self.assertEqual('fake-key-id', credentials['Credentials']['AccessKeyId'])
+
+    def test_streaming(self):
+        """
+        Cassette records streamed bodies without taking them from the caller
+        """
+        self.responses = [(200, {'content-length': '11'}, b'fake-object')]
+        responses = self._record('s3', [lambda client: client.get_object(Bucket='fake-bucket', Key='fake-key')])
+
+        self.assertEqual(b'fake-object', responses[0]['Body'].read())
+        replayed = self._replay('s3').get_object(Bucket='fake-bucket', Key='fake-key')
+        self.assertEqual(b'fake-object', replayed['Body'].read())
+
+    @patch('krux_boto.cassette.time')
+    def test_simulate_latency(self, mock_time):
+        """
+        Cassette makes replayed responses take as long as they did when recorded
+        """
+        with gzip.open(self.path, 'wt') as f:
+            f.write(json.dumps({
+                'service': 'dynamodb', 'operation': 'ListTables', 'key': 'fake', 'method': 'POST', 'url': 'fake',
+                'status': 200, 'headers': {}, 'body': 'e30=', 'latency': 0.25,
+            }) + '\n')
+
+        self._replay('dynamodb', simulate_latency=True).list_tables()
+
+        mock_time.sleep.assert_called_once_with(0.25)
@@ -28,7 +28,9 @@ from mock import MagicMock, patch, call
 from krux.logging import DEFAULT_LOG_LEVEL
 from krux.stats import DummyStatsClient
 from krux_boto.boto import Boto, Boto3, NAME
-from krux_boto.cli import Application, main
+from krux_boto.cli import Application, BotoTestApplication, main
+from krux_boto.latency import RegionLatency
+from krux_boto.loadgen import LoadReport, Operation
 from krux.cli import get_group
 
 
@@ -60,6 +62,23 @@ class CLItest(unittest.TestCase):
         self.assertIn(NAME, self.app._VERSIONS)
         self.assertEqual(self._VERSION, self.app._VERSIONS[NAME])
 
+    @patch('krux_boto.cli.get_boto3')
+    @patch('krux_boto.cli.get_boto')
+    def test_lazy_boto(self, mock_get_boto, mock_get_boto3):
+        """
+        CLI constructor does not create boto objects until they are used
+        """
+        self.app = Application()
+
+        self.assertFalse(mock_get_boto.called)
+        self.assertFalse(mock_get_boto3.called)
+
+        self.assertEqual(mock_get_boto3.return_value, self.app.boto3)
+        self.assertEqual(mock_get_boto3.return_value, self.app.boto3)
+
+        mock_get_boto3.assert_called_once_with(self.app.args, self.app.logger, self.app.stats)
+        self.assertFalse(mock_get_boto.called)
+
     def test_add_cli_arguments(self):
         """
         All the necessary arguments for krux_boto are added and default values properly configured
@@ -77,7 +96,7 @@ class CLItest(unittest.TestCase):
         self.assertIn('boto_log_level', args)
         self.assertEqual(DEFAULT_LOG_LEVEL, args['boto_log_level'])
 
-    @patch('krux_boto.cli.Application.run')
+    @patch('krux_boto.cli.BotoTestApplication.run')
     @patch('krux_boto.cli.krux.cli.sys.exit')
     def test_main(self, mock_exit, mock_run):
         """
@@ -98,6 +117,77 @@ class CLItest(unittest.TestCase):
         # Verify the mock sys.exit has been called
         mock_exit.assert_called_once_with(0)
 
+    def test_call_accounting(self):
+        """
+        CLI logs the AWS calls made by the boto objects it created on exit
+        """
+        self.app = Application()
+        self.app.boto3 = MagicMock()
+
+        self.app._log_call_accounting()
+
+        self.app.boto3.call_accounting.log_summary.assert_called_once_with(self.app.logger)
+        self.assertIsNone(self.app._boto)
+
+    @patch.object(sys, 'argv', ['prog', 'latency', '--latency-samples', '3'])
+    @patch('krux_boto.cli.probe_regions')
+    def test_latency(self, mock_probe_regions):
+        """
+        latency mode probes all the valid regions and reports their latency
+        """
+        mock_probe_regions.return_value = [
+            RegionLatency(region='us-east-1', p50=10.0, p99=12.0, errors=0),
+            RegionLatency(region='ap-south-1', p50=None, p99=None, errors=3),
+        ]
+        app = BotoTestApplication()
+        app.boto3 = MagicMock()
+        app.logger = MagicMock(spec=Logger, autospec=True)
+
+        app.run()
+
+        mock_probe_regions.assert_called_once_with(app.boto3.get_valid_regions.return_value, samples=3)
+        app.logger.warn.assert_any_call('%-16s %10.1f %10.1f %7d', 'us-east-1', 10.0, 12.0, 0)
+        app.logger.warn.assert_any_call('%-16s %10s %10s %7d', 'ap-south-1', '-', '-', 3)
+
+    @patch.object(sys, 'argv', [
+        'prog', 'loadgen', '--loadgen-mix', 's3:list_buckets=3,sqs:list_queues', '--loadgen-model', 'asyncio',
+        '--loadgen-rate', '100',
+    ])
+    @patch('krux_boto.cli.LoadGenerator')
+    def test_loadgen(self, mock_generator):
+        """
+        loadgen mode runs the operation mix and reports throughput, latency and errors
+        """
+        mock_generator.return_value.run.return_value = LoadReport(
+            calls=200, errors=4, throttles=2, retries=0, duration=2.0, throughput=100.0,
+            p50=10.0, p90=20.0, p99=30.0, max=40.0, cpu_per_call=0.5,
+            operations={'list_buckets': (150, 4), 'list_queues': (50, 0)},
+        )
+        app = BotoTestApplication()
+        app.boto3 = MagicMock()
+        app.logger = MagicMock(spec=Logger, autospec=True)
+
+        app.run()
+
+        mix = mock_generator.call_args[0][1]
+        self.assertEqual([Operation('s3', 'list_buckets', {}, 3.0), Operation('sqs', 'list_queues', {}, 1.0)], mix)
+        self.assertEqual(100.0, mock_generator.call_args[1]['rate'])
+        mock_generator.return_value.run.assert_called_once_with(model='asyncio', processes=None)
+        app.logger.warn.assert_any_call(
+            '%d calls in %.1fs: %.1f calls/s, %.2f ms of CPU per call', 200, 2.0, 100.0, 0.5,
+        )
+        app.logger.warn.assert_any_call('Errors: %.2f%%, throttled: %.2f%%, retries: %d', 2.0, 1.0, 0)
+        app.logger.warn.assert_any_call('%-32s %10d %7d', 'list_buckets', 150, 4)
+
+    @patch.object(sys, 'argv', ['prog', 'memory', '--memory-sessions', '0'])
+    @patch('sys.stderr')
+    def test_memory_sessions(self, mock_stderr):
+        """
+        memory mode rejects a number of sessions below 1
+        """
+        with self.assertRaises(SystemExit):
+            BotoTestApplication()
+
     @patch.object(sys, 'argv', ['prog', 'arg1'])
     def test_inheritance(self):
         """
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, division, print_function
+import threading
+import unittest
+
+#
+# Third party libraries
+#
+
+import boto3
+from botocore.awsrequest import AWSResponse
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from mock import patch
+
+#
+# Internal libraries
+#
+
+from krux_boto.deadline import deadline, remaining, register_deadline, DeadlineExceededError, _version
+
+
+class _FakeRaw(object):
+
+    def __init__(self, body):
+        self._body = body
+
+    def stream(self, **kwargs):
+        yield self._body
+
+
+class DeadlineTest(unittest.TestCase):
+    TABLE_NAME = 'fake-table'
+
+    def setUp(self):
+        session = boto3.session.Session(
+            region_name='us-east-1', aws_access_key_id='fake-key', aws_secret_access_key='fake-secret',
+        )
+        self.client = session.client(
+            'dynamodb', config=Config(read_timeout=60, retries={'max_attempts': 10, 'mode': 'standard'}),
+        )
+        register_deadline(self.client)
+
+        # Responses of the next attempts, as (seconds the attempt takes, status code, error code)
+        self.responses = []
+        self.read_timeouts = []
+        self.client.meta.events.register('before-send.*.*', self._fake_send)
+
+    def _fake_send(self, request, **kwargs):
+        self.read_timeouts.append(request.context.get('read_timeout'))
+        duration, status_code, error_code = self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+        # GOTCHA: Not time.sleep(), which is patched to skip the backoff between retries
+        threading.Event().wait(duration)
+        body = b'{}' if error_code is None else '{{"__type": "{0}", "message": "fake"}}'.format(error_code).encode()
+        return AWSResponse(request.url, status_code, {}, _FakeRaw(body))
+
+    def _get_item(self):
+        return self.client.get_item(TableName=self.TABLE_NAME, Key={'id': {'S': 'fake'}})
+
+    def test_no_deadline(self):
+        """
+        Calls made without a deadline keep the read timeout of the client
+        """
+        self.responses = [(0, 200, None)]
+
+        self._get_item()
+
+        self.assertEqual([None], self.read_timeouts)
+        self.assertIsNone(remaining())
+
+    def test_read_timeout(self):
+        """
+        Calls made under a deadline have their read timeout shortened to the time left
+        """
+        self.responses = [(0, 200, None)]
+
+        with deadline(5):
+            with deadline(10):
+                self._get_item()
+
+        self.assertLessEqual(self.read_timeouts[0], 5)
+        self.assertIsNone(remaining())
+
+    @patch('krux_boto.deadline._warned', False)
+    @patch('krux_boto.deadline.PER_REQUEST_READ_TIMEOUT', False)
+    @patch('krux_boto.deadline.get_logger')
+    def test_read_timeout_unsupported(self, mock_get_logger):
+        """
+        Deadlines warn once when botocore cannot shorten the attempts
+        """
+        self.responses = [(0, 200, None)]
+
+        self._get_item()
+        with deadline(5):
+            self._get_item()
+            self._get_item()
+
+        self.assertEqual(1, mock_get_logger.return_value.warn.call_count)
+
+    def test_version(self):
+        """
+        Deadlines compare botocore versions numerically
+        """
+        self.assertGreater(_version('1.43.100'), (1, 43, 68))
+        self.assertLess(_version('1.19.17'), (1, 43, 68))
+        self.assertEqual((1, 43, 68), _version('1.43.68rc1'))
+
+    def test_expired(self):
+        """
+        Calls made once the deadline has passed fail right away
+        """
+        self.responses = [(0, 200, None)]
+
+        with deadline(0):
+            with self.assertRaises(DeadlineExceededError):
+                self._get_item()
+
+        self.assertEqual([], self.read_timeouts)
+
+    @patch('botocore.endpoint.time.sleep')
+    def test_stop_retrying(self, mock_sleep):
+        """
+        Calls stop retrying when there is less time left than an attempt takes
+        """
+        self.responses = [(0.05, 503, 'ServiceUnavailable')]
+
+        with deadline(0.12):
+            with self.assertRaises(DeadlineExceededError):
+                self._get_item()
+
+        self.assertLess(len(self.read_timeouts), 10)
+        self.assertTrue(all(timeout <= 0.12 for timeout in self.read_timeouts))
+
+    def test_not_retryable(self):
+        """
+        Errors that are not retried are raised as they are, even when the deadline is near
+        """
+        self.responses = [(0.05, 400, 'ResourceNotFoundException')]
+
+        with deadline(0.06):
+            with self.assertRaises(ClientError) as context:
+                self._get_item()
+
+        self.assertNotIsInstance(context.exception, DeadlineExceededError)
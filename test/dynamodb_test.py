@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, division, print_function
+import time
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import MagicMock
+
+#
+# Internal libraries
+#
+
+from krux_boto.dynamodb import DynamoDBParallelScan
+
+
+class FakeDynamoDBClient(object):
+    """
+    A minimal in-memory stand-in for the scan() call of the DynamoDB client.
+    Each segment holds ITEMS_PER_SEGMENT items, returned PAGE_SIZE at a time.
+    """
+    ITEMS_PER_SEGMENT = 5
+    PAGE_SIZE = 2
+
+    def __init__(self, capacity_per_page=1):
+        self.capacity_per_page = capacity_per_page
+        self.scan = MagicMock(side_effect=self._scan)
+
+    def _scan(self, TableName, Segment, TotalSegments, ExclusiveStartKey=None, **kwargs):
+        start = ExclusiveStartKey['n'] if ExclusiveStartKey else 0
+        end = min(start + self.PAGE_SIZE, self.ITEMS_PER_SEGMENT)
+        response = {
+            'Items': [{'id': {'S': '{0}-{1}'.format(Segment, n)}} for n in range(start, end)],
+            'ConsumedCapacity': {'TableName': TableName, 'CapacityUnits': self.capacity_per_page},
+        }
+        if end < self.ITEMS_PER_SEGMENT:
+            response['LastEvaluatedKey'] = {'n': end}
+        return response
+
+
+def _ids(items):
+    return sorted(item['id']['S'] for item in items)
+
+
+class DynamoDBParallelScanTest(unittest.TestCase):
+    TABLE_NAME = 'fake-table'
+    TOTAL_SEGMENTS = 4
+
+    def setUp(self):
+        self.client = FakeDynamoDBClient()
+        self.all_ids = sorted(
+            '{0}-{1}'.format(segment, n)
+            for segment in range(self.TOTAL_SEGMENTS) for n in range(FakeDynamoDBClient.ITEMS_PER_SEGMENT)
+        )
+
+    def test_scan(self):
+        """
+        DynamoDBParallelScan yields the items of every segment and marks them all finished
+        """
+        scan = DynamoDBParallelScan(
+            self.client, self.TABLE_NAME, total_segments=self.TOTAL_SEGMENTS, max_workers=2, max_buffered_pages=1,
+        )
+
+        self.assertEqual(self.all_ids, _ids(scan))
+        self.assertEqual(dict((segment, None) for segment in range(self.TOTAL_SEGMENTS)), scan.checkpoints)
+
+        segments = set(args[1]['Segment'] for args in self.client.scan.call_args_list)
+        self.assertEqual(set(range(self.TOTAL_SEGMENTS)), segments)
+        for args in self.client.scan.call_args_list:
+            self.assertEqual(self.TOTAL_SEGMENTS, args[1]['TotalSegments'])
+
+    def test_resume(self):
+        """
+        DynamoDBParallelScan resumes from the checkpoints of an interrupted scan without skipping items
+        """
+        scan = DynamoDBParallelScan(self.client, self.TABLE_NAME, total_segments=self.TOTAL_SEGMENTS)
+        items = iter(scan)
+        seen = [next(items) for _ in range(7)]
+        items.close()
+        checkpoints = dict(scan.checkpoints)
+
+        resumed = DynamoDBParallelScan(
+            self.client, self.TABLE_NAME, total_segments=self.TOTAL_SEGMENTS, checkpoints=checkpoints,
+        )
+
+        self.assertEqual(self.all_ids, sorted(set(_ids(seen)) | set(_ids(resumed))))
+
+    def test_resume_finished_segments(self):
+        """
+        DynamoDBParallelScan does not scan the segments a previous scan finished
+        """
+        scan = DynamoDBParallelScan(
+            self.client, self.TABLE_NAME, total_segments=2, checkpoints={'0': None, '1': {'n': 4}},
+        )
+
+        self.assertEqual(['1-4'], _ids(scan))
+        self.assertEqual(1, self.client.scan.call_count)
+        self.assertEqual({'n': 4}, self.client.scan.call_args[1]['ExclusiveStartKey'])
+
+    def test_error(self):
+        """
+        DynamoDBParallelScan raises the errors of the segments
+        """
+        self.client.scan.side_effect = RuntimeError('fake failure')
+
+        with self.assertRaises(RuntimeError):
+            list(DynamoDBParallelScan(self.client, self.TABLE_NAME, total_segments=self.TOTAL_SEGMENTS))
+
+    def test_read_capacity(self):
+        """
+        DynamoDBParallelScan keeps the consumed capacity within the budget
+        """
+        self.client.capacity_per_page = 10
+        scan = DynamoDBParallelScan(
+            self.client, self.TABLE_NAME, total_segments=self.TOTAL_SEGMENTS, read_capacity=100,
+        )
+
+        start = time.time()
+        self.assertEqual(self.all_ids, _ids(scan))
+
+        # 12 pages of 10 units each at 100 units per second, the first 100 units being available right away.
+        # Calls may run the bucket into debt by the pages in flight, hence the slack.
+        self.assertGreaterEqual(time.time() - start, 0.05)
+        for args in self.client.scan.call_args_list:
+            self.assertEqual('TOTAL', args[1]['ReturnConsumedCapacity'])
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, division, print_function
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import MagicMock
+
+#
+# Internal libraries
+#
+
+from krux_boto.ec2 import EC2Inventory
+
+
+def _instance(instance_id, ip, tags):
+    return {
+        'InstanceId': instance_id,
+        'PrivateIpAddress': ip,
+        'NetworkInterfaces': [{'PrivateIpAddresses': [{'PrivateIpAddress': ip}, {'PrivateIpAddress': ip + '0'}]}],
+        'Tags': [{'Key': key, 'Value': value} for key, value in sorted(tags.items())],
+    }
+
+
+class FakeEC2Client(object):
+    """
+    A minimal stand-in for the describe_instances paginator of the EC2 client.
+    """
+
+    def __init__(self, instances):
+        self.instances = instances
+        self.describe_count = 0
+
+    def get_paginator(self, operation_name):
+        paginator = MagicMock()
+        paginator.paginate.side_effect = self._paginate
+        return paginator
+
+    def _paginate(self):
+        self.describe_count += 1
+        # One reservation per page, to exercise the pagination
+        return [{'Reservations': [{'Instances': [instance]}]} for instance in self.instances]
+
+
+class EC2InventoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clients = {
+            'us-east-1': FakeEC2Client([
+                _instance('i-1', '10.0.0.1', {'Name': 'web-1', 'Role': 'web'}),
+                _instance('i-2', '10.0.0.2', {'Name': 'db-1', 'Role': 'db'}),
+            ]),
+            'us-west-2': FakeEC2Client([
+                _instance('i-3', '10.0.0.3', {'Name': 'web-2', 'Role': 'web'}),
+            ]),
+        }
+        self.inventory = EC2Inventory(self.clients.get, sorted(self.clients))
+        self.inventory.refresh()
+
+    def _ids(self, instances):
+        return [instance['InstanceId'] for instance in instances]
+
+    def test_lookups(self):
+        """
+        EC2Inventory finds instances by ID, tag and private IP across regions
+        """
+        self.assertEqual(3, len(self.inventory))
+        self.assertEqual('i-2', self.inventory.get('i-2')['InstanceId'])
+        self.assertIsNone(self.inventory.get('i-unknown'))
+        self.assertEqual(['i-1', 'i-3'], self._ids(self.inventory.find_by_tag('Role', 'web')))
+        self.assertEqual(['i-1', 'i-2', 'i-3'], self._ids(self.inventory.find_by_tag('Name')))
+        self.assertEqual([], self.inventory.find_by_tag('Role', 'cache'))
+        self.assertEqual(['i-3'], self._ids(self.inventory.find_by_private_ip('10.0.0.3')))
+        self.assertEqual(['i-3'], self._ids(self.inventory.find_by_private_ip('10.0.0.30')))
+        self.assertEqual(['i-1', 'i-2', 'i-3'], self._ids(self.inventory.instances()))
+
+    def test_incremental_refresh(self):
+        """
+        EC2Inventory.refresh() adds, updates and removes instances in the indexes
+        """
+        self.clients['us-east-1'].instances = [
+            _instance('i-1', '10.0.0.1', {'Name': 'web-1', 'Role': 'cache'}),
+            _instance('i-4', '10.0.0.4', {'Name': 'web-3', 'Role': 'web'}),
+        ]
+
+        self.inventory.refresh()
+
+        self.assertIsNone(self.inventory.get('i-2'))
+        self.assertEqual([], self.inventory.find_by_private_ip('10.0.0.2'))
+        self.assertEqual([], self.inventory.find_by_tag('Role', 'db'))
+        self.assertEqual(['i-1'], self._ids(self.inventory.find_by_tag('Role', 'cache')))
+        self.assertEqual(['i-3', 'i-4'], self._ids(self.inventory.find_by_tag('Role', 'web')))
+        self.assertNotIn(('Role', 'db'), self.inventory._by_tag)
+
+    def test_refresh_error(self):
+        """
+        EC2Inventory keeps the previous state of a region that cannot be read
+        """
+        self.inventory._logger = MagicMock()
+        self.clients['us-west-2'].get_paginator = MagicMock(side_effect=RuntimeError('fake failure'))
+        self.clients['us-east-1'].instances = []
+
+        self.inventory.refresh()
+
+        self.assertEqual(['i-3'], self._ids(self.inventory.instances()))
+
+    def test_background_refresh(self):
+        """
+        EC2Inventory refreshes itself in the background once started
+        """
+        inventory = EC2Inventory(self.clients.get, sorted(self.clients), refresh_interval=0.01)
+        inventory.start()
+        try:
+            while self.clients['us-east-1'].describe_count < 4:
+                inventory._stop.wait(0.01)
+        finally:
+            inventory.stop()
+
+        self.assertIsNone(inventory._thread)
+
+    def test_fields(self):
+        """
+        EC2Inventory keeps instances as records of the given fields, still indexed by tag and private IP
+        """
+        inventory = EC2Inventory(self.clients.get, sorted(self.clients), fields=['instance_id', 'private_ip'])
+        inventory.refresh()
+
+        self.assertEqual(('i-2', '10.0.0.2'), inventory.get('i-2'))
+        self.assertEqual(['i-1', 'i-3'], [instance.instance_id for instance in inventory.find_by_tag('Role', 'web')])
+
+        # Changes of the tags are picked up, although the records do not have them
+        self.clients['us-west-2'].instances = [_instance('i-3', '10.0.0.3', {'Name': 'web-2', 'Role': 'cache'})]
+        inventory.refresh()
+
+        self.assertEqual(['i-1'], [instance.instance_id for instance in inventory.find_by_tag('Role', 'web')])
+        self.assertEqual(['i-3'], [instance.instance_id for instance in inventory.find_by_tag('Role', 'cache')])
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, division, print_function
+import threading
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import MagicMock, patch
+
+#
+# Internal libraries
+#
+
+from krux_boto.deadline import deadline, remaining
+from krux_boto.hedge import HedgedClient, _OperationLatency
+
+
+class FakeClient(object):
+    """
+    A client whose first get_object() call is slow, and whose next calls return right away.
+    """
+
+    def __init__(self, slow_error=None):
+        self.slow_error = slow_error
+        self.release = threading.Event()
+        self.bodies = []
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get_object(self, Bucket, Key):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        body = MagicMock()
+        self.bodies.append(body)
+        if call == 1:
+            self.release.wait(5)
+            if self.slow_error is not None:
+                raise self.slow_error
+            return {'Body': body, 'Call': 'slow'}
+        return {'Body': body, 'Call': 'fast'}
+
+    def put_object(self, Bucket, Key, Body):
+        return {'Call': 'put'}
+
+
+class HedgedClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        self.stats = MagicMock()
+        self.hedged = HedgedClient(self.client, delay=0.01, max_extra_load=1, stats=self.stats)
+
+    def tearDown(self):
+        self.client.release.set()
+
+    def test_hedge_wins(self):
+        """
+        HedgedClient returns the hedge when the first call is slow, and closes the body of the slow one
+        """
+        response = self.hedged.get_object(Bucket='fake-bucket', Key='fake-key')
+
+        self.assertEqual('fast', response['Call'])
+        self.assertEqual(1, self.hedged.hedge_wins)
+        self.stats.incr.assert_any_call('hedge.get_object.sent')
+        self.stats.incr.assert_any_call('hedge.get_object.won')
+
+        self.client.release.set()
+        self.hedged._executor.shutdown(wait=True)
+        self.client.bodies[0].close.assert_called_once_with()
+        self.assertFalse(self.client.bodies[1].close.called)
+
+    def test_error(self):
+        """
+        HedgedClient raises the error of a call that fails before being hedged
+        """
+        self.client.slow_error = RuntimeError('fake failure')
+        self.client.release.set()
+
+        with self.assertRaises(RuntimeError):
+            self.hedged.get_object(Bucket='fake-bucket', Key='fake-key')
+        self.assertEqual(0, self.hedged.hedges)
+
+    def test_no_hedge_when_fast(self):
+        """
+        HedgedClient does not hedge calls returning within the delay
+        """
+        self.client.calls = 1
+
+        response = self.hedged.get_object(Bucket='fake-bucket', Key='fake-key')
+
+        self.assertEqual('fast', response['Call'])
+        self.assertEqual(1, self.client.calls - 1)
+        self.assertEqual(0, self.hedged.hedges)
+
+    def test_extra_load_cap(self):
+        """
+        HedgedClient does not hedge beyond max_extra_load
+        """
+        hedged = HedgedClient(self.client, delay=0.01, max_extra_load=0.5)
+        self.client.release.set()
+
+        self.assertEqual('slow', hedged.get_object(Bucket='fake-bucket', Key='fake-key')['Call'])
+        self.assertEqual(0, hedged.hedges)
+
+    def test_other_operations(self):
+        """
+        HedgedClient passes the calls of the operations it does not hedge through
+        """
+        self.assertEqual(self.client.put_object, self.hedged.put_object)
+        self.assertEqual({'Call': 'put'}, self.hedged.put_object(Bucket='fake-bucket', Key='fake-key', Body=b''))
+
+    def test_deadline(self):
+        """
+        HedgedClient makes the calls under the deadline of the caller
+        """
+        left = []
+        self.client.put_object = lambda **kwargs: left.append(remaining())
+        hedged = HedgedClient(self.client, operations=['put_object'], delay=0.01)
+
+        with deadline(10):
+            hedged.put_object(Bucket='fake-bucket', Key='fake-key', Body=b'')
+        hedged.put_object(Bucket='fake-bucket', Key='fake-key', Body=b'')
+
+        self.assertTrue(0 < left[0] <= 10)
+        self.assertIsNone(left[1])
+
+    def test_close(self):
+        """
+        HedgedClient shuts down its thread pool and closes the wrapped client when closed
+        """
+        self.client.close = MagicMock()
+
+        with self.hedged as hedged:
+            self.client.release.set()
+            hedged.get_object(Bucket='fake-bucket', Key='fake-key')
+
+        self.assertTrue(self.hedged._executor._shutdown)
+        self.client.close.assert_called_once_with()
+        with self.assertRaises(RuntimeError):
+            self.hedged.get_object(Bucket='fake-bucket', Key='fake-key')
+
+
+class OperationLatencyTest(unittest.TestCase):
+
+    @patch('krux_boto.hedge.percentile', return_value=0.5)
+    def test_p95(self, mock_percentile):
+        """
+        _OperationLatency computes the p95 every 50 latencies, including once its window is full
+        """
+        latency = _OperationLatency()
+
+        for _ in range(49):
+            latency.add(0.1)
+        self.assertIsNone(latency.p95)
+
+        for _ in range(1000 + 1):
+            latency.add(0.1)
+
+        self.assertEqual(0.5, latency.p95)
+        self.assertEqual(21, mock_percentile.call_count)
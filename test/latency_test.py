@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, division, print_function
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import patch
+
+#
+# Internal libraries
+#
+
+from krux_boto.latency import get_nearest_region, percentile, RegionLatency
+from krux_boto.util import Error
+
+
+class LatencyTest(unittest.TestCase):
+    REGIONS = ['us-east-1', 'us-west-2', 'eu-west-1']
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.tmp_dir, 'cache', 'region-latency.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_percentile(self):
+        """
+        percentile() returns the nearest-rank percentile
+        """
+        samples = [5, 1, 4, 2, 3]
+        self.assertEqual(3, percentile(samples, 50))
+        self.assertEqual(5, percentile(samples, 99))
+        self.assertEqual(1, percentile(samples, 0))
+        self.assertIsNone(percentile([], 50))
+
+    @patch('krux_boto.latency.probe_regions')
+    def test_get_nearest_region(self, mock_probe_regions):
+        """
+        get_nearest_region() picks the fastest region and caches it on disk
+        """
+        mock_probe_regions.return_value = [
+            RegionLatency(region='us-west-2', p50=10.0, p99=20.0, errors=0),
+            RegionLatency(region='us-east-1', p50=50.0, p99=60.0, errors=0),
+        ]
+
+        self.assertEqual('us-west-2', get_nearest_region(self.REGIONS, cache_path=self.cache_path))
+        # The second call is served from the cache
+        self.assertEqual('us-west-2', get_nearest_region(self.REGIONS, cache_path=self.cache_path))
+
+        self.assertEqual(1, mock_probe_regions.call_count)
+        with open(self.cache_path) as f:
+            self.assertEqual('us-west-2', json.load(f)['region'])
+
+    @patch('krux_boto.latency.probe_regions')
+    def test_get_nearest_region_expired(self, mock_probe_regions):
+        """
+        get_nearest_region() probes again once the cache expires
+        """
+        os.makedirs(os.path.dirname(self.cache_path))
+        with open(self.cache_path, 'w') as f:
+            json.dump({'timestamp': time.time() - 100, 'regions': sorted(self.REGIONS), 'region': 'eu-west-1'}, f)
+        mock_probe_regions.return_value = [RegionLatency(region='us-east-1', p50=10.0, p99=20.0, errors=0)]
+
+        self.assertEqual('us-east-1', get_nearest_region(self.REGIONS, cache_path=self.cache_path, ttl=10))
+
+    @patch('krux_boto.latency.probe_regions')
+    def test_get_nearest_region_unreachable(self, mock_probe_regions):
+        """
+        get_nearest_region() raises an error when no region can be reached
+        """
+        mock_probe_regions.return_value = [RegionLatency(region='us-east-1', p50=None, p99=None, errors=5)]
+
+        with self.assertRaises(Error):
+            get_nearest_region(self.REGIONS, cache_path=None)
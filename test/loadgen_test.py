@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, division, print_function
+import json
+import os
+import tempfile
+import unittest
+
+#
+# Third party libraries
+#
+
+from botocore.exceptions import ClientError
+from mock import MagicMock
+
+#
+# Internal libraries
+#
+
+from krux_boto.loadgen import parse_mix, LoadGenerator, Operation
+
+
+class FakeClient(object):
+    """
+    A client whose list_queues() succeeds and whose list_buckets() is throttled.
+    """
+
+    def list_queues(self):
+        return {'QueueUrls': [], 'ResponseMetadata': {'RetryAttempts': 1}}
+
+    def list_buckets(self):
+        raise ClientError({'Error': {'Code': 'SlowDown', 'Message': 'fake'}}, 'ListBuckets')
+
+    def describe_regions(self):
+        raise RuntimeError('fake failure')
+
+
+class ParseMixTest(unittest.TestCase):
+
+    def test_inline(self):
+        """
+        parse_mix() parses a comma separated list of weighted operations
+        """
+        self.assertEqual(
+            [Operation('s3', 'list_buckets', {}, 3.0), Operation('sqs', 'list_queues', {}, 1.0)],
+            parse_mix('s3:list_buckets=3, sqs:list_queues'),
+        )
+
+    def test_file(self):
+        """
+        parse_mix() reads the operations and their parameters from a JSON file
+        """
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump([{'service': 's3', 'operation': 'head_object', 'params': {'Bucket': 'b', 'Key': 'k'}}], f)
+        self.addCleanup(os.remove, f.name)
+
+        self.assertEqual([Operation('s3', 'head_object', {'Bucket': 'b', 'Key': 'k'}, 1.0)], parse_mix('@' + f.name))
+
+    def test_invalid(self):
+        """
+        parse_mix() rejects operations without a service and weights that are not positive
+        """
+        for value in ('list_buckets', 's3:list_buckets=0', ''):
+            with self.assertRaises(ValueError):
+                parse_mix(value)
+
+
+class LoadGeneratorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.boto3 = MagicMock()
+        self.boto3.client.return_value = FakeClient()
+
+    def _run(self, mix, model='threads', processes=None, **kwargs):
+        kwargs.setdefault('duration', 0.2)
+        generator = LoadGenerator(self.boto3, parse_mix(mix), concurrency=4, seed=0, logger=MagicMock(), **kwargs)
+        return generator.run(model=model, processes=processes)
+
+    def test_threads(self):
+        """
+        LoadGenerator counts the calls, errors, throttles and retries of every operation
+        """
+        report = self._run('sqs:list_queues,s3:list_buckets,ec2:describe_regions')
+
+        calls = dict((name, counts[0]) for name, counts in report.operations.items())
+        errors = dict((name, counts[1]) for name, counts in report.operations.items())
+        self.assertEqual(set(['list_queues', 'list_buckets', 'describe_regions']), set(calls))
+        self.assertEqual(report.calls, sum(calls.values()))
+        self.assertEqual(0, errors['list_queues'])
+        self.assertEqual(calls['list_queues'], report.retries)
+        self.assertEqual(calls['list_buckets'], report.throttles)
+        self.assertEqual(calls['list_buckets'] + calls['describe_regions'], report.errors)
+        self.assertGreater(report.throughput, 0)
+        self.assertLessEqual(report.p50, report.p99)
+        self.assertIsNotNone(report.cpu_per_call)
+
+    def test_client_config(self):
+        """
+        LoadGenerator creates one client per service, sized for the concurrency and with the given retries
+        """
+        self._run('sqs:list_queues', duration=0, retries=2)
+
+        self.boto3.client.assert_called_once()
+        config = self.boto3.client.call_args[1]['config']
+        self.assertEqual(10, config.max_pool_connections)
+        self.assertEqual(3, config.retries['total_max_attempts'])
+
+    def test_rate(self):
+        """
+        LoadGenerator makes calls at the given rate instead of as fast as it can
+        """
+        report = self._run('sqs:list_queues', rate=50, duration=0.2)
+
+        self.assertEqual(10, report.calls)
+
+    def test_asyncio(self):
+        """
+        LoadGenerator can schedule the calls from an event loop
+        """
+        report = self._run('sqs:list_queues', model='asyncio', rate=50, duration=0.2)
+
+        self.assertEqual(10, report.calls)
+        self.assertEqual(0, report.errors)
+
+    def test_processes(self):
+        """
+        LoadGenerator splits the load across worker processes and merges their results
+        """
+        self.boto3.process_map.side_effect = lambda fn, tasks, processes: [fn(self.boto3, task) for task in tasks]
+
+        report = self._run('sqs:list_queues', model='processes', processes=2, rate=50, duration=0.2)
+
+        tasks = self.boto3.process_map.call_args[0][1]
+        self.assertEqual([2, 2], [task['concurrency'] for task in tasks])
+        self.assertEqual([25, 25], [task['rate'] for task in tasks])
+        self.assertEqual(10, report.calls)
+
+    def test_unknown_model(self):
+        """
+        LoadGenerator rejects unknown concurrency models
+        """
+        with self.assertRaises(ValueError):
+            self._run('sqs:list_queues', model='fibers')
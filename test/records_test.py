@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, division, print_function
+from datetime import datetime
+import pickle
+import unittest
+
+#
+# Third party libraries
+#
+
+from dateutil.tz import tzutc
+
+#
+# Internal libraries
+#
+
+from krux_boto.records import RecordSchema, S3_OBJECT, EC2_INSTANCE
+
+
+def _object(key, size, storage_class='STANDARD'):
+    return {
+        'Key': key,
+        'Size': size,
+        'ETag': '"fake-etag-{0}"'.format(key),
+        'LastModified': datetime(2016, 1, 1, tzinfo=tzutc()),
+        'StorageClass': storage_class,
+        'Owner': {'ID': 'fake-owner'},
+    }
+
+
+class RecordSchemaTest(unittest.TestCase):
+
+    def test_record(self):
+        """
+        RecordSchema keeps the given fields of an item only, with timestamps in seconds since the epoch
+        """
+        schema = RecordSchema(S3_OBJECT)
+
+        record = schema.record(_object('a', 10))
+
+        self.assertEqual(('a', 10, 'fake-etag-a', 1451606400), record)
+        self.assertEqual('a', record.key)
+        self.assertEqual(1451606400, record.last_modified)
+        self.assertFalse(hasattr(record, '__dict__'))
+
+    def test_ec2_instance(self):
+        """
+        RecordSchema reads nested fields and tags of EC2 instances
+        """
+        schema = RecordSchema(EC2_INSTANCE, ['instance_id', 'state', 'availability_zone', 'tags', 'public_ip'])
+
+        record = schema.record({
+            'InstanceId': 'i-1',
+            'State': {'Name': 'running'},
+            'Placement': {'AvailabilityZone': 'us-east-1a'},
+            'Tags': [{'Key': 'Role', 'Value': 'web'}, {'Key': 'Name', 'Value': 'web-1'}],
+        })
+
+        self.assertEqual(('i-1', 'running', 'us-east-1a', (('Name', 'web-1'), ('Role', 'web')), None), record)
+
+    def test_invalid(self):
+        """
+        RecordSchema rejects unknown kinds and fields
+        """
+        with self.assertRaises(ValueError):
+            RecordSchema('fake_kind')
+        with self.assertRaises(ValueError):
+            RecordSchema(S3_OBJECT, ['key', 'owner'])
+
+    def test_same_class(self):
+        """
+        RecordSchema shares the record class of the same fields, and its records can be pickled
+        """
+        record = RecordSchema(S3_OBJECT, ['key', 'size']).record(_object('a', 10))
+
+        self.assertIs(RecordSchema(S3_OBJECT, ['key', 'size']).record_class, type(record))
+        self.assertIsNot(RecordSchema(S3_OBJECT, ['size', 'key']).record_class, type(record))
+        self.assertEqual(record, pickle.loads(pickle.dumps(record)))
+
+
+class ColumnsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.schema = RecordSchema(S3_OBJECT, ['key', 'size', 'storage_class'])
+        self.columns = self.schema.columns([
+            _object('a', 10), _object('b', 20, 'GLACIER'), _object('c', 30),
+        ])
+
+    def test_records(self):
+        """
+        Columns yields the same records as the schema
+        """
+        self.assertEqual(3, len(self.columns))
+        self.assertEqual(self.schema.record(_object('b', 20, 'GLACIER')), self.columns[1])
+        self.assertEqual(('c', 30, 'STANDARD'), self.columns[-1])
+        self.assertEqual(['a', 'b', 'c'], [record.key for record in self.columns])
+        with self.assertRaises(IndexError):
+            self.columns[3]
+
+    def test_column(self):
+        """
+        Columns returns the values of a field, with integers packed in an array
+        """
+        self.assertEqual([10, 20, 30], list(self.columns.column('size')))
+        self.assertEqual('q', self.columns.column('size').typecode)
+        self.assertEqual(['STANDARD', 'GLACIER', 'STANDARD'], self.columns.column('storage_class'))
+        with self.assertRaises(KeyError):
+            self.columns.column('etag')
+
+        # Values of categories are stored once
+        self.assertEqual(['STANDARD', 'GLACIER'], self.columns._categories['storage_class'][0])
+
+    def test_pickle(self):
+        """
+        Columns can be pickled, i.e. to be returned by Boto3.process_map()
+        """
+        self.assertEqual(list(self.columns), list(pickle.loads(pickle.dumps(self.columns))))
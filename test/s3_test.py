@@ -0,0 +1,855 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, division, print_function
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+
+#
+# Third party libraries
+#
+
+from botocore.exceptions import ClientError
+from mock import MagicMock, patch
+
+#
+# Internal libraries
+#
+
+from krux_boto.s3 import S3Downloader, S3MultipartWriter, ChecksumMismatchError, MIN_PART_SIZE
+from krux_boto.s3 import S3BulkDeleter, S3BulkCopier, S3MultipartCopier, iter_s3_keys, MAX_PARTS
+from krux_boto.s3 import BucketRegionCache, S3BulkOperation
+
+
+class FakeS3Client(object):
+    """
+    A minimal in-memory stand-in for the parts of the S3 client the helpers use.
+    """
+    _RANGE_PATTERN = re.compile(r'^bytes=(\d+)-(\d+)$')
+
+    def __init__(self, data, etag=None):
+        self.data = data
+        self.etag = etag or '"{0}"'.format(hashlib.md5(data).hexdigest())
+        self.get_object = MagicMock(side_effect=self._get_object)
+        self.head_object = MagicMock(side_effect=self._head_object)
+
+        self.uploaded_parts = {}
+        self.put_object = MagicMock()
+        self.create_multipart_upload = MagicMock(return_value={'UploadId': 'fake-upload-id'})
+        self.upload_part = MagicMock(side_effect=self._upload_part)
+        self.complete_multipart_upload = MagicMock()
+        self.abort_multipart_upload = MagicMock()
+
+    def _head_object(self, Bucket, Key, PartNumber=None, **kwargs):
+        return {'ContentLength': len(self.data), 'ETag': self.etag}
+
+    def _get_object(self, Bucket, Key, Range, IfMatch, **kwargs):
+        start, end = [int(x) for x in self._RANGE_PATTERN.match(Range).groups()]
+        return {'Body': io.BytesIO(self.data[start:end + 1])}
+
+    def _upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploaded_parts[PartNumber] = Body
+        return {'ETag': '"etag-{0}"'.format(PartNumber)}
+
+
+class S3DownloaderTest(unittest.TestCase):
+    BUCKET = 'fake-bucket'
+    KEY = 'fake/key'
+    PART_SIZE = 1000
+
+    def setUp(self):
+        self.data = os.urandom(self.PART_SIZE * 3 + 123)
+        self.client = FakeS3Client(self.data)
+        self.downloader = S3Downloader(self.client, part_size=self.PART_SIZE, max_workers=4)
+
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_download_to_file(self):
+        """
+        S3Downloader writes all the parts into the target file
+        """
+        path = os.path.join(self.tmp_dir, 'target')
+
+        self.assertEqual(len(self.data), self.downloader.download(self.BUCKET, self.KEY, path))
+
+        with open(path, 'rb') as f:
+            self.assertEqual(self.data, f.read())
+
+        # One ranged GET per part, each pinned to the ETag
+        self.assertEqual(4, self.client.get_object.call_count)
+        for args in self.client.get_object.call_args_list:
+            self.assertEqual(self.client.etag, args[1]['IfMatch'])
+
+    def test_download_to_buffer(self):
+        """
+        S3Downloader writes all the parts into a caller-supplied buffer
+        """
+        buf = bytearray(len(self.data) + 10)
+
+        self.downloader.download(self.BUCKET, self.KEY, buf)
+
+        self.assertEqual(self.data, bytes(buf[:len(self.data)]))
+
+    def test_download_buffer_too_small(self):
+        """
+        S3Downloader rejects a buffer smaller than the object
+        """
+        with self.assertRaises(ValueError):
+            self.downloader.download(self.BUCKET, self.KEY, bytearray(10))
+
+    def test_download_checksum_mismatch(self):
+        """
+        S3Downloader raises an error when the data does not match the ETag
+        """
+        self.client.etag = '"{0}"'.format(hashlib.md5(b'something else').hexdigest())
+
+        with self.assertRaises(ChecksumMismatchError):
+            self.downloader.download(self.BUCKET, self.KEY, bytearray(len(self.data)))
+
+    def _set_parts(self, part_sizes, etag_sizes=None):
+        """
+        Makes the object look uploaded in parts of part_sizes, with the ETag of parts of etag_sizes.
+        """
+        digests = []
+        start = 0
+        for part_size in etag_sizes or part_sizes:
+            digests.append(hashlib.md5(self.data[start:start + part_size]).digest())
+            start += part_size
+        self.client.etag = '"{0}-{1}"'.format(hashlib.md5(b''.join(digests)).hexdigest(), len(digests))
+        self.client.head_object.side_effect = lambda PartNumber=None, **kwargs: {
+            'ContentLength': part_sizes[PartNumber - 1] if PartNumber else len(self.data),
+            'ETag': self.client.etag,
+        }
+
+    def test_download_multipart_checksum(self):
+        """
+        S3Downloader verifies multipart ETags using the size of the first part
+        """
+        # Parts of a size other than the one of the ranged GETs
+        self._set_parts([2000, len(self.data) - 2000])
+
+        self.downloader.download(self.BUCKET, self.KEY, bytearray(len(self.data)))
+
+        # A single HEAD of a part, whatever the number of parts
+        self.assertEqual(
+            [1], [c[1]['PartNumber'] for c in self.client.head_object.call_args_list if 'PartNumber' in c[1]],
+        )
+
+    def test_download_multipart_checksum_mismatch(self):
+        """
+        S3Downloader raises an error when the data does not match a multipart ETag
+        """
+        self._set_parts([2000, len(self.data) - 2000], etag_sizes=[len(self.data) - 2000, 2000])
+
+        with self.assertRaises(ChecksumMismatchError):
+            self.downloader.download(self.BUCKET, self.KEY, bytearray(len(self.data)))
+
+        # A multipart upload of a single part
+        self._set_parts([len(self.data)])
+        self.client.etag = '"{0}-1"'.format(hashlib.md5(b'something else').hexdigest())
+
+        with self.assertRaises(ChecksumMismatchError):
+            self.downloader.download(self.BUCKET, self.KEY, bytearray(len(self.data)))
+
+    def test_download_multipart_unknown_parts(self):
+        """
+        S3Downloader skips verifying multipart ETags when the part sizes cannot be found out
+        """
+        # GOTCHA: An ETag the data does not match, to tell verifying from skipping
+        self._set_parts([2000, len(self.data) - 2000], etag_sizes=[1000, len(self.data) - 1000])
+        head_object = self.client.head_object.side_effect
+
+        def head_part(PartNumber=None, **kwargs):
+            if PartNumber:
+                raise ClientError({'Error': {'Code': '403', 'Message': ''}}, 'HeadObject')
+            return head_object(**kwargs)
+
+        self.client.head_object.side_effect = head_part
+
+        self.downloader.download(self.BUCKET, self.KEY, bytearray(len(self.data)))
+
+        # Parts of the size of the first one do not add up to the size of the object
+        self._set_parts([1000, len(self.data) - 1000], etag_sizes=[2000, len(self.data) - 2000])
+
+        self.downloader.download(self.BUCKET, self.KEY, bytearray(len(self.data)))
+
+    def test_download_read_fallback(self):
+        """
+        S3Downloader reads bodies without readinto() with read()
+        """
+        get_object = self.client.get_object.side_effect
+
+        def read_only(**kwargs):
+            body = get_object(**kwargs)['Body']
+            return {'Body': MagicMock(spec=['read', 'close'], read=body.read)}
+
+        self.client.get_object.side_effect = read_only
+        buf = bytearray(len(self.data))
+
+        self.downloader.download(self.BUCKET, self.KEY, buf)
+
+        self.assertEqual(self.data, bytes(buf))
+
+    def test_download_empty(self):
+        """
+        S3Downloader handles empty objects
+        """
+        self.client.data = b''
+        path = os.path.join(self.tmp_dir, 'target')
+
+        self.assertEqual(0, self.downloader.download(self.BUCKET, self.KEY, path))
+        self.assertEqual(0, os.path.getsize(path))
+        self.assertFalse(self.client.get_object.called)
+
+
+class S3MultipartWriterTest(unittest.TestCase):
+    BUCKET = 'fake-bucket'
+    KEY = 'fake/key'
+
+    def setUp(self):
+        self.client = FakeS3Client(b'')
+
+    def test_small_payload(self):
+        """
+        S3MultipartWriter falls back to a single put_object() for payloads smaller than a part
+        """
+        with S3MultipartWriter(self.client, self.BUCKET, self.KEY, extra_args={'ContentType': 'text/plain'}) as writer:
+            writer.writelines([b'foo', b'bar'])
+
+        self.client.put_object.assert_called_once_with(
+            Bucket=self.BUCKET, Key=self.KEY, Body=b'foobar', ContentType='text/plain',
+        )
+        self.assertFalse(self.client.create_multipart_upload.called)
+
+    def test_multipart(self):
+        """
+        S3MultipartWriter uploads full parts as they fill and completes the upload in order
+        """
+        data = os.urandom(MIN_PART_SIZE * 2 + 100)
+
+        with S3MultipartWriter(self.client, self.BUCKET, self.KEY, part_size=MIN_PART_SIZE, max_in_flight=2) as writer:
+            writer.write_from(io.BytesIO(data))
+
+        self.assertFalse(self.client.put_object.called)
+        self.assertEqual(data, b''.join(self.client.uploaded_parts[n] for n in sorted(self.client.uploaded_parts)))
+        self.client.complete_multipart_upload.assert_called_once_with(
+            Bucket=self.BUCKET,
+            Key=self.KEY,
+            UploadId='fake-upload-id',
+            MultipartUpload={'Parts': [{'PartNumber': n, 'ETag': '"etag-{0}"'.format(n)} for n in (1, 2, 3)]},
+        )
+        self.assertFalse(self.client.abort_multipart_upload.called)
+
+    def test_abort_on_error(self):
+        """
+        S3MultipartWriter aborts the multipart upload when a part fails
+        """
+        self.client.upload_part.side_effect = RuntimeError('fake failure')
+
+        with self.assertRaises(RuntimeError):
+            with S3MultipartWriter(self.client, self.BUCKET, self.KEY, part_size=MIN_PART_SIZE) as writer:
+                writer.write(os.urandom(MIN_PART_SIZE * 2))
+
+        self.client.abort_multipart_upload.assert_called_once_with(
+            Bucket=self.BUCKET, Key=self.KEY, UploadId='fake-upload-id',
+        )
+        self.assertFalse(self.client.complete_multipart_upload.called)
+
+    def test_large_write(self):
+        """
+        S3MultipartWriter buffers a single write larger than a part one part at a time, holding at most
+        max_in_flight parts buffered or uploading
+        """
+        data = os.urandom(MIN_PART_SIZE * 3 + 100)
+        writer = S3MultipartWriter(self.client, self.BUCKET, self.KEY, part_size=MIN_PART_SIZE, max_in_flight=1)
+        buffered = []
+        upload_part = self.client.upload_part.side_effect
+
+        def record_buffer(**kwargs):
+            buffered.append(len(writer._buffer))
+            return upload_part(**kwargs)
+
+        self.client.upload_part.side_effect = record_buffer
+
+        with writer:
+            self.assertEqual(len(data), writer.write(data))
+
+        self.assertEqual(data, b''.join(self.client.uploaded_parts[n] for n in sorted(self.client.uploaded_parts)))
+        self.assertEqual(4, len(buffered))
+        self.assertLess(max(buffered), MIN_PART_SIZE)
+        # The next part is only buffered once the upload of the previous one is done
+        self.assertEqual([0, 0, 0], buffered[:3])
+
+    def test_abort_failure(self):
+        """
+        S3MultipartWriter raises the original error when aborting the multipart upload fails too
+        """
+        self.client.upload_part.side_effect = RuntimeError('fake failure')
+        self.client.abort_multipart_upload.side_effect = ClientError(
+            {'Error': {'Code': 'NoSuchUpload', 'Message': 'fake'}}, 'AbortMultipartUpload',
+        )
+
+        with self.assertRaises(RuntimeError):
+            with S3MultipartWriter(self.client, self.BUCKET, self.KEY, part_size=MIN_PART_SIZE) as writer:
+                writer.write(os.urandom(MIN_PART_SIZE * 2))
+
+        with self.assertRaises(RuntimeError):
+            writer = S3MultipartWriter(self.client, self.BUCKET, self.KEY, part_size=MIN_PART_SIZE)
+            writer.write(os.urandom(MIN_PART_SIZE))
+            writer.close()
+
+    def test_part_size_too_small(self):
+        """
+        S3MultipartWriter rejects parts smaller than S3 allows
+        """
+        with self.assertRaises(ValueError):
+            S3MultipartWriter(self.client, self.BUCKET, self.KEY, part_size=MIN_PART_SIZE - 1)
+
+
+class IterS3KeysTest(unittest.TestCase):
+
+    def test_iter_s3_keys(self):
+        """
+        iter_s3_keys() yields the keys of every page of the listing
+        """
+        client = MagicMock()
+        client.get_paginator.return_value.paginate.return_value = iter([
+            {'Contents': [{'Key': 'a'}, {'Key': 'b'}]},
+            {},
+            {'Contents': [{'Key': 'c'}]},
+        ])
+
+        self.assertEqual(['a', 'b', 'c'], list(iter_s3_keys(client, 'fake-bucket', prefix='fake/', start_after='0')))
+
+        client.get_paginator.assert_called_once_with('list_objects_v2')
+        client.get_paginator.return_value.paginate.assert_called_once_with(
+            Bucket='fake-bucket', Prefix='fake/', StartAfter='0',
+        )
+
+
+@patch('krux_boto.s3.random.uniform', return_value=0)
+class S3BulkDeleterTest(unittest.TestCase):
+    BUCKET = 'fake-bucket'
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.deleted = []
+        self.lock = threading.Lock()
+        self.client.delete_objects.side_effect = self._delete_objects
+        # Codes of the errors of the next attempts to delete a key
+        self.key_errors = {}
+
+    def _delete_objects(self, Bucket, Delete):
+        errors = []
+        with self.lock:
+            for item in Delete['Objects']:
+                codes = self.key_errors.get(item['Key'])
+                if codes:
+                    errors.append({'Key': item['Key'], 'Code': codes.pop(0), 'Message': 'fake'})
+                else:
+                    self.deleted.append(item['Key'])
+        return {'Errors': errors}
+
+    def _keys(self, count):
+        return ('key-{0:05d}'.format(i) for i in range(count))
+
+    def test_batches(self, mock_uniform):
+        """
+        S3BulkDeleter deletes the keys in batches of up to 1,000 keys
+        """
+        result = S3BulkDeleter(self.client, self.BUCKET, max_workers=2, logger=MagicMock()).run(self._keys(2500))
+
+        self.assertEqual(sorted(self._keys(2500)), sorted(self.deleted))
+        self.assertEqual(
+            [1000, 1000, 500],
+            sorted([len(c[1]['Delete']['Objects']) for c in self.client.delete_objects.call_args_list], reverse=True),
+        )
+        self.assertTrue(all(c[1]['Delete']['Quiet'] for c in self.client.delete_objects.call_args_list))
+        self.assertEqual((2500, 0, {}), (result.succeeded, result.failed, result.errors))
+
+    def test_retries(self, mock_uniform):
+        """
+        S3BulkDeleter retries the keys failing with transient errors, and fails the others right away
+        """
+        self.key_errors = {
+            'key-00001': ['SlowDown', 'InternalError'],
+            'key-00002': ['AccessDenied'],
+            'key-00003': ['SlowDown'] * 5,
+        }
+
+        result = S3BulkDeleter(self.client, self.BUCKET, max_retries=3, logger=MagicMock()).run(self._keys(5))
+
+        self.assertIn('key-00001', self.deleted)
+        self.assertEqual({'key-00002': 'AccessDenied', 'key-00003': 'SlowDown'}, result.errors)
+        self.assertEqual((3, 2), (result.succeeded, result.failed))
+        # The retries only include the keys that failed
+        self.assertEqual(
+            [5, 2, 2, 1], [len(c[1]['Delete']['Objects']) for c in self.client.delete_objects.call_args_list],
+        )
+
+    def test_call_failure(self, mock_uniform):
+        """
+        S3BulkDeleter retries a whole batch when its call fails
+        """
+        self.client.delete_objects.side_effect = [
+            ClientError({'Error': {'Code': 'ServiceUnavailable', 'Message': 'fake'}}, 'DeleteObjects'),
+            {'Errors': []},
+        ]
+
+        result = S3BulkDeleter(self.client, self.BUCKET, logger=MagicMock()).run(self._keys(3))
+
+        self.assertEqual((3, 0), (result.succeeded, result.failed))
+
+    def test_backpressure(self, mock_uniform):
+        """
+        S3BulkDeleter stops consuming keys while the workers are busy
+        """
+        release = threading.Event()
+        consumed = []
+
+        def keys():
+            for key in self._keys(100):
+                consumed.append(key)
+                yield key
+
+        def delete_objects(**kwargs):
+            release.wait(5)
+            return {}
+        self.client.delete_objects.side_effect = delete_objects
+
+        deleter = S3BulkDeleter(self.client, self.BUCKET, batch_size=1, max_workers=1, logger=MagicMock())
+        thread = threading.Thread(target=deleter.run, args=(keys(),))
+        thread.start()
+        try:
+            threading.Event().wait(0.2)
+            # Two batches pending, and one waiting for a slot
+            self.assertEqual(3, len(consumed))
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(100, len(consumed))
+
+    def test_progress(self, mock_uniform):
+        """
+        S3BulkDeleter reports its progress
+        """
+        progress = MagicMock()
+
+        S3BulkDeleter(self.client, self.BUCKET, batch_size=10, progress_interval=0, progress=progress).run(
+            self._keys(50)
+        )
+
+        self.assertGreater(progress.call_count, 1)
+        final = progress.call_args[0][0]
+        self.assertEqual((50, 50, 0), (final.submitted, final.succeeded, final.failed))
+
+    def test_progress_unlocked(self, mock_uniform):
+        """
+        S3BulkDeleter reports its progress without holding its lock
+        """
+        locked = []
+
+        def try_lock():
+            acquired = deleter._lock.acquire(timeout=1)
+            locked.append(not acquired)
+            if acquired:
+                deleter._lock.release()
+
+        def progress(_):
+            # The lock is reentrant, so try it from another thread
+            thread = threading.Thread(target=try_lock)
+            thread.start()
+            thread.join()
+
+        deleter = S3BulkDeleter(self.client, self.BUCKET, batch_size=10, progress_interval=0, progress=progress)
+        deleter.run(self._keys(50))
+
+        self.assertTrue(locked)
+        self.assertFalse(any(locked))
+
+    def test_abstract(self, mock_uniform):
+        """
+        S3BulkOperation cannot be instantiated without the methods of an operation
+        """
+        class PartialOperation(S3BulkOperation):
+            def _stat_name(self):
+                return 'partial'
+
+        with self.assertRaises(TypeError):
+            PartialOperation(self.client, batch_size=10)
+
+    def test_batch_size_too_large(self, mock_uniform):
+        """
+        S3BulkDeleter rejects batches larger than DeleteObjects allows
+        """
+        with self.assertRaises(ValueError):
+            S3BulkDeleter(self.client, self.BUCKET, batch_size=1001)
+
+
+class S3BulkCopierTest(unittest.TestCase):
+
+    def test_copy(self):
+        """
+        S3BulkCopier copies every key to its destination key
+        """
+        client = MagicMock()
+        client.copy_object.side_effect = lambda **kwargs: (
+            self._raise('NoSuchKey') if kwargs['CopySource']['Key'] == 'src/b' else {}
+        )
+
+        copier = S3BulkCopier(
+            client, 'source-bucket', 'destination-bucket', key_map=lambda key: 'dst/' + key[len('src/'):],
+            batch_size=2, extra_args={'StorageClass': 'STANDARD_IA'}, logger=MagicMock(),
+        )
+        result = copier.run(['src/a', 'src/b', 'src/c'])
+
+        client.copy_object.assert_any_call(
+            Bucket='destination-bucket', Key='dst/a', CopySource={'Bucket': 'source-bucket', 'Key': 'src/a'},
+            StorageClass='STANDARD_IA',
+        )
+        self.assertEqual(3, client.copy_object.call_count)
+        self.assertEqual((2, {'src/b': 'NoSuchKey'}), (result.succeeded, result.errors))
+
+    def _raise(self, code):
+        raise ClientError({'Error': {'Code': code, 'Message': 'fake'}}, 'CopyObject')
+
+
+class S3MultipartCopierTest(unittest.TestCase):
+    SOURCE = {'Bucket': 'source-bucket', 'Key': 'source/key'}
+
+    def setUp(self):
+        self.head = {
+            'ContentLength': MIN_PART_SIZE * 2 + 100,
+            'ETag': '"fake-etag"',
+            'ContentType': 'text/csv',
+            'Metadata': {'origin': 'fake'},
+            'LastModified': 'fake',
+        }
+        self.source_client = MagicMock()
+        self.source_client.head_object.side_effect = lambda **kwargs: self.head
+        self.source_client.get_object_tagging.return_value = {
+            'TagSet': [{'Key': 'team', 'Value': 'data'}, {'Key': 'note', 'Value': 'a b'}],
+        }
+
+        self.destination_client = MagicMock()
+        self.destination_client.copy_object.return_value = {'CopyObjectResult': {'ETag': '"copy-etag"'}}
+        self.destination_client.create_multipart_upload.return_value = {'UploadId': 'fake-upload-id'}
+        self.destination_client.upload_part_copy.side_effect = lambda PartNumber, **kwargs: {
+            'CopyPartResult': {'ETag': '"etag-{0}"'.format(PartNumber)},
+        }
+        self.destination_client.complete_multipart_upload.return_value = {'ETag': '"multipart-etag"'}
+        self.stats = MagicMock()
+
+    def _copy(self, **kwargs):
+        kwargs.setdefault('multipart_threshold', MIN_PART_SIZE)
+        copier = S3MultipartCopier(
+            self.source_client, self.destination_client, part_size=MIN_PART_SIZE, max_workers=4,
+            logger=MagicMock(), stats=self.stats, **kwargs
+        )
+        return copier.copy('source-bucket', 'source/key', 'destination-bucket', 'destination/key',
+                           extra_args={'StorageClass': 'STANDARD_IA'})
+
+    def test_small_object(self):
+        """
+        S3MultipartCopier copies objects up to the threshold with a single copy_object()
+        """
+        self.head['ContentLength'] = 100
+
+        result = self._copy()
+
+        self.destination_client.copy_object.assert_called_once_with(
+            Bucket='destination-bucket', Key='destination/key', CopySource=self.SOURCE,
+            CopySourceIfMatch='"fake-etag"', StorageClass='STANDARD_IA',
+        )
+        self.assertFalse(self.destination_client.create_multipart_upload.called)
+        self.assertEqual(('"copy-etag"', 100, 1), result[:3])
+
+    def test_small_object_new_metadata(self):
+        """
+        S3MultipartCopier replaces the metadata of small objects when given new metadata or content headers
+        """
+        self.head['ContentLength'] = 100
+
+        copier = S3MultipartCopier(self.source_client, self.destination_client, logger=MagicMock())
+        copier.copy('source-bucket', 'source/key', 'destination-bucket', 'destination/key',
+                    extra_args={'ContentType': 'application/json'})
+
+        self.destination_client.copy_object.assert_called_once_with(
+            Bucket='destination-bucket', Key='destination/key', CopySource=self.SOURCE,
+            CopySourceIfMatch='"fake-etag"', ContentType='application/json', Metadata={'origin': 'fake'},
+            MetadataDirective='REPLACE',
+        )
+
+    @patch('krux_boto.s3.time')
+    def test_small_object_timing(self, mock_time):
+        """
+        S3MultipartCopier times the CopyObject call of small objects alone
+        """
+        self.head['ContentLength'] = 100
+        now = [0]
+
+        def head_object(**kwargs):
+            now[0] += 5
+            return self.head
+
+        def copy_object(**kwargs):
+            now[0] += 1
+            return {'CopyObjectResult': {'ETag': '"copy-etag"'}}
+
+        mock_time.time.side_effect = lambda: now[0]
+        self.source_client.head_object.side_effect = head_object
+        self.destination_client.copy_object.side_effect = copy_object
+
+        result = self._copy()
+
+        self.assertEqual([1], result.part_timings)
+        self.assertEqual(6, result.elapsed)
+
+    def test_multipart(self):
+        """
+        S3MultipartCopier copies large objects in parts, keeping their headers and tags
+        """
+        result = self._copy()
+
+        self.destination_client.create_multipart_upload.assert_called_once_with(
+            Bucket='destination-bucket', Key='destination/key', ContentType='text/csv', Metadata={'origin': 'fake'},
+            Tagging='team=data&note=a+b', StorageClass='STANDARD_IA',
+        )
+        ranges = sorted(
+            (c[1]['PartNumber'], c[1]['CopySourceRange']) for c in self.destination_client.upload_part_copy.call_args_list
+        )
+        self.assertEqual([
+            (1, 'bytes=0-{0}'.format(MIN_PART_SIZE - 1)),
+            (2, 'bytes={0}-{1}'.format(MIN_PART_SIZE, MIN_PART_SIZE * 2 - 1)),
+            (3, 'bytes={0}-{1}'.format(MIN_PART_SIZE * 2, MIN_PART_SIZE * 2 + 99)),
+        ], ranges)
+        self.destination_client.upload_part_copy.assert_any_call(
+            Bucket='destination-bucket', Key='destination/key', UploadId='fake-upload-id', PartNumber=1,
+            CopySource=self.SOURCE, CopySourceRange='bytes=0-{0}'.format(MIN_PART_SIZE - 1),
+            CopySourceIfMatch='"fake-etag"',
+        )
+        self.destination_client.complete_multipart_upload.assert_called_once_with(
+            Bucket='destination-bucket',
+            Key='destination/key',
+            UploadId='fake-upload-id',
+            MultipartUpload={'Parts': [{'PartNumber': n, 'ETag': '"etag-{0}"'.format(n)} for n in (1, 2, 3)]},
+        )
+        self.assertEqual(('"multipart-etag"', MIN_PART_SIZE * 2 + 100, 3), result[:3])
+        self.assertEqual(3, len(result.part_timings))
+        self.assertEqual(3, len([c for c in self.stats.timing.call_args_list if c[0][0] == 's3.copy_part']))
+
+    def test_abort_on_error(self):
+        """
+        S3MultipartCopier aborts the multipart upload when a part fails
+        """
+        self.destination_client.upload_part_copy.side_effect = RuntimeError('fake failure')
+
+        with self.assertRaises(RuntimeError):
+            self._copy()
+
+        self.destination_client.abort_multipart_upload.assert_called_once_with(
+            Bucket='destination-bucket', Key='destination/key', UploadId='fake-upload-id',
+        )
+        self.assertFalse(self.destination_client.complete_multipart_upload.called)
+
+        # A failure to abort does not replace the error of the copy
+        self.destination_client.abort_multipart_upload.side_effect = RuntimeError('fake abort failure')
+        with self.assertRaisesRegex(RuntimeError, '^fake failure$'):
+            self._copy()
+
+    def test_max_parts(self):
+        """
+        S3MultipartCopier raises the part size of objects that would need more parts than S3 allows
+        """
+        self.head['ContentLength'] = MIN_PART_SIZE * (MAX_PARTS + 1)
+
+        result = self._copy()
+
+        self.assertEqual(MAX_PARTS, result.parts)
+
+
+class BucketRegionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.client.head_bucket.side_effect = lambda Bucket: self._response('eu-west-1')
+
+    def _response(self, region):
+        return {'ResponseMetadata': {'HTTPStatusCode': 200, 'HTTPHeaders': {'x-amz-bucket-region': region}}}
+
+    def _error(self, code, status_code, headers):
+        return ClientError(
+            {'Error': {'Code': code, 'Message': ''}, 'ResponseMetadata': {'HTTPStatusCode': status_code, 'HTTPHeaders': headers}},
+            'HeadBucket',
+        )
+
+    def test_get_region(self):
+        """
+        BucketRegionCache reads the region of a bucket from HeadBucket once, and remembers it
+        """
+        cache = BucketRegionCache(self.client, logger=MagicMock())
+
+        self.assertEqual('eu-west-1', cache.get_region('fake-bucket'))
+        self.assertEqual('eu-west-1', cache.get_region('fake-bucket'))
+
+        self.client.head_bucket.assert_called_once_with(Bucket='fake-bucket')
+
+    def test_denied(self):
+        """
+        BucketRegionCache reads the region of buckets it may not access from the error, and raises for missing ones
+        """
+        errors = {
+            'denied-bucket': self._error('403', 403, {'x-amz-bucket-region': 'ap-south-1'}),
+            'missing-bucket': self._error('404', 404, {}),
+        }
+
+        def head_bucket(Bucket):
+            raise errors[Bucket]
+
+        self.client.head_bucket.side_effect = head_bucket
+        cache = BucketRegionCache(self.client, logger=MagicMock())
+
+        self.assertEqual('ap-south-1', cache.get_region('denied-bucket'))
+        with self.assertRaises(ClientError):
+            cache.get_region('missing-bucket')
+
+    @patch('krux_boto.s3.time')
+    def test_ttl(self, mock_time):
+        """
+        BucketRegionCache finds out the region again once it expired, or was invalidated
+        """
+        mock_time.time.return_value = 1000
+        cache = BucketRegionCache(self.client, ttl=60, logger=MagicMock())
+        cache.get_region('fake-bucket')
+
+        mock_time.time.return_value = 1059
+        cache.get_region('fake-bucket')
+        self.assertEqual(1, self.client.head_bucket.call_count)
+
+        mock_time.time.return_value = 1060
+        cache.get_region('fake-bucket')
+        self.assertEqual(2, self.client.head_bucket.call_count)
+
+        cache.invalidate('fake-bucket')
+        cache.get_region('fake-bucket')
+        self.assertEqual(3, self.client.head_bucket.call_count)
+
+    def test_cache_path(self):
+        """
+        BucketRegionCache shares the regions it found out through its file
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cache_path = os.path.join(directory, 'cache', 'bucket-regions.json')
+
+        BucketRegionCache(self.client, cache_path=cache_path, logger=MagicMock()).get_region('first-bucket')
+        other = BucketRegionCache(MagicMock(), cache_path=cache_path, logger=MagicMock())
+        BucketRegionCache(self.client, cache_path=cache_path, logger=MagicMock()).get_region('second-bucket')
+
+        self.assertEqual('eu-west-1', other.get_region('first-bucket'))
+        self.assertFalse(other._client.head_bucket.called)
+
+        # Regions found out by other objects are kept
+        third = BucketRegionCache(MagicMock(), cache_path=cache_path, logger=MagicMock())
+        self.assertEqual('eu-west-1', third.get_region('second-bucket'))
+        self.assertFalse(third._client.head_bucket.called)
+
+    def test_concurrent(self):
+        """
+        BucketRegionCache sends a single HeadBucket for concurrent lookups of the same bucket
+        """
+        called = threading.Event()
+        release = threading.Event()
+
+        def head_bucket(Bucket):
+            called.set()
+            release.wait(5)
+            return self._response('eu-west-1')
+
+        self.client.head_bucket.side_effect = head_bucket
+        cache = BucketRegionCache(self.client, logger=MagicMock())
+        regions = []
+        threads = [threading.Thread(target=lambda: regions.append(cache.get_region('fake-bucket'))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        called.wait(5)
+        threading.Event().wait(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(['eu-west-1'] * 5, regions)
+        self.client.head_bucket.assert_called_once_with(Bucket='fake-bucket')
+
+    def test_concurrent_failure(self):
+        """
+        BucketRegionCache raises the error of a concurrent lookup to every thread waiting for it, and tries again later
+        """
+        called = threading.Event()
+        release = threading.Event()
+
+        def head_bucket(Bucket):
+            called.set()
+            release.wait(5)
+            raise self._error('404', 404, {})
+
+        self.client.head_bucket.side_effect = head_bucket
+        cache = BucketRegionCache(self.client, logger=MagicMock())
+        errors = []
+
+        def get_region():
+            try:
+                cache.get_region('fake-bucket')
+            except ClientError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=get_region) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        called.wait(5)
+        threading.Event().wait(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(3, len(errors))
+        self.assertEqual(1, self.client.head_bucket.call_count)
+
+        with self.assertRaises(ClientError):
+            cache.get_region('fake-bucket')
+        self.assertEqual(2, self.client.head_bucket.call_count)
+
+    def test_save_unlocked(self):
+        """
+        BucketRegionCache writes its file without holding its lock
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cache = BucketRegionCache(self.client, cache_path=os.path.join(directory, 'regions.json'), logger=MagicMock())
+        write = cache._write
+        locked = []
+
+        def record_lock(*args):
+            locked.append(cache._lock.locked())
+            return write(*args)
+
+        cache._write = record_lock
+        cache.get_region('fake-bucket')
+        cache.invalidate('fake-bucket')
+
+        self.assertEqual([False, False], locked)
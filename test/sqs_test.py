@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, division, print_function
+import threading
+import time
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import MagicMock
+
+#
+# Internal libraries
+#
+
+from krux_boto.sqs import SQSConsumer, MAX_BATCH_SIZE
+
+
+class FakeSQSClient(object):
+    """
+    A minimal in-memory stand-in for the parts of the SQS client the consumer uses.
+    """
+
+    def __init__(self, count):
+        self.messages = [
+            {'MessageId': str(i), 'ReceiptHandle': 'handle-{0}'.format(i), 'Body': 'body-{0}'.format(i)}
+            for i in range(count)
+        ]
+        self.max_received = 0
+        self._lock = threading.Lock()
+
+        self.receive_message = MagicMock(side_effect=self._receive_message)
+        self.delete_message_batch = MagicMock(return_value={'Successful': [], 'Failed': []})
+        self.change_message_visibility_batch = MagicMock(return_value={'Successful': [], 'Failed': []})
+
+    def _receive_message(self, QueueUrl, MaxNumberOfMessages, **kwargs):
+        with self._lock:
+            messages, self.messages = self.messages[:MaxNumberOfMessages], self.messages[MaxNumberOfMessages:]
+            self.max_received = max(self.max_received, MaxNumberOfMessages)
+        if not messages:
+            # Stands in for the long poll
+            time.sleep(0.01)
+        return {'Messages': messages}
+
+    def deleted(self):
+        return sorted(
+            entry['ReceiptHandle']
+            for args in self.delete_message_batch.call_args_list
+            for entry in args[1]['Entries']
+        )
+
+
+class SQSConsumerTest(unittest.TestCase):
+    QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/123456789012/fake-queue'
+
+    def _wait_until(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_consume(self):
+        """
+        SQSConsumer handles every message and deletes them in batches
+        """
+        client = FakeSQSClient(25)
+        handled = []
+        stats = MagicMock()
+
+        with SQSConsumer(client, self.QUEUE_URL, handled.append, receivers=2, workers=4, stats=stats):
+            self._wait_until(lambda: len(handled) == 25)
+
+        self.assertEqual(sorted('handle-{0}'.format(i) for i in range(25)), client.deleted())
+        for args in client.delete_message_batch.call_args_list:
+            self.assertLessEqual(len(args[1]['Entries']), MAX_BATCH_SIZE)
+
+        timings = set(args[0][0] for args in stats.timing.call_args_list)
+        self.assertEqual(set(['sqs.receive', 'sqs.process', 'sqs.delete']), timings)
+
+    def test_handler_error(self):
+        """
+        SQSConsumer does not delete the messages whose handler raises
+        """
+        client = FakeSQSClient(4)
+        handled = []
+
+        def handler(message):
+            handled.append(message)
+            if message['MessageId'] == '2':
+                raise RuntimeError('fake failure')
+
+        with SQSConsumer(client, self.QUEUE_URL, handler, logger=MagicMock()):
+            self._wait_until(lambda: len(handled) == 4)
+
+        self.assertEqual(['handle-0', 'handle-1', 'handle-3'], client.deleted())
+
+    def test_backpressure(self):
+        """
+        SQSConsumer never receives more messages than it has free workers
+        """
+        client = FakeSQSClient(20)
+        release = threading.Event()
+        handled = []
+
+        def handler(message):
+            release.wait()
+            handled.append(message)
+
+        consumer = SQSConsumer(client, self.QUEUE_URL, handler, receivers=3, workers=3)
+        consumer.start()
+        try:
+            self._wait_until(lambda: len(client.messages) == 17)
+            time.sleep(0.05)
+            # All the workers are busy, so nothing more is received
+            self.assertEqual(17, len(client.messages))
+            self.assertLessEqual(client.max_received, 3)
+        finally:
+            release.set()
+            self._wait_until(lambda: len(handled) == 20)
+            consumer.stop()
+
+    def test_extend_visibility(self):
+        """
+        SQSConsumer extends the visibility of the messages still being handled
+        """
+        client = FakeSQSClient(1)
+        release = threading.Event()
+
+        consumer = SQSConsumer(client, self.QUEUE_URL, lambda message: release.wait(), visibility_timeout=0.2)
+        consumer.start()
+        try:
+            self._wait_until(lambda: client.change_message_visibility_batch.called)
+        finally:
+            release.set()
+            consumer.stop()
+
+        entries = client.change_message_visibility_batch.call_args[1]['Entries']
+        self.assertEqual([{'Id': '0', 'ReceiptHandle': 'handle-0', 'VisibilityTimeout': 0.2}], entries)
+
+    def test_extend_visibility_stopping(self):
+        """
+        SQSConsumer keeps extending the visibility of the messages being handled while it stops
+        """
+        client = FakeSQSClient(1)
+        started = threading.Event()
+        release = threading.Event()
+
+        def handler(message):
+            started.set()
+            release.wait(5)
+
+        consumer = SQSConsumer(client, self.QUEUE_URL, handler, visibility_timeout=0.2)
+        consumer.start()
+        started.wait(5)
+        thread = threading.Thread(target=consumer.stop)
+        thread.start()
+        try:
+            self._wait_until(lambda: client.change_message_visibility_batch.called)
+        finally:
+            release.set()
+            thread.join()
+
+        self.assertEqual(['handle-0'], client.deleted())
+
+    def test_stop_not_started(self):
+        """
+        SQSConsumer does nothing when stopped before being started
+        """
+        SQSConsumer(FakeSQSClient(1), self.QUEUE_URL, MagicMock()).stop()
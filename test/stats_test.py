@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+#
+# © 2015-2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, division, print_function
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import MagicMock, patch
+
+#
+# Internal libraries
+#
+
+from krux_boto.stats import CloudWatchStatsClient
+
+
+class CloudWatchStatsClientTest(unittest.TestCase):
+    NAMESPACE = 'FakeNamespace'
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.stats = CloudWatchStatsClient(
+            self.client,
+            self.NAMESPACE,
+            prefix='app',
+            dimensions={'Environment': 'test'},
+            flush_interval=None,
+        )
+
+    def _sent_metrics(self):
+        metrics = {}
+        for args in self.client.put_metric_data.call_args_list:
+            self.assertEqual(self.NAMESPACE, args[1]['Namespace'])
+            for datum in args[1]['MetricData']:
+                metrics[datum['MetricName']] = datum
+        return metrics
+
+    def test_aggregation(self):
+        """
+        CloudWatchStatsClient aggregates the stats and sends them in one call per flush
+        """
+        self.stats.incr('requests')
+        self.stats.incr('requests', 4)
+        self.stats.decr('requests')
+        self.stats.gauge('queue', 10)
+        self.stats.gauge('queue', 3)
+        self.stats.gauge('queue', 2, delta=True)
+        self.stats.set('users', 'alice')
+        self.stats.set('users', 'bob')
+        self.stats.set('users', 'alice')
+        self.stats.timing('latency', 10)
+        self.stats.timing('latency', 30)
+        self.stats.timing('latency', 20)
+
+        self.assertFalse(self.client.put_metric_data.called)
+        self.stats.flush()
+        self.assertEqual(1, self.client.put_metric_data.call_count)
+
+        metrics = self._sent_metrics()
+        self.assertEqual(4, metrics['app.requests']['Value'])
+        self.assertEqual('Count', metrics['app.requests']['Unit'])
+        self.assertEqual(5, metrics['app.queue']['Value'])
+        self.assertEqual(2, metrics['app.users']['Value'])
+        self.assertEqual(
+            {'SampleCount': 3, 'Sum': 60, 'Minimum': 10, 'Maximum': 30},
+            metrics['app.latency']['StatisticValues'],
+        )
+        self.assertEqual('Milliseconds', metrics['app.latency']['Unit'])
+        self.assertEqual([{'Name': 'Environment', 'Value': 'test'}], metrics['app.latency']['Dimensions'])
+
+        # The buffers are emptied by the flush, except for the gauges
+        self.client.put_metric_data.reset_mock()
+        self.stats.flush()
+        self.assertEqual(['app.queue'], list(self._sent_metrics()))
+
+    def test_timer(self):
+        """
+        CloudWatchStatsClient.timer() records a timing as a context manager and a decorator
+        """
+        with self.stats.timer('block'):
+            pass
+
+        @self.stats.timer('function')
+        def function():
+            return 'result'
+
+        self.assertEqual('result', function())
+        self.assertEqual('result', function())
+
+        self.stats.flush()
+        metrics = self._sent_metrics()
+        self.assertEqual(1, metrics['app.block']['StatisticValues']['SampleCount'])
+        self.assertEqual(2, metrics['app.function']['StatisticValues']['SampleCount'])
+
+    def test_gauges_kept(self):
+        """
+        CloudWatchStatsClient keeps the gauges across flushes
+        """
+        self.stats.gauge('queue', 10)
+        self.stats.flush()
+        self.client.put_metric_data.reset_mock()
+
+        self.stats.gauge('workers', 1)
+        self.stats.flush()
+        self.assertEqual(10, self._sent_metrics()['app.queue']['Value'])
+
+        self.stats.gauge('queue', -3, delta=True)
+        self.stats.flush()
+        self.assertEqual(7, self._sent_metrics()['app.queue']['Value'])
+
+    def test_batches(self):
+        """
+        CloudWatchStatsClient splits the metrics into batches of at most batch_size
+        """
+        stats = CloudWatchStatsClient(self.client, self.NAMESPACE, flush_interval=None, batch_size=2)
+        for i in range(5):
+            stats.incr('counter.{0}'.format(i))
+
+        stats.flush()
+
+        self.assertEqual([2, 2, 1], [len(args[1]['MetricData']) for args in self.client.put_metric_data.call_args_list])
+
+    def test_drop_accounting(self):
+        """
+        CloudWatchStatsClient drops new metrics when the buffer is full and batches that fail to send
+        """
+        stats = CloudWatchStatsClient(self.client, self.NAMESPACE, flush_interval=None, max_metrics=2)
+        stats.incr('a')
+        stats.incr('b')
+        stats.incr('c')
+        # Metrics already in the buffer are still updated
+        stats.incr('a')
+        self.assertEqual(1, stats.dropped)
+
+        self.client.put_metric_data.side_effect = RuntimeError('fake failure')
+        stats.flush()
+        self.assertEqual(3, stats.dropped)
+
+    def test_close(self):
+        """
+        CloudWatchStatsClient.close() stops the background thread and sends the remaining stats
+        """
+        stats = CloudWatchStatsClient(self.client, self.NAMESPACE, flush_interval=3600)
+        stats.incr('counter')
+
+        stats.close()
+
+        self.assertFalse(stats._thread.is_alive())
+        self.assertEqual(1, self.client.put_metric_data.call_count)
+
+        # Closing twice does nothing
+        stats.close()
+        self.assertEqual(1, self.client.put_metric_data.call_count)
+
+    @patch('krux_boto.stats.atexit')
+    def test_close_unregisters(self, mock_atexit):
+        """
+        CloudWatchStatsClient.close() stops being called at exit
+        """
+        stats = CloudWatchStatsClient(self.client, self.NAMESPACE, flush_interval=3600)
+        mock_atexit.register.assert_called_once_with(stats.close)
+
+        stats.close()
+
+        mock_atexit.unregister.assert_called_once_with(stats.close)
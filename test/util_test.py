@@ -9,6 +9,14 @@
 
 from __future__ import absolute_import, division, print_function
 from builtins import str
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
 import unittest
 from logging import Logger
 
@@ -23,7 +31,154 @@ from six import iteritems
 # Internal libraries
 #
 
-from krux_boto.util import RegionCode, get_instance_region, Error, setup_hosts
+from krux_boto.util import RegionCode, get_instance_region, Error, setup_hosts, InstanceMetadata, write_json
+
+
+class FakeMetadataHandler(BaseHTTPRequestHandler):
+    """
+    A local stand-in for the EC2 instance metadata service, speaking IMDSv2.
+    """
+    # Keep-alive, so the connection reuse can be verified
+    protocol_version = 'HTTP/1.1'
+
+    def do_PUT(self):
+        server = self.server
+        server.token_requests += 1
+        if server.token is not None:
+            self._respond(200, server.token)
+        elif server.put_delay:
+            # Never answer, like the service beyond the hop limit of the token
+            time.sleep(server.put_delay)
+        else:
+            self._respond(403, '')
+
+    def do_GET(self):
+        server = self.server
+        server.client_ports.add(self.client_address[1])
+
+        # An IMDSv1 service, without a token, accepts any request
+        if server.token is not None and self.headers.get('X-aws-ec2-metadata-token') != server.token:
+            self._respond(401, '')
+            return
+
+        path = self.path[len('/latest/meta-data/'):]
+        if path in server.metadata:
+            self._respond(200, server.metadata[path])
+        else:
+            self._respond(404, '')
+
+    def _respond(self, status, body):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class InstanceMetadataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeMetadataHandler)
+        self.server.daemon_threads = True
+        self.server.token = 'fake-token'
+        self.server.token_requests = 0
+        self.server.put_delay = None
+        self.server.client_ports = set()
+        self.server.metadata = {
+            'instance-id': 'i-0123456789abcdef0',
+            'placement/availability-zone': 'us-east-1a',
+            'iam/security-credentials/': 'fake-role',
+        }
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.metadata = InstanceMetadata(host='127.0.0.1', port=self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_lookups(self):
+        """
+        InstanceMetadata returns the requested metadata
+        """
+        self.assertEqual('i-0123456789abcdef0', self.metadata.instance_id())
+        self.assertEqual('us-east-1a', self.metadata.availability_zone())
+        self.assertEqual('us-east-1', self.metadata.region())
+        self.assertEqual('fake-role', self.metadata.iam_role())
+        self.assertIsNone(self.metadata.get('does-not-exist'))
+
+    def test_token_and_connection_reuse(self):
+        """
+        InstanceMetadata reuses the IMDSv2 token and the connection across requests
+        """
+        for _ in range(3):
+            self.metadata.instance_id()
+
+        self.assertEqual(1, self.server.token_requests)
+        self.assertEqual(1, len(self.server.client_ports))
+
+    def test_token_refresh(self):
+        """
+        InstanceMetadata gets a new token when the service rejects the cached one
+        """
+        self.metadata.instance_id()
+        self.server.token = 'new-fake-token'
+
+        self.assertEqual('i-0123456789abcdef0', self.metadata.instance_id())
+        self.assertEqual(2, self.server.token_requests)
+
+    def test_imdsv1(self):
+        """
+        InstanceMetadata falls back to IMDSv1 when the service hands out no token, and remembers it
+        """
+        self.server.token = None
+
+        for _ in range(3):
+            self.assertEqual('i-0123456789abcdef0', self.metadata.instance_id())
+
+        self.assertEqual(1, self.server.token_requests)
+
+    def test_imdsv1_token_timeout(self):
+        """
+        InstanceMetadata falls back to IMDSv1 when the token request is never answered
+        """
+        self.server.token = None
+        self.server.put_delay = 1
+        metadata = InstanceMetadata(host='127.0.0.1', port=self.server.server_address[1], timeout=0.2)
+
+        for _ in range(2):
+            self.assertEqual('i-0123456789abcdef0', metadata.instance_id())
+
+        self.assertEqual(1, self.server.token_requests)
+
+    def test_imdsv2_required(self):
+        """
+        InstanceMetadata asks for a token again when the service requires one after all
+        """
+        self.server.token = None
+        self.metadata.instance_id()
+        self.server.token = 'fake-token'
+
+        self.assertEqual('i-0123456789abcdef0', self.metadata.instance_id())
+        self.assertEqual(2, self.server.token_requests)
+
+    def test_unreachable(self):
+        """
+        InstanceMetadata raises an error when the service cannot be contacted
+        """
+        # Find a port nothing is listening on
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        with self.assertRaises(Error):
+            InstanceMetadata(host='127.0.0.1', port=port).instance_id()
 
 
 class UtilTest(unittest.TestCase):
@@ -34,17 +189,13 @@ class UtilTest(unittest.TestCase):
         """
         # Mocking the logger to check for calls later
         mock_logger = MagicMock(spec=Logger, autospec=True)
-        # Mocking the metadata returned by boto
-        mock_metadata = {
-            'placement': {
-                'availability-zone': 'us-east-1a',
-            },
-        }
+        # Mocking the metadata client
+        mock_metadata = MagicMock(spec=InstanceMetadata)
+        mock_metadata.region.return_value = 'us-east-1'
 
         # get_logger function returns the mocked logger
         with patch('krux_boto.util.get_logger', return_value=mock_logger):
-            # get_instance_metadata returns a mock dictionary created above
-            with patch('krux_boto.util.boto.utils.get_instance_metadata', return_value=mock_metadata):
+            with patch('krux_boto.util.get_instance_metadata', return_value=mock_metadata):
                 self.assertEquals('us-east-1', get_instance_region())
 
         # Verify no warning is thrown
@@ -52,17 +203,17 @@ class UtilTest(unittest.TestCase):
 
     def test_get_instance_region_failure(self):
         """
-        get_instance_region fails when no region is returned
+        get_instance_region fails when the metadata service cannot be contacted
         """
         # Mocking the logger to check for calls later
         mock_logger = MagicMock(spec=Logger, autospec=True)
-        # Mocking the metadata returned by boto
-        mock_metadata = {}
+        # Mocking the metadata client
+        mock_metadata = MagicMock(spec=InstanceMetadata)
+        mock_metadata.region.side_effect = Error('fake failure')
 
         # get_logger function returns the mocked logger
         with patch('krux_boto.util.get_logger', return_value=mock_logger):
-            # get_instance_metadata returns a mock dictionary created above
-            with patch('krux_boto.util.boto.utils.get_instance_metadata', return_value=mock_metadata):
+            with patch('krux_boto.util.get_instance_metadata', return_value=mock_metadata):
                 # Verify an error is thrown
                 with self.assertRaises(Error):
                     get_instance_region()
@@ -113,6 +264,26 @@ class UtilTest(unittest.TestCase):
         mock_appended_hosts = [s + '.' + default_domain for s in mock_host_list_without] + mock_host_list_with
         appended_hosts = setup_hosts(mock_host_list_without + mock_host_list_with, accepted_hosts, default_domain)
         self.assertEquals(mock_appended_hosts, appended_hosts)
+    def test_write_json(self):
+        """
+        write_json creates the directory of the file, and concurrent writers never mix their data
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'cache', 'fake.json')
+        datas = [{'writer': i, 'values': list(range(10000))} for i in range(8)]
+
+        threads = [threading.Thread(target=write_json, args=(path, data)) for data in datas]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with open(path, 'r') as f:
+            self.assertIn(json.load(f), datas)
+        # No temporary file is left behind
+        self.assertEqual(['fake.json'], os.listdir(os.path.dirname(path)))
+
 
 class RegionCodeTest(unittest.TestCase):
     REGIONS = {